@@ -0,0 +1,558 @@
+# bench_hedwig.py
+"""
+Offline benchmarks for hedwig_bot.py hot paths.
+
+Runs the real command callbacks against in-process stand-ins for discord.py's
+Member / Guild / Role / TextChannel, so no token or live server is needed.
+For each scenario and member count it reports:
+
+  * p50 / p99 command latency
+  * simulated Discord REST calls (total and per route)
+  * event-loop blocking time (lag seen by a 1 ms probe task)
+  * bytes the persistence layer wrote to disk
+
+Usage:
+    python bench_hedwig.py                          # 1k, 10k and 100k members
+    python bench_hedwig.py --members 1000 --iterations 50
+    python bench_hedwig.py --scenario cast --scenario pay --output bench_output.txt
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# Point persistence at a scratch directory *before* importing the bot.
+_ORIGINAL_CWD = os.getcwd()
+_SCRATCH = tempfile.mkdtemp(prefix="hedwig-bench-")
+os.environ.setdefault("HEDWIG_DATA_DIR", _SCRATCH)
+os.chdir(_SCRATCH)  # keep any relative-path writes inside the scratch dir
+
+import hedwig_bot as hb  # noqa: E402
+
+OWNER_ID = 1
+
+
+# -------------------------
+# FAKE DISCORD OBJECTS
+# -------------------------
+class FakeRest:
+    """Counts the REST calls the bot would have made, by route."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def call(self, route: str):
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+
+    def reset(self):
+        self.calls.clear()
+
+
+class FakeRole:
+    def __init__(self, role_id: int, name: str):
+        self.id = role_id
+        self.name = name
+        self.guild = None
+
+    @property
+    def members(self):
+        return [m for m in self.guild.members if self in m.roles]
+
+    @property
+    def mention(self):
+        return f"<@&{self.id}>"
+
+    def __repr__(self):
+        return f"<FakeRole {self.name}>"
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None):
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.id = random.getrandbits(63)
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        await self.channel.rest.call("PATCH /channels/{channel_id}/messages/{message_id}")
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+        return self
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id: int, name: str, guild, rest: FakeRest):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.rest = rest
+        self.sent = 0
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        await self.rest.call("POST /channels/{channel_id}/messages")
+        self.sent += 1
+        return FakeMessage(self, content, embed)
+
+    async def purge(self, limit=100, **kwargs):
+        await self.rest.call("POST /channels/{channel_id}/messages/bulk-delete")
+        return []
+
+
+class FakeMember:
+    bot = False
+
+    def __init__(self, user_id: int, name: str, guild, rest: FakeRest):
+        self.id = user_id
+        self.name = name
+        self.global_name = None
+        self.nick = None
+        self.guild = guild
+        self.roles = []
+        self._rest = rest
+
+    @property
+    def display_name(self):
+        return self.nick or self.global_name or self.name
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    async def add_roles(self, *roles, **kwargs):
+        for role in roles:
+            await self._rest.call("PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, **kwargs):
+        for role in roles:
+            await self._rest.call("DELETE /guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+            if role in self.roles:
+                self.roles.remove(role)
+
+    async def edit(self, **kwargs):
+        await self._rest.call("PATCH /guilds/{guild_id}/members/{user_id}")
+        if "nick" in kwargs:
+            self.nick = kwargs["nick"]
+        if "roles" in kwargs:
+            self.roles = list(kwargs["roles"])
+        return self
+
+    async def send(self, content=None, **kwargs):
+        await self._rest.call("POST /channels/{channel_id}/messages")
+
+    def __eq__(self, other):
+        return isinstance(other, FakeMember) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<FakeMember {self.id}>"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, rest: FakeRest):
+        self.id = guild_id
+        self.owner_id = OWNER_ID
+        self.rest = rest
+        self._members = {}
+        self._roles = {}
+        self._channels = {}
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def roles(self):
+        return list(self._roles.values())
+
+    @property
+    def channels(self):
+        return list(self._channels.values())
+
+    def get_member(self, user_id):
+        return self._members.get(user_id)
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def add_role(self, role: FakeRole):
+        role.guild = self
+        self._roles[role.id] = role
+
+    def add_member(self, member: FakeMember):
+        self._members[member.id] = member
+
+    def add_channel(self, channel: FakeTextChannel):
+        self._channels[channel.id] = channel
+
+    async def query_members(self, user_ids=None, limit=5, **kwargs):
+        await self.rest.call("GATEWAY request_guild_members")
+        return [self._members[uid] for uid in (user_ids or []) if uid in self._members]
+
+
+class FakeUser:
+    id = 42
+    name = "Hedwig"
+    mention = "<@42>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeBot:
+    """Just the parts of commands.Bot the command bodies touch."""
+
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.user = FakeUser()
+
+    @property
+    def guilds(self):
+        return [self.guild]
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    def get_channel(self, channel_id):
+        return self.guild.get_channel(channel_id)
+
+    def get_user(self, user_id):
+        return self.guild.get_member(user_id)
+
+
+class FakeContext:
+    def __init__(self, author: FakeMember, channel: FakeTextChannel):
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.bot = hb.bot
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+# -------------------------
+# LOOP LAG PROBE
+# -------------------------
+class LoopLagProbe:
+    """Sleeps in short ticks and records how late each wake-up is."""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.total = 0.0
+        self.worst = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            if lag > 0:
+                self.total += lag
+                self.worst = max(self.worst, lag)
+
+    def start(self):
+        self.total = self.worst = 0.0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+# -------------------------
+# WORLD SETUP
+# -------------------------
+HOUSES = ("gryffindor", "slytherin", "ravenclaw", "hufflepuff")
+
+
+class World:
+    """A synthetic guild with `size` members wired into hedwig_bot's globals."""
+
+    def __init__(self, size: int, rest_latency: float):
+        self.size = size
+        self.rest = FakeRest(rest_latency)
+        self.guild = FakeGuild(hb.GUILD_ID, self.rest)
+
+        for name, role_id in hb.ROLE_IDS.items():
+            label = hb.ALOHOMORA_ROLE_NAME if name == "alohomora" else name.capitalize()
+            self.guild.add_role(FakeRole(role_id, label))
+        for channel_id, name in (
+            (hb.OWLRY_CHANNEL_ID, "owlry"),
+            (hb.ROOM_OF_REQUIREMENT_ID, "room-of-requirement"),
+            (hb.GRINGOTTS_CHANNEL_ID, "gringotts"),
+            (hb.DUELING_CLUB_ID, "dueling-club"),
+        ):
+            self.guild.add_channel(FakeTextChannel(channel_id, name, self.guild, self.rest))
+
+        house_roles = [self.guild.get_role(hb.ROLE_IDS[h]) for h in HOUSES]
+        for i in range(size):
+            user_id = 10_000 + i
+            m = FakeMember(user_id, f"wizard{i:06d}", self.guild, self.rest)
+            m.roles.append(house_roles[i % len(house_roles)])
+            self.guild.add_member(m)
+        self.member_ids = [m.id for m in self.guild.members]
+
+        self._reset_bot_state()
+
+    def _reset_bot_state(self):
+        hb.bot = FakeBot(self.guild)
+        # pacing would only add idle wall time; the REST counts are what matter here
+        hb.MEMBER_EDIT_RATE = hb.MEMBER_EDIT_BURST = 1_000_000
+        hb.member_edit_buckets.clear()
+        hb.OUTBOX_SEND_RATE = hb.OUTBOX_SEND_BURST = 1_000_000
+        hb.outboxes.clear()
+        hb.sequence_messages.clear()
+        hb.scheduler = hb.DeadlineScheduler()  # never started: timers just queue up
+        hb.member_resolver = hb.MemberResolver()
+        hb.member_resolver.index_guild(self.guild)
+        hb.rebuild_role_index(self.guild)
+        hb.current_room_user = None
+        hb.startup_state.update(core_loaded=True, effects_loaded=True, display_ready=True)
+        for state in (
+            hb.active_effects, hb.effects, hb.active_potions, hb.last_daily,
+            hb.alohomora_cooldowns, hb.reminders, hb.duel_cooldowns, hb.duels, hb.duel_by_challenged,
+            hb.pending_display, hb.last_pushed_nicks, hb.dirty_keys, hb.effects_hydrated,
+        ):
+            state.clear()
+        hb.galleons.clear()
+        hb.galleons.update({uid: 10_000 for uid in self.member_ids})
+        hb.galleon_ranking.rebuild(hb.galleons)
+
+    def member(self, i: int) -> FakeMember:
+        return self.guild.get_member(self.member_ids[i % self.size])
+
+    def ctx(self, author: FakeMember, channel_id: int) -> FakeContext:
+        return FakeContext(author, self.guild.get_channel(channel_id))
+
+
+def _flushes_in_flight():
+    return [t for t in asyncio.all_tasks() if t.get_coro().__name__ == "flush_member_display" and not t.done()]
+
+
+async def drain_display_queue():
+    """Wait for debounced role/nickname batches and queued messages to hit the fake REST layer."""
+    while hb.pending_display:
+        await asyncio.sleep(hb.DISPLAY_DEBOUNCE_SECONDS / 2)
+    # batches already popped may still be waiting on the guild's edit bucket
+    while _flushes_in_flight():
+        await asyncio.sleep(0.01)
+    await hb.drain_outboxes()
+
+
+# -------------------------
+# SCENARIOS
+# -------------------------
+# Each scenario is (setup, op): setup(world, i) runs untimed and returns the
+# arguments op(world, i, *args) needs; only op is timed.
+
+def _no_setup(world, i):
+    return ()
+
+
+async def op_cast(world, i):
+    spell = ("incendio", "lumos", "aguamenti", "finite")[i % 4]
+    caster, target = world.member(i), world.member(i // 4)
+    await hb.cast.callback(world.ctx(caster, hb.DUELING_CLUB_ID), spell, target)
+
+
+def setup_cast_alohomora(world, i):
+    hb.current_room_user = None
+    hb.alohomora_cooldowns.clear()
+    return ()
+
+
+async def op_cast_alohomora(world, i):
+    caster, target = world.member(i), world.member(i + 1)
+    await hb.cast.callback(world.ctx(caster, hb.DUELING_CLUB_ID), "alohomora", target)
+
+
+async def op_drink(world, i):
+    potion = ("felixfelicis", "amortentia", "polyjuice", "bezoar")[i % 4]
+    caster, target = world.member(i), world.member(i // 4)
+    await hb.drink.callback(world.ctx(caster, hb.DUELING_CLUB_ID), potion, target)
+
+
+async def op_daily(world, i):
+    await hb.daily.callback(world.ctx(world.member(i), hb.GRINGOTTS_CHANNEL_ID))
+
+
+async def op_pay(world, i):
+    payer, payee = world.member(i), world.member(i * 7 + 3)
+    await hb.pay.callback(world.ctx(payer, hb.GRINGOTTS_CHANNEL_ID), payee, 5)
+
+
+def setup_choose(world, i):
+    player = world.member(i)
+    hb.active_potions[player.id] = {"winning": hb.pick_winning_potion(), "chosen": False, "started_by": player.id}
+    return (player,)
+
+
+async def op_choose(world, i, player):
+    await hb.choose.callback(world.ctx(player, hb.ROOM_OF_REQUIREMENT_ID), random.randint(1, 5))
+
+
+async def op_leaderboard(world, i):
+    await hb.leaderboard.callback(world.ctx(world.member(i), hb.GRINGOTTS_CHANNEL_ID))
+
+
+def setup_expire_effect(world, i):
+    target = world.member(i)
+    uid = f"bench_{i}"
+    data = hb.active_effects.setdefault(target.id, {"original_nick": target.display_name, "effects": hb.EffectStack()})
+    data["effects"].add(hb.EffectInstance(
+        "incendio", hb.item_library["version"], uid,
+        definition=hb.EFFECT_LIBRARY["incendio"], source="bench",
+    ))
+    hb.effects[str(target.id)] = data
+    return (target, uid)
+
+
+async def op_expire_effect(world, i, target, uid):
+    await hb.expire_effect(target, uid)
+
+
+SCENARIOS = {
+    "cast": (_no_setup, op_cast),
+    "cast_alohomora": (setup_cast_alohomora, op_cast_alohomora),
+    "drink": (_no_setup, op_drink),
+    "daily": (_no_setup, op_daily),
+    "pay": (_no_setup, op_pay),
+    "choose": (setup_choose, op_choose),
+    "leaderboard": (_no_setup, op_leaderboard),
+    "expire_effect": (setup_expire_effect, op_expire_effect),
+}
+
+
+# -------------------------
+# RUNNER
+# -------------------------
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+async def run_scenario(world: World, name: str, iterations: int) -> dict:
+    setup, op = SCENARIOS[name]
+    await hb.load_saved_effects()  # the bot does this in the background after connecting
+    world._reset_bot_state()
+    world.rest.reset()
+    bytes_before = hb.persistence_stats["bytes_written"]
+
+    probe = LoopLagProbe()
+    probe.start()
+    latencies = []
+    for i in range(iterations):
+        args = setup(world, i)
+        started = time.perf_counter()
+        await op(world, i, *args)
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0)  # let the probe observe the loop between commands
+    await drain_display_queue()
+    await hb.persist_now()
+    await probe.stop()
+
+    calls = sum(world.rest.calls.values())
+    return {
+        "scenario": name,
+        "members": world.size,
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "rest_calls": calls,
+        "rest_per_op": calls / iterations,
+        "routes": dict(world.rest.calls),
+        "loop_blocked_ms": probe.total * 1000,
+        "worst_block_ms": probe.worst * 1000,
+        "bytes_written": hb.persistence_stats["bytes_written"] - bytes_before,
+    }
+
+
+def format_results(results) -> str:
+    header = (
+        f"{'scenario':<16}{'members':>9}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'REST':>8}{'REST/op':>9}{'blocked ms':>12}{'worst ms':>10}{'disk bytes':>12}"
+    )
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['scenario']:<16}{r['members']:>9}{r['iterations']:>6}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+            f"{r['rest_calls']:>8}{r['rest_per_op']:>9.2f}{r['loop_blocked_ms']:>12.1f}"
+            f"{r['worst_block_ms']:>10.2f}{r['bytes_written']:>12}"
+        )
+    lines.append("")
+    lines.append("REST calls by route:")
+    for r in results:
+        routes = ", ".join(f"{route} x{n}" for route, n in sorted(r["routes"].items()))
+        lines.append(f"  {r['scenario']} @ {r['members']}: {routes or '-'}")
+    return "\n".join(lines)
+
+
+async def main(args):
+    # keep the bot's own console chatter out of the report
+    quiet = open(os.devnull, "w")
+    results = []
+    for size in args.members:
+        world = World(size, args.rest_latency_ms / 1000)
+        for name in args.scenario or list(SCENARIOS):
+            real_stdout, sys.stdout = sys.stdout, quiet
+            try:
+                results.append(await run_scenario(world, name, args.iterations))
+            finally:
+                sys.stdout = real_stdout
+            r = results[-1]
+            print(f"[bench] {name} @ {size}: p50 {r['p50_ms']:.3f}ms, {r['rest_per_op']:.2f} REST/op", file=sys.stderr)
+
+    report = format_results(results)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark hedwig_bot.py against a fake Discord gateway.")
+    parser.add_argument("--members", type=int, action="append",
+                        help="synthetic guild size (repeatable; default 1000, 10000, 100000)")
+    parser.add_argument("--iterations", type=int, default=200, help="commands per scenario")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="run only these scenarios (repeatable)")
+    parser.add_argument("--rest-latency-ms", type=float, default=0.0,
+                        help="simulated latency of every REST call")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args(argv)
+    args.members = args.members or [1_000, 10_000, 100_000]
+    if args.output:
+        args.output = os.path.abspath(os.path.join(_ORIGINAL_CWD, args.output))
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,695 @@
+# fake_discord.py
+"""
+Local stand-in for Discord's gateway and REST API, for load and soak tests.
+
+It serves one synthetic school (the guild, channels and roles hedwig_bot.py is
+configured for, plus --members students), speaks enough of the gateway for
+py-cord to log in, cache the guild and receive messages, and answers the REST
+calls Hedwig makes: message send / edit / delete / purge, member edits, role
+add / remove. REST routes are rate limited per bucket the way Discord does it,
+with X-RateLimit-* headers and 429 responses, so the bot's pacing is exercised.
+
+Once the bot is connected, a traffic generator replays a mix of !cast, !drink,
+!daily, !duel (challenge, confirm, cast) and !balance as gateway
+MESSAGE_CREATE events and reports sustained throughput, REST calls per route,
+429s per bucket and approximate reply latency.
+
+Usage:
+    python fake_discord.py --members 2000 --rate 20 --duration 300
+    # in another shell, with a scratch data directory:
+    HEDWIG_DISCORD_API=http://127.0.0.1:8787 DISCORD_TOKEN=fake \\
+        HEDWIG_DATA_DIR=/tmp/hedwig-soak python hedwig_bot.py
+
+    python fake_discord.py --mix cast=60,daily=40 --rate 50 --output soak.json
+
+The bot's own /metrics endpoint (HEDWIG_METRICS_PORT) can be scraped during a
+soak run for the server-side view. Not emulated: zlib transport compression,
+session resume (a resume is refused and the bot re-identifies), interactions,
+presences and voice.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web, WSMsgType
+
+# hedwig_bot.py is imported for its ids and item names only; keep the files
+# its import creates out of the real data directory.
+_ORIGINAL_CWD = os.getcwd()
+_SCRATCH = tempfile.mkdtemp(prefix="hedwig-fake-discord-")
+os.environ["HEDWIG_DATA_DIR"] = _SCRATCH
+os.environ["HEDWIG_METRICS_PORT"] = "0"
+os.chdir(_SCRATCH)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import hedwig_bot as hb  # noqa: E402
+
+DISCORD_EPOCH_MS = 1420070400000
+BOT_USER_ID = 900_000_000_000_000_001
+STAFF_USER_ID = 900_000_000_000_000_002
+HEDWIG_ROLE_ID = 900_000_000_000_000_003
+STUDENT_ID_BASE = 910_000_000_000_000_000
+HOUSES = ("gryffindor", "slytherin", "ravenclaw", "hufflepuff")
+HISTORY_LIMIT = 5000  # recent messages per channel served to purges
+
+_seq = itertools.count()
+
+
+def snowflake() -> int:
+    ms = int(time.time() * 1000) - DISCORD_EPOCH_MS
+    return (ms << 22) | (next(_seq) & 0x3FFFFF)
+
+
+def iso_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def json_response(data, status: int = 200, headers=None) -> web.Response:
+    """py-cord only decodes bodies whose content type is exactly application/json (no charset)."""
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={**(headers or {}), "Content-Type": "application/json"})
+
+
+# -------------------------
+# RATE LIMITS
+# -------------------------
+# (method, route template) -> (bucket name, requests, per seconds, major parameter)
+# Discord doesn't publish exact numbers; these are in line with what it reports.
+BUCKET_LIMITS = {
+    ("POST", "/channels/{channel_id}/messages"): ("messages", 5, 5.0, "channel_id"),
+    ("PATCH", "/channels/{channel_id}/messages/{message_id}"): ("message-edit", 5, 5.0, "channel_id"),
+    ("DELETE", "/channels/{channel_id}/messages/{message_id}"): ("message-delete", 5, 1.0, "channel_id"),
+    ("POST", "/channels/{channel_id}/messages/bulk-delete"): ("bulk-delete", 1, 1.0, "channel_id"),
+    ("GET", "/channels/{channel_id}/messages"): ("history", 5, 5.0, "channel_id"),
+    ("PATCH", "/guilds/{guild_id}/members/{user_id}"): ("member-edit", 10, 10.0, "guild_id"),
+    ("PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"): ("member-roles", 10, 10.0, "guild_id"),
+    ("DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}"): ("member-roles", 10, 10.0, "guild_id"),
+}
+GLOBAL_LIMIT = 50  # requests per second, all routes
+
+
+class FixedWindow:
+    """`limit` requests per `per` seconds; the window starts at the first request."""
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self.started = 0.0
+        self.used = 0
+
+    def hit(self):
+        """(allowed, remaining, reset_after)."""
+        now = time.monotonic()
+        if now - self.started >= self.per:
+            self.started, self.used = now, 0
+        reset_after = self.per - (now - self.started)
+        if self.used >= self.limit:
+            return False, 0, reset_after
+        self.used += 1
+        return True, self.limit - self.used, reset_after
+
+
+class RateLimiter:
+    def __init__(self):
+        self.buckets = {}  # (name, major id) -> FixedWindow
+        self.global_window = FixedWindow(GLOBAL_LIMIT, 1.0)
+
+    def check(self, method: str, template: str, params: dict):
+        """(headers, 429 body or None) for one request."""
+        allowed, _, reset_after = self.global_window.hit()
+        if not allowed:
+            return {"Retry-After": f"{reset_after:.3f}", "X-RateLimit-Global": "true", "Via": "1.1 google"}, {
+                "message": "You are being rate limited.", "retry_after": round(reset_after, 3), "global": True,
+            }
+        limit = BUCKET_LIMITS.get((method, template))
+        if limit is None:
+            return {}, None
+        name, requests, per, major = limit
+        key = (name, params.get(major))
+        window = self.buckets.get(key)
+        if window is None:
+            window = self.buckets[key] = FixedWindow(requests, per)
+        allowed, remaining, reset_after = window.hit()
+        headers = {
+            "X-RateLimit-Limit": str(requests),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": f"{time.time() + reset_after:.3f}",
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            "X-RateLimit-Bucket": name,
+        }
+        if allowed:
+            return headers, None
+        headers.update({"Retry-After": f"{reset_after:.3f}", "X-RateLimit-Scope": "shared", "Via": "1.1 google"})
+        return headers, {"message": "You are being rate limited.", "retry_after": round(reset_after, 3), "global": False}
+
+
+# -------------------------
+# SCHOOL STATE
+# -------------------------
+class School:
+    """The one guild the stand-in serves, kept as Discord API payloads."""
+
+    def __init__(self, members: int):
+        self.guild_id = hb.GUILD_ID
+        self.bot_user = self._user(BOT_USER_ID, "Hedwig", bot=True)
+        self.roles = {self.guild_id: self._role(self.guild_id, "@everyone", 0, permissions="0")}
+        for position, (name, role_id) in enumerate(hb.ROLE_IDS.items(), start=1):
+            label = hb.ALOHOMORA_ROLE_NAME if name == "alohomora" else name.capitalize()
+            self.roles[role_id] = self._role(role_id, label, position)
+        self.roles[HEDWIG_ROLE_ID] = self._role(HEDWIG_ROLE_ID, "Hedwig", len(self.roles) + 1, permissions="8")
+
+        self.channels = {}
+        for channel_id, name in (
+            (hb.OWLRY_CHANNEL_ID, "owlry"),
+            (hb.ROOM_OF_REQUIREMENT_ID, "room-of-requirement"),
+            (hb.GRINGOTTS_CHANNEL_ID, "gringotts"),
+            (hb.DUELING_CLUB_ID, "dueling-club"),
+        ):
+            self.channels[channel_id] = {
+                "id": str(channel_id), "type": 0, "name": name, "guild_id": str(self.guild_id),
+                "position": len(self.channels), "permission_overwrites": [], "nsfw": False,
+                "parent_id": None, "topic": None, "last_message_id": None, "rate_limit_per_user": 0,
+            }
+        # Everything the bot sends stays editable for the whole run, so edit-in-place
+        # never falls back to a new send just because the stand-in forgot the
+        # message. Per-channel history (for purges) is bounded and holds both.
+        self.sent = {}  # message id -> payload, bot messages only
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=HISTORY_LIMIT))  # channel -> payloads
+
+        self.members = {}  # user_id -> member payload
+        self._add_member(self.bot_user, [HEDWIG_ROLE_ID])
+        self._add_member(self._user(STAFF_USER_ID, "headmaster"), [hb.ROLE_IDS["prefects"], hb.ROLE_IDS["head_of_house"]])
+        self.students = []
+        for i in range(members):
+            user_id = STUDENT_ID_BASE + i
+            house = hb.ROLE_IDS[HOUSES[i % len(HOUSES)]]
+            self._add_member(self._user(user_id, f"wizard{i:06d}"), [house])
+            self.students.append(user_id)
+
+    @staticmethod
+    def _user(user_id: int, name: str, bot: bool = False) -> dict:
+        return {"id": str(user_id), "username": name, "global_name": None, "discriminator": "0",
+                "avatar": None, "bot": bot}
+
+    @staticmethod
+    def _role(role_id: int, name: str, position: int, permissions: str = "0") -> dict:
+        return {"id": str(role_id), "name": name, "color": 0, "colors": {"primary_color": 0}, "hoist": False, "position": position,
+                "permissions": permissions, "managed": False, "mentionable": True, "flags": 0}
+
+    def _add_member(self, user: dict, roles):
+        self.members[int(user["id"])] = {
+            "user": user, "nick": None, "roles": [str(r) for r in roles], "joined_at": iso_now(),
+            "deaf": False, "mute": False, "flags": 0, "avatar": None, "premium_since": None, "pending": False,
+        }
+
+    def guild_payload(self) -> dict:
+        return {
+            "id": str(self.guild_id), "name": "Hogwarts (stand-in)", "icon": None, "owner_id": str(STAFF_USER_ID),
+            "roles": list(self.roles.values()), "channels": list(self.channels.values()),
+            "members": list(self.members.values()), "member_count": len(self.members),
+            "large": len(self.members) > 250, "unavailable": False, "emojis": [], "stickers": [],
+            "features": [], "presences": [], "voice_states": [], "threads": [], "stage_instances": [],
+            "guild_scheduled_events": [], "premium_tier": 0, "verification_level": 0,
+            "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0,
+            "system_channel_flags": 0, "preferred_locale": "en-US", "nsfw_level": 0,
+            "joined_at": iso_now(), "afk_timeout": 300,
+        }
+
+    def message(self, channel_id: int, author_id: int, content: str, *, embeds=None, mentions=(), keep=True) -> dict:
+        author = self.members[author_id]
+        data = {
+            "id": str(snowflake()), "channel_id": str(channel_id), "guild_id": str(self.guild_id),
+            "author": author["user"], "member": {k: v for k, v in author.items() if k != "user"},
+            "content": content, "timestamp": iso_now(), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mention_roles": [], "attachments": [], "embeds": embeds or [],
+            "pinned": False, "type": 0, "flags": 0, "components": [],
+            "mentions": [
+                {**self.members[uid]["user"], "member": {k: v for k, v in self.members[uid].items() if k != "user"}}
+                for uid in mentions
+            ],
+        }
+        if keep:
+            self.history[channel_id].append(data)
+            if author_id == BOT_USER_ID:
+                self.sent[data["id"]] = data
+        return data
+
+
+# -------------------------
+# STAND-IN SERVER
+# -------------------------
+class FakeDiscord:
+    def __init__(self, school: School, host: str, port: int):
+        self.school = school
+        self.host = host
+        self.port = port
+        self.limiter = RateLimiter()
+        self.sockets = []      # [(ws, shard_id, shard_count)] with an identified session
+        self.ready = asyncio.Event()
+        self.gateway_seq = itertools.count(1)
+        self.stats = {
+            "rest": collections.Counter(),           # "METHOD template" -> calls
+            "rate_limited": collections.Counter(),   # bucket -> 429s
+            "gateway_events": collections.Counter(),
+            "unknown_routes": collections.Counter(),
+        }
+        self.reply_waiters = collections.defaultdict(collections.deque)  # channel -> injection times
+        self.reply_latencies = []
+
+    # ---- REST ----
+    def routes(self):
+        api = "/api/v{version}"
+        add = []
+        for method, template, handler in (
+            ("GET", "/gateway", self.get_gateway),
+            ("GET", "/gateway/bot", self.get_gateway),
+            ("GET", "/users/@me", self.get_me),
+            ("GET", "/applications/{app_id}/commands", self.empty_list),
+            ("PUT", "/applications/{app_id}/commands", self.empty_list),
+            ("GET", "/soundboard-default-sounds", self.empty_list),
+            ("POST", "/users/@me/channels", self.create_dm),
+            ("POST", "/channels/{channel_id}/messages", self.send_message),
+            ("GET", "/channels/{channel_id}/messages", self.message_history),
+            ("PATCH", "/channels/{channel_id}/messages/{message_id}", self.edit_message),
+            ("DELETE", "/channels/{channel_id}/messages/{message_id}", self.delete_message),
+            ("POST", "/channels/{channel_id}/messages/bulk-delete", self.bulk_delete),
+            ("GET", "/guilds/{guild_id}/members/{user_id}", self.get_member),
+            ("PATCH", "/guilds/{guild_id}/members/{user_id}", self.edit_member),
+            ("PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}", self.add_role),
+            ("DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}", self.remove_role),
+        ):
+            add.append(web.route(method, api + template, self._limited(method, template, handler)))
+        add.append(web.route("*", api + "/{tail:.*}", self.unknown_route))
+        add.append(web.get("/gateway", self.gateway))
+        return add
+
+    def _limited(self, method, template, handler):
+        async def wrapper(request):
+            params = dict(request.match_info)
+            self.stats["rest"][f"{method} {template}"] += 1
+            headers, limited = self.limiter.check(method, template, params)
+            if limited is not None:
+                self.stats["rate_limited"][headers.get("X-RateLimit-Bucket", "global")] += 1
+                return json_response(limited, status=429, headers=headers)
+            response = await handler(request, params)
+            response.headers.update(headers)
+            return response
+        return wrapper
+
+    async def unknown_route(self, request):
+        self.stats["unknown_routes"][f"{request.method} {request.path}"] += 1
+        return json_response({"message": "Unknown route (stand-in)", "code": 0}, status=404)
+
+    async def get_gateway(self, request, params):
+        return json_response({
+            "url": f"ws://{self.host}:{self.port}/gateway", "shards": max(1, hb.SHARD_COUNT),
+            "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1},
+        })
+
+    async def get_me(self, request, params):
+        return json_response(self.school.bot_user)
+
+    async def empty_list(self, request, params):
+        return json_response([])
+
+    async def create_dm(self, request, params):
+        body = await request.json()
+        return json_response({"id": str(snowflake()), "type": 1, "last_message_id": None,
+                                  "recipients": [self.school.members[int(body["recipient_id"])]["user"]]})
+
+    async def send_message(self, request, params):
+        channel_id = int(params["channel_id"])
+        body = await self._body(request)
+        waiting = self.reply_waiters.get(channel_id)
+        if waiting:
+            self.reply_latencies.append(time.monotonic() - waiting.popleft())
+        if channel_id not in self.school.channels:
+            # a DM: not kept, just echoed back
+            return json_response({**self.school.message(hb.OWLRY_CHANNEL_ID, BOT_USER_ID, body.get("content") or "", keep=False),
+                                      "channel_id": str(channel_id), "guild_id": None})
+        return json_response(self.school.message(channel_id, BOT_USER_ID, body.get("content") or "",
+                                                     embeds=body.get("embeds")))
+
+    async def message_history(self, request, params):
+        channel_id = int(params["channel_id"])
+        limit = int(request.query.get("limit", 50))
+        before = request.query.get("before")
+        messages = list(reversed(self.school.history.get(channel_id, ())))
+        if before:
+            messages = [m for m in messages if int(m["id"]) < int(before)]
+        return json_response(messages[:limit])
+
+    async def edit_message(self, request, params):
+        body = await self._body(request)
+        message = self.school.sent.get(params["message_id"])
+        if message is None or message["channel_id"] != params["channel_id"]:
+            return json_response({"message": "Unknown Message", "code": 10008}, status=404)
+        message.update({k: v for k, v in body.items() if k in ("content", "embeds")}, edited_timestamp=iso_now())
+        return json_response(message)
+
+    async def delete_message(self, request, params):
+        self._forget_messages(int(params["channel_id"]), {params["message_id"]})
+        return web.Response(status=204)
+
+    async def bulk_delete(self, request, params):
+        body = await request.json()
+        self._forget_messages(int(params["channel_id"]), set(body.get("messages", [])))
+        return web.Response(status=204)
+
+    def _forget_messages(self, channel_id: int, ids: set):
+        for message_id in ids:
+            self.school.sent.pop(message_id, None)
+        history = self.school.history.get(channel_id)
+        if history:
+            kept = [m for m in history if m["id"] not in ids]
+            history.clear()
+            history.extend(kept)
+
+    async def get_member(self, request, params):
+        member = self.school.members.get(int(params["user_id"]))
+        if member is None:
+            return json_response({"message": "Unknown Member", "code": 10007}, status=404)
+        return json_response(member)
+
+    async def edit_member(self, request, params):
+        member = self.school.members.get(int(params["user_id"]))
+        if member is None:
+            return json_response({"message": "Unknown Member", "code": 10007}, status=404)
+        body = await self._body(request)
+        if "roles" in body:
+            member["roles"] = [str(r) for r in body["roles"]]
+        if "nick" in body:
+            member["nick"] = body["nick"]
+        await self.member_updated(member)
+        return json_response(member)
+
+    async def add_role(self, request, params):
+        member = self.school.members.get(int(params["user_id"]))
+        if member is None:
+            return json_response({"message": "Unknown Member", "code": 10007}, status=404)
+        if params["role_id"] not in member["roles"]:
+            member["roles"].append(params["role_id"])
+            await self.member_updated(member)
+        return web.Response(status=204)
+
+    async def remove_role(self, request, params):
+        member = self.school.members.get(int(params["user_id"]))
+        if member is None:
+            return json_response({"message": "Unknown Member", "code": 10007}, status=404)
+        if params["role_id"] in member["roles"]:
+            member["roles"].remove(params["role_id"])
+            await self.member_updated(member)
+        return web.Response(status=204)
+
+    @staticmethod
+    async def _body(request) -> dict:
+        if request.content_type == "multipart/form-data":
+            form = await request.post()
+            return json.loads(form.get("payload_json") or "{}")
+        if not request.can_read_body:
+            return {}
+        return await request.json()
+
+    # ---- gateway ----
+    async def gateway(self, request):
+        ws = web.WebSocketResponse(heartbeat=None, max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_json({"op": 10, "d": {"heartbeat_interval": 41250}})
+        session = None
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(msg.data)
+            op, data = payload.get("op"), payload.get("d")
+            if op == 1:  # heartbeat
+                await ws.send_json({"op": 11})
+            elif op == 2:  # identify
+                shard_id, shard_count = (data.get("shard") or [0, 1])
+                session = (ws, shard_id, shard_count)
+                await self.identify(ws, shard_id, shard_count)
+                self.sockets.append(session)
+                self.ready.set()
+            elif op == 6:  # resume: not supported, start a fresh session
+                await ws.send_json({"op": 9, "d": False})
+            elif op == 8:  # request guild members
+                await self.member_chunk(ws, data)
+        if session in self.sockets:
+            self.sockets.remove(session)
+        if not self.sockets:
+            self.ready.clear()
+        return ws
+
+    async def close(self):
+        """Hang up on the bot so the HTTP server can shut down without waiting for it."""
+        for ws, _, _ in list(self.sockets):
+            await ws.close(code=1000, message=b"stand-in shutting down")
+
+    def _serves_school(self, shard_id: int, shard_count: int) -> bool:
+        return hb.shard_for(self.school.guild_id, shard_count) == shard_id
+
+    async def identify(self, ws, shard_id: int, shard_count: int):
+        guilds = []
+        if self._serves_school(shard_id, shard_count):
+            guilds.append({"id": str(self.school.guild_id), "unavailable": True})
+        await self.dispatch_to(ws, "READY", {
+            "v": 10, "user": self.school.bot_user, "guilds": guilds, "session_id": f"stand-in-{shard_id}",
+            "resume_gateway_url": f"ws://{self.host}:{self.port}/gateway", "shard": [shard_id, shard_count],
+            "application": {"id": str(BOT_USER_ID), "flags": 0},
+        })
+        if guilds:
+            await self.dispatch_to(ws, "GUILD_CREATE", self.school.guild_payload())
+
+    async def member_chunk(self, ws, data: dict):
+        wanted = data.get("user_ids")
+        if wanted is not None:
+            wanted = wanted if isinstance(wanted, list) else [wanted]
+            members = [self.school.members[int(uid)] for uid in wanted if int(uid) in self.school.members]
+        else:
+            prefix = (data.get("query") or "").lower()
+            members = [m for m in self.school.members.values() if m["user"]["username"].startswith(prefix)]
+            if data.get("limit"):
+                members = members[:data["limit"]]
+        await self.dispatch_to(ws, "GUILD_MEMBERS_CHUNK", {
+            "guild_id": str(self.school.guild_id), "members": members, "chunk_index": 0, "chunk_count": 1,
+            "not_found": [], "nonce": data.get("nonce"),
+        })
+
+    async def dispatch_to(self, ws, event: str, data: dict):
+        self.stats["gateway_events"][event] += 1
+        await ws.send_str(json.dumps({"op": 0, "t": event, "s": next(self.gateway_seq), "d": data}))
+
+    async def dispatch(self, event: str, data: dict):
+        """Send a guild event to every session on the school's shard."""
+        for ws, shard_id, shard_count in list(self.sockets):
+            if self._serves_school(shard_id, shard_count) and not ws.closed:
+                await self.dispatch_to(ws, event, data)
+
+    async def member_updated(self, member: dict):
+        await self.dispatch("GUILD_MEMBER_UPDATE", {"guild_id": str(self.school.guild_id), **member})
+
+    async def inject(self, channel_id: int, author_id: int, content: str, mentions=()):
+        """A member types `content` in `channel_id`."""
+        self.reply_waiters[channel_id].append(time.monotonic())
+        await self.dispatch("MESSAGE_CREATE", self.school.message(channel_id, author_id, content, mentions=mentions))
+
+
+# -------------------------
+# TRAFFIC GENERATOR
+# -------------------------
+DEFAULT_MIX = "cast=35,drink=20,daily=20,duel=10,balance=15"
+DUEL_CAST_AFTER_SECONDS = 27  # the countdown's length, plus a little reaction time
+
+
+class Traffic:
+    """Replays a weighted mix of student commands at a steady rate."""
+
+    def __init__(self, server: FakeDiscord, mix: dict, rate: float, duration: float, seed: int):
+        self.server = server
+        self.school = server.school
+        self.kinds, self.weights = zip(*mix.items())
+        self.rate = rate
+        self.duration = duration
+        self.random = random.Random(seed)
+        self.sent = collections.Counter()
+        self.duelists = set()  # one duel per student per day, like the bot enforces
+        self.background = set()
+        self.spells = [name for name in hb.EFFECT_LIBRARY if name not in ("alohomora", "finite")]
+        self.potions = [name for name in hb.POTION_LIBRARY if name not in hb.SHOP_HIDDEN]
+
+    def student(self) -> int:
+        return self.random.choice(self.school.students)
+
+    async def fund(self, count: int, amount: int):
+        """Staff hands out galleons first so casts and potions can be paid for."""
+        for user_id in self.school.students[:count]:
+            await self.server.inject(hb.GRINGOTTS_CHANNEL_ID, STAFF_USER_ID,
+                                     f"!givegalleons <@{user_id}> {amount}", mentions=[user_id])
+            self.sent["givegalleons"] += 1
+            await asyncio.sleep(1 / max(self.rate, 1))
+
+    async def one(self, kind: str):
+        club = hb.DUELING_CLUB_ID
+        if kind == "cast":
+            caster, target = self.student(), self.student()
+            await self.server.inject(club, caster, f"!cast {self.random.choice(self.spells)} <@{target}>", mentions=[target])
+        elif kind == "drink":
+            drinker, target = self.student(), self.student()
+            await self.server.inject(club, drinker, f"!drink {self.random.choice(self.potions)} <@{target}>", mentions=[target])
+        elif kind == "daily":
+            await self.server.inject(hb.GRINGOTTS_CHANNEL_ID, self.student(), "!daily")
+        elif kind == "balance":
+            await self.server.inject(hb.GRINGOTTS_CHANNEL_ID, self.student(), "!balance")
+        elif kind == "duel":
+            free = [uid for uid in self.random.sample(self.school.students, min(20, len(self.school.students)))
+                    if uid not in self.duelists]
+            if len(free) < 2:
+                return
+            task = asyncio.create_task(self.duel(free[0], free[1]))
+            self.background.add(task)
+            task.add_done_callback(self.background.discard)
+        else:
+            raise ValueError(f"unknown traffic kind {kind!r}")
+        self.sent[kind] += 1
+
+    async def duel(self, challenger: int, challenged: int):
+        self.duelists.update((challenger, challenged))
+        club = hb.DUELING_CLUB_ID
+        await self.server.inject(club, challenger, f"!duel <@{challenged}>", mentions=[challenged])
+        await asyncio.sleep(1 + self.random.random())
+        await self.server.inject(club, challenged, "!duelconfirm")
+        await asyncio.sleep(DUEL_CAST_AFTER_SECONDS + self.random.random() * 3)
+        await self.server.inject(club, self.random.choice((challenger, challenged)), "!duel cast")
+
+    async def run(self, report_every: float):
+        started = time.monotonic()
+        next_report = started + report_every
+        interval = 1 / self.rate
+        due = started
+        while time.monotonic() - started < self.duration:
+            await self.one(self.random.choices(self.kinds, self.weights)[0])
+            due += self.random.expovariate(1 / interval)
+            now = time.monotonic()
+            if now >= next_report:
+                print(progress_line(self.server, self, now - started), file=sys.stderr)
+                next_report += report_every
+            await asyncio.sleep(max(0.0, due - now))
+        if self.background:
+            await asyncio.gather(*self.background, return_exceptions=True)
+
+
+# -------------------------
+# REPORT
+# -------------------------
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def progress_line(server: FakeDiscord, traffic: Traffic, elapsed: float) -> str:
+    injected = sum(traffic.sent.values())
+    rest = sum(server.stats["rest"].values())
+    limited = sum(server.stats["rate_limited"].values())
+    return (f"[fake-discord] {elapsed:6.0f}s  {injected / elapsed:6.1f} cmd/s  "
+            f"{rest / elapsed:6.1f} REST/s  {limited} x 429  "
+            f"reply p50 {percentile(server.reply_latencies, 50) * 1000:.0f}ms")
+
+
+def summary(server: FakeDiscord, traffic: Traffic, elapsed: float) -> dict:
+    return {
+        "seconds": round(elapsed, 1),
+        "members": len(server.school.students),
+        "commands": dict(traffic.sent),
+        "commands_per_second": round(sum(traffic.sent.values()) / elapsed, 2),
+        "rest_calls": dict(server.stats["rest"]),
+        "rest_per_second": round(sum(server.stats["rest"].values()) / elapsed, 2),
+        "rate_limited": dict(server.stats["rate_limited"]),
+        "gateway_events": dict(server.stats["gateway_events"]),
+        "unknown_routes": dict(server.stats["unknown_routes"]),
+        # a reply is matched to the oldest unanswered command in its channel,
+        # so batched or missing replies make this an estimate
+        "reply_latency_ms": {
+            "p50": round(percentile(server.reply_latencies, 50) * 1000, 1),
+            "p95": round(percentile(server.reply_latencies, 95) * 1000, 1),
+            "p99": round(percentile(server.reply_latencies, 99) * 1000, 1),
+        },
+        "unanswered": sum(len(q) for q in server.reply_waiters.values()),
+    }
+
+
+async def main(args):
+    school = School(args.members)
+    server = FakeDiscord(school, args.host, args.port)
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.add_routes(server.routes())
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"[fake-discord] serving guild {school.guild_id} ({args.members} students) on "
+          f"http://{args.host}:{args.port}; start the bot with HEDWIG_DISCORD_API=http://{args.host}:{args.port}",
+          file=sys.stderr)
+
+    try:
+        await server.ready.wait()
+        print(f"[fake-discord] bot connected; traffic starts in {args.warmup:.0f}s", file=sys.stderr)
+        await asyncio.sleep(args.warmup)
+        traffic = Traffic(server, parse_mix(args.mix), args.rate, args.duration, args.seed)
+        started = time.monotonic()
+        if args.fund:
+            await traffic.fund(min(args.fund, args.members), args.fund_amount)
+        await traffic.run(args.report_every)
+        await asyncio.sleep(args.cooldown)  # let the last replies land
+        result = summary(server, traffic, time.monotonic() - started)
+    finally:
+        await server.close()
+        await runner.cleanup()
+
+    report = json.dumps(result, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in ("cast", "drink", "daily", "duel", "balance"):
+            raise argparse.ArgumentTypeError(f"unknown traffic kind {kind!r}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Discord gateway/REST stand-in with a traffic generator.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--members", type=int, default=1000, help="students in the synthetic school")
+    parser.add_argument("--rate", type=float, default=10.0, help="commands per second")
+    parser.add_argument("--duration", type=float, default=120.0, help="seconds of traffic")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted command mix (default {DEFAULT_MIX})")
+    parser.add_argument("--fund", type=int, default=200, help="students staff gives galleons to first (0: none)")
+    parser.add_argument("--fund-amount", type=int, default=1000)
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds between connect and traffic")
+    parser.add_argument("--cooldown", type=float, default=10.0, help="seconds to wait for replies at the end")
+    parser.add_argument("--report-every", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON summary to this file")
+    args = parser.parse_args(argv)
+    parse_mix(args.mix)
+    if args.output:
+        args.output = os.path.abspath(os.path.join(_ORIGINAL_CWD, args.output))
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -3,14 +3,26 @@ import os
 import random
 import asyncio
 import uuid
+import heapq
+import bisect
+import itertools
+import collections
 import discord
 import json
+import sqlite3
 import time
 import signal
+import logging
+import functools
+import contextlib
+import threading
 import datetime as dt 
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from aiohttp import web
 
 # -------------------------
 # CONFIG / SETUP
@@ -22,7 +34,31 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Each process serves one school (guild); HEDWIG_GUILD_ID picks which. With
+# HEDWIG_SHARD_COUNT > 1 it connects as an AutoShardedBot, but only to the
+# shard that carries its school, and ignores the other guilds on that shard.
+# DMs are answered by the home school's process only.
+HOME_GUILD_ID = 1398801863549259796
+GUILD_ID = int(os.getenv("HEDWIG_GUILD_ID") or HOME_GUILD_ID)
+SHARD_COUNT = int(os.getenv("HEDWIG_SHARD_COUNT") or 1)
+
+def shard_for(guild_id: int, shard_count: int) -> int:
+    """The shard Discord delivers a guild's events on."""
+    return (guild_id >> 22) % shard_count
+
+# HEDWIG_DISCORD_API points REST and gateway discovery at a local stand-in
+# (fake_discord.py) for load and soak tests.
+DISCORD_API = os.getenv("HEDWIG_DISCORD_API")
+if DISCORD_API:
+    discord.http.Route.API_BASE_URL = f"{DISCORD_API.rstrip('/')}/api/v{discord.http.API_VERSION}"
+
+if SHARD_COUNT > 1:
+    bot = commands.AutoShardedBot(
+        command_prefix="!", intents=intents,
+        shard_count=SHARD_COUNT, shard_ids=[shard_for(GUILD_ID, SHARD_COUNT)],
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
 
 # Channel IDs
 OWLRY_CHANNEL_ID = 1410875871249829898
@@ -102,27 +138,119 @@ effect_unicode = {
     "finite": "✂️"
 }
 
+# -------------------------
+# SCHOOLS (per-guild config)
+# -------------------------
+# The ids above are the home school's. Any other school needs an entry in
+# schools.json (HEDWIG_SCHOOLS_FILE overrides the path), keyed by guild id:
+#   {"<guild_id>": {"channels": {"owlry": id, "room_of_requirement": id,
+#                                "gringotts": id, "dueling_club": id},
+#                   "roles": {<every ROLE_IDS key>: id},
+#                   "alohomora_role_name": "...",
+#                   "emojis": {"potions": [...], "houses": {...}, "effects": {...}}}}
+# The home school may use an entry too, to override some of its ids.
+try:
+    SCHOOLS_FILE = os.getenv("HEDWIG_SCHOOLS_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "schools.json")
+except NameError:
+    SCHOOLS_FILE = os.path.join(os.getcwd(), "schools.json")
+
+SCHOOL_CHANNELS = {
+    "owlry": "OWLRY_CHANNEL_ID",
+    "room_of_requirement": "ROOM_OF_REQUIREMENT_ID",
+    "gringotts": "GRINGOTTS_CHANNEL_ID",
+    "dueling_club": "DUELING_CLUB_ID",
+}
+
+def load_school_config(guild_id: int) -> dict:
+    """This school's entry from SCHOOLS_FILE ({} for the home school without one)."""
+    try:
+        with open(SCHOOLS_FILE, "r", encoding="utf-8") as f:
+            school = json.load(f).get(str(guild_id))
+    except FileNotFoundError:
+        school = None
+    if school is None:
+        if guild_id != HOME_GUILD_ID:
+            raise ValueError(f"no entry for guild {guild_id} in {SCHOOLS_FILE}")
+        return {}
+    if guild_id != HOME_GUILD_ID:
+        missing = [k for k in SCHOOL_CHANNELS if k not in school.get("channels", {})]
+        missing += [k for k in ROLE_IDS if k not in school.get("roles", {})]
+        if missing:
+            raise ValueError(f"school {guild_id} in {SCHOOLS_FILE} is missing: {', '.join(missing)}")
+    return school
+
+def apply_school_config(school: dict):
+    global ALOHOMORA_ROLE_NAME
+    for key, value in school.get("channels", {}).items():
+        if key not in SCHOOL_CHANNELS:
+            raise ValueError(f"unknown school channel {key!r}")
+        globals()[SCHOOL_CHANNELS[key]] = int(value)
+    ROLE_IDS.update({name: int(rid) for name, rid in school.get("roles", {}).items()})
+    ALOHOMORA_ROLE_NAME = school.get("alohomora_role_name", ALOHOMORA_ROLE_NAME)
+    emojis = school.get("emojis", {})
+    if "potions" in emojis:
+        POTION_EMOJIS[:] = emojis["potions"]
+    house_emojis.update(emojis.get("houses", {}))
+    effect_emojis.update(emojis.get("effects", {}))
+
+apply_school_config(load_school_config(GUILD_ID))
+
+def school_guilds():
+    """The guilds this process serves: its school, once the gateway has it."""
+    guild = bot.get_guild(GUILD_ID)
+    return [guild] if guild else []
+
 # New global dictionaries for dueling state
-active_duels = {}
+duels = {}               # challenger_id -> duel record (see DUEL STATE MACHINE)
+duel_by_challenged = {}  # challenged_id -> challenger_id
 duel_cooldowns = {}
 
 # -------------------------
 # PERSISTENCE: data files
 # -------------------------
 effects = {}  # {user_id: {"effect": str, "expires": timestamp}}
-EFFECTS_FILE = "effects.json"
 try:
-    DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+    DATA_ROOT = os.getenv("HEDWIG_DATA_DIR") or os.path.join(os.path.dirname(__file__), "data")
 except NameError:
-    DATA_DIR = os.path.join(os.getcwd(), "data")
+    DATA_ROOT = os.path.join(os.getcwd(), "data")
+# every school's state lives in its own partition; a process only reads its own
+DATA_DIR = os.path.join(DATA_ROOT, str(GUILD_ID))
+
+def migrate_flat_data_dir():
+    """Move the single-school layout (files straight in DATA_ROOT, effects.json in
+    the working directory) into the home school's partition, once."""
+    if GUILD_ID != HOME_GUILD_ID or os.path.isdir(DATA_DIR):
+        return
+    os.makedirs(DATA_ROOT, exist_ok=True)
+    legacy = [os.path.join(DATA_ROOT, name) for name in os.listdir(DATA_ROOT)]
+    legacy = [path for path in legacy if os.path.isfile(path)]
+    if os.path.isfile("effects.json"):
+        legacy.append("effects.json")
+    os.makedirs(DATA_DIR)
+    for path in legacy:
+        os.replace(path, os.path.join(DATA_DIR, os.path.basename(path)))
+    if legacy:
+        print(f"[Hedwig] moved {len(legacy)} data files into {DATA_DIR}")
+
+migrate_flat_data_dir()
 os.makedirs(DATA_DIR, exist_ok=True)
+EFFECTS_FILE = os.path.join(DATA_DIR, "effects.json")
 GALLEONS_FILE = os.path.join(DATA_DIR, "galleons.json")
 POINTS_FILE = os.path.join(DATA_DIR, "house_points.json")
 DUEL_COOLDOWNS_FILE = os.path.join(DATA_DIR, "duel_cooldowns.json")
+DUELS_FILE = os.path.join(DATA_DIR, "duels.json")
 REMINDERS_FILE = os.path.join(DATA_DIR, "reminders.json")
 
 LAST_DAILY_FILE = os.path.join(DATA_DIR, "last_daily.json")
 
+def write_json_file(path: str, data: str) -> int:
+    """Atomically replace `path` with the serialized `data`; returns bytes written."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data.encode("utf-8"))
+
 def load_last_daily():
     global last_daily
     try:
@@ -140,15 +268,16 @@ def load_last_daily():
         print("[Hedwig] Failed to load last_daily:", e)
         last_daily = {}
 
+def dump_last_daily():
+    serializable = {str(k): v.isoformat() for k, v in last_daily.items()}
+    return json.dumps(serializable, indent=2)
+
 def save_last_daily():
     try:
-        tmp = LAST_DAILY_FILE + ".tmp"
-        serializable = {str(k): v.isoformat() for k, v in last_daily.items()}
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(serializable, f, indent=2)
-        os.replace(tmp, LAST_DAILY_FILE)
+        return write_json_file(LAST_DAILY_FILE, dump_last_daily())
     except Exception as e:
         print("[Hedwig] Failed to save last_daily:", e)
+        return 0
 
 # in-memory state (will be loaded on start)
 galleons = {}                          # int_user_id -> int
@@ -172,15 +301,16 @@ def load_galleons():
         print("[Hedwig] Failed to load galleons:", e)
         galleons = {}
 
+def dump_galleons():
+    serializable = {str(k): v for k, v in galleons.items()}
+    return json.dumps(serializable, indent=2)
+
 def save_galleons():
     try:
-        tmp = GALLEONS_FILE + ".tmp"
-        serializable = {str(k): v for k, v in galleons.items()}
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(serializable, f, indent=2)
-        os.replace(tmp, GALLEONS_FILE)
+        return write_json_file(GALLEONS_FILE, dump_galleons())
     except Exception as e:
         print("[Hedwig] Failed to save galleons:", e)
+        return 0
 
 def load_reminders():
     global reminders
@@ -198,15 +328,16 @@ def load_reminders():
         print("[Hedwig] Failed to load reminders:", e)
         reminders = {}
 
+def dump_reminders():
+    serializable = {str(k): v for k, v in reminders.items()}
+    return json.dumps(serializable, indent=2)
+
 def save_reminders():
     try:
-        tmp = REMINDERS_FILE + ".tmp"
-        serializable = {str(k): v for k, v in reminders.items()}
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(serializable, f, indent=2)
-        os.replace(tmp, REMINDERS_FILE)
+        return write_json_file(REMINDERS_FILE, dump_reminders())
     except Exception as e:
         print("[Hedwig] Failed to save reminders:", e)
+        return 0
 
 # --- house points persistence ---
 def load_house_points():
@@ -226,14 +357,15 @@ def load_house_points():
     except Exception as e:
         print("[Hedwig] Failed to load house points:", e)
 
+def dump_house_points():
+    return json.dumps(house_points, indent=2)
+
 def save_house_points():
     try:
-        tmp = POINTS_FILE + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(house_points, f, indent=2)
-        os.replace(tmp, POINTS_FILE)
+        return write_json_file(POINTS_FILE, dump_house_points())
     except Exception as e:
         print("[Hedwig] Failed to save house points:", e)
+        return 0
 
 # -------------------------
 # Persistence Functions
@@ -243,26 +375,41 @@ def load_effects():
     global effects
     try:
         with open(EFFECTS_FILE, "r") as f:
-            effects = json.load(f)
+            raw = json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
-        effects = {}
+        raw = {}
+    effects = {}
+    for uid, data in raw.items():
+        try:
+            effects[uid] = {
+                "original_nick": data.get("original_nick"),
+                "effects": EffectStack.unpack(data.get("effects", [])),
+            }
+        except Exception as e:
+            print(f"[Hedwig] Skipping unreadable saved effects for {uid}: {e}")
+
+def dump_effects():
+    # effects are stored as references into the item library (see EffectInstance.pack)
+    serializable = {
+        uid: {"original_nick": data.get("original_nick"), "effects": data["effects"].pack()}
+        for uid, data in effects.items()
+    }
+    return json.dumps(serializable, separators=(",", ":"))
 
 def save_effects():
-    with open(EFFECTS_FILE, "w") as f:
-        json.dump(effects, f, indent=4)
+    return write_json_file(EFFECTS_FILE, dump_effects())
 
 
 # -------------------------
 # STATE (OTHER IN-MEMORY)
 # -------------------------
 last_daily = {}           # user_id -> datetime
-active_effects = {}       # user_id -> {"original_nick": str, "effects": [ ... ]}
+active_effects = {}       # user_id -> {"original_nick": str, "effects": EffectStack}
 active_potions = {}       # user_id -> {"winning": int, "chosen": bool, "started_by": id}
 current_room_user = None  # user_id of whoever currently has access to the Room of Requirement 
 
 alohomora_cooldowns = {}    # target_user_id -> datetime
 reminders = {}  # {user_id: "2025-10-01T15:30:00"}  # store ISO datetime when daily is ready
-reminder_tasks = {}  # user_id -> asyncio.Task for recurring reminders
 
 # -------------------------
 # PERSISTENCE: Dueling
@@ -285,16 +432,865 @@ def load_duel_cooldowns():
         print(f"[Hedwig] Failed to load duel cooldowns: {e}")
         duel_cooldowns = {}
 
+def dump_duel_cooldowns():
+    # Convert datetime objects to ISO format strings for JSON
+    serializable = {str(k): v.isoformat() for k, v in duel_cooldowns.items()}
+    return json.dumps(serializable, indent=2)
+
 def save_duel_cooldowns():
     try:
-        tmp = DUEL_COOLDOWNS_FILE + ".tmp"
-        # Convert datetime objects to ISO format strings for JSON
-        serializable = {str(k): v.isoformat() for k, v in duel_cooldowns.items()}
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(serializable, f, indent=2)
-        os.replace(tmp, DUEL_COOLDOWNS_FILE)
+        return write_json_file(DUEL_COOLDOWNS_FILE, dump_duel_cooldowns())
     except Exception as e:
         print(f"[Hedwig] Failed to save duel cooldowns: {e}")
+        return 0
+
+def load_duels():
+    global duels
+    try:
+        if os.path.exists(DUELS_FILE):
+            with open(DUELS_FILE, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            duels = {int(k): v for k, v in raw.items()}
+            print(f"[Hedwig] loaded {len(duels)} open duels.")
+        else:
+            duels = {}
+    except Exception as e:
+        print(f"[Hedwig] Failed to load duels: {e}")
+        duels = {}
+
+def dump_duels():
+    return json.dumps({str(k): v for k, v in duels.items()}, indent=2)
+
+# -------------------------
+# METRICS
+# -------------------------
+# Prometheus text exposition served on METRICS_HOST:METRICS_PORT/metrics
+# (HEDWIG_METRICS_PORT=0 turns it off). Counters and histograms keep one series
+# per label set; gauges are read from live state when scraped. Hot paths are
+# instrumented with the @timed / @track_command decorators below.
+METRICS_HOST = os.getenv("HEDWIG_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("HEDWIG_METRICS_PORT", "9108"))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_PROBE_SECONDS = 0.5
+
+def _label_text(labels) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._series = {}  # sorted label tuple -> value
+        self._lock = threading.Lock()  # the persistence writer thread records too
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{_label_text(key)} {value}")
+        return lines
+
+class HistogramMetric:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # sorted label tuple -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_label_text(key)} {series[-1]}")
+        return lines
+
+class GaugeMetric:
+    """Read at scrape time from `read()`, so nothing has to keep it up to date."""
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            print(f"[Hedwig] Failed to read gauge {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+COMMAND_SECONDS = HistogramMetric("hedwig_command_duration_seconds", "Command handler latency.")
+REST_REQUESTS = CounterMetric("hedwig_discord_rest_requests_total", "Discord REST requests by route and status.")
+REST_SECONDS = HistogramMetric("hedwig_discord_rest_duration_seconds", "Discord REST latency by route (including rate-limit waits).")
+RATE_LIMITS = CounterMetric("hedwig_discord_rate_limited_total", "429 responses from Discord.")
+PERSISTENCE_FLUSH_SECONDS = HistogramMetric("hedwig_persistence_flush_seconds", "Writer-thread time per flush.")
+PERSISTENCE_SNAPSHOT_SECONDS = HistogramMetric("hedwig_persistence_snapshot_seconds", "Event-loop time spent snapshotting dirty stores.")
+LEDGER_COMMIT_SECONDS = HistogramMetric("hedwig_ledger_commit_seconds", "Writer-thread time per galleon ledger group commit (write + fsync).")
+PERSISTENCE_LOAD_SECONDS = HistogramMetric("hedwig_persistence_load_seconds", "Time to load all stores at startup.")
+SCHEDULER_JOB_SECONDS = HistogramMetric("hedwig_scheduler_job_duration_seconds", "Scheduled job run time by kind.")
+SCHEDULER_JOB_LATENESS = HistogramMetric("hedwig_scheduler_job_lateness_seconds", "How late scheduled jobs start.")
+LOOP_LAG_SECONDS = HistogramMetric("hedwig_event_loop_lag_seconds", "Extra delay seen by a periodic event-loop probe.")
+REMINDER_MESSAGES = CounterMetric("hedwig_reminder_messages_total", "Daily-reminder messages sent, by delivery (channel or dm).")
+loop_lag_stats = {"last": 0.0, "max": 0.0}
+
+METRICS = [
+    COMMAND_SECONDS, REST_REQUESTS, REST_SECONDS, RATE_LIMITS,
+    PERSISTENCE_FLUSH_SECONDS, PERSISTENCE_SNAPSHOT_SECONDS, LEDGER_COMMIT_SECONDS, PERSISTENCE_LOAD_SECONDS,
+    SCHEDULER_JOB_SECONDS, SCHEDULER_JOB_LATENESS, LOOP_LAG_SECONDS, REMINDER_MESSAGES,
+    GaugeMetric("hedwig_event_loop_lag_last_seconds", "Most recent event-loop probe delay.", lambda: loop_lag_stats["last"]),
+    GaugeMetric("hedwig_event_loop_lag_max_seconds", "Worst event-loop probe delay since start.", lambda: loop_lag_stats["max"]),
+    GaugeMetric("hedwig_scheduler_timers", "Live timers in the deadline scheduler.", lambda: len(scheduler)),
+    GaugeMetric("hedwig_scheduler_heap_size", "Scheduler heap entries, including cancelled ones not yet dropped.", lambda: len(scheduler._heap)),
+    GaugeMetric("hedwig_reminder_timers", "Pending daily-reminder timers.", lambda: scheduler.count("reminder")),
+    GaugeMetric("hedwig_reminder_batch_size", "Reminders waiting for the open Gringotts batch.", lambda: len(reminder_batch)),
+    GaugeMetric("hedwig_reminder_dm_queue", "Reminder DMs waiting for a send slot.", lambda: len(reminder_dms)),
+    GaugeMetric("hedwig_active_effects", "Active spell/potion effects across all members.",
+                lambda: sum(len(data["effects"]) for data in active_effects.values())),
+    GaugeMetric("hedwig_pending_display_batches", "Members with a queued role/nickname batch.", lambda: len(pending_display)),
+    GaugeMetric("hedwig_persistence_dirty_keys", "Changed keys waiting for the next flush.",
+                lambda: sum(len(keys) for keys in dirty_keys.values())),
+    GaugeMetric("hedwig_ledger_buffered_records", "Galleon ledger records waiting for a group commit.", lambda: len(ledger_buffer)),
+    GaugeMetric("hedwig_ledger_records_since_compaction", "Galleon ledger records a restart would replay.",
+                lambda: ledger_state["since_compaction"]),
+    GaugeMetric("hedwig_persistence_bytes_written", "Bytes written by the persistence layer since start.",
+                lambda: persistence_stats["bytes_written"]),
+    GaugeMetric("hedwig_persistence_failed_writes", "Failed store writes since start.",
+                lambda: persistence_stats["failed_writes"]),
+]
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def timed(histogram: HistogramMetric, labels=None):
+    """Decorator: observe the wall time of each call in `histogram`.
+
+    `labels` may be a callable taking the call's arguments and returning the
+    label dict for that call. Works for plain and async functions.
+    """
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **(labels(*args, **kwargs) if labels else {}))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **(labels(*args, **kwargs) if labels else {}))
+        return wrapper
+    return decorate
+
+def track_command(func):
+    """Decorator for command callbacks: latency histogram labelled by command and outcome."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await func(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - started, command=name, outcome=outcome)
+    return wrapper
+
+def instrument_http(http):
+    """Count and time every REST call py-cord makes, by templated route."""
+    original = http.request
+
+    @functools.wraps(original)
+    async def request(route, *args, **kwargs):
+        path = f"{route.method} {route.path}"
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await original(route, *args, **kwargs)
+            status = "ok"
+            return result
+        except discord.HTTPException as e:
+            status = str(e.status)
+            raise
+        finally:
+            REST_REQUESTS.inc(route=path, status=status)
+            REST_SECONDS.observe(time.perf_counter() - started, route=path)
+
+    http.request = request
+
+class RateLimitCounter(logging.Handler):
+    """py-cord retries 429s internally and only logs them, so count the log lines.
+
+    Every 429 logs "We are being rate limited..."; a global one follows it at
+    once (no await in between) with "Global rate limit has been hit...". Each
+    429 is counted once, from the first line, and the count is taken on the
+    next loop iteration so the second line can mark it global first.
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.pending = []  # scopes of 429s logged but not yet counted, oldest first
+
+    def emit(self, record):
+        msg = str(record.msg)
+        if msg.startswith("We are being rate limited"):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                RATE_LIMITS.inc(scope="route")
+                return
+            self.pending.append("route")
+            loop.call_soon(self._count)
+        elif msg.startswith("Global rate limit has been hit") and self.pending:
+            self.pending[-1] = "global"
+
+    def _count(self):
+        RATE_LIMITS.inc(scope=self.pending.pop(0))
+
+instrument_http(bot.http)
+logging.getLogger("discord.http").addHandler(RateLimitCounter(level=logging.WARNING))
+
+async def monitor_loop_lag():
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_PROBE_SECONDS)
+        lag = max(0.0, time.perf_counter() - started - LOOP_LAG_PROBE_SECONDS)
+        loop_lag_stats["last"] = lag
+        loop_lag_stats["max"] = max(loop_lag_stats["max"], lag)
+        LOOP_LAG_SECONDS.observe(lag)
+
+metrics_runner = None
+loop_lag_task = None
+
+async def start_metrics():
+    """Start the /metrics endpoint and the loop-lag probe (once; on_ready can repeat)."""
+    global metrics_runner, loop_lag_task
+    if loop_lag_task is None or loop_lag_task.done():
+        loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    if METRICS_PORT <= 0 or metrics_runner is not None:
+        return
+
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+        metrics_runner = runner
+        print(f"[Hedwig] metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except Exception as e:
+        await runner.cleanup()
+        print(f"[Hedwig] Failed to start metrics endpoint: {e}")
+
+# -------------------------
+# PERSISTENCE: write-behind flushing
+# -------------------------
+# Mutations only mark a store dirty; the flusher snapshots each dirty store once
+# every FLUSH_INTERVAL_SECONDS (or sooner once enough entries changed) and hands
+# the actual disk write to a single writer thread, so the event loop never waits
+# on the filesystem. One thread means writes land in the order they were taken.
+FLUSH_INTERVAL_SECONDS = 5
+FLUSH_DIRTY_THRESHOLD = 200
+
+# store name -> (file, serializer) for the JSON layout
+STORE_DUMPERS = {
+    "galleons": (GALLEONS_FILE, dump_galleons),
+    "last_daily": (LAST_DAILY_FILE, dump_last_daily),
+    "duel_cooldowns": (DUEL_COOLDOWNS_FILE, dump_duel_cooldowns),
+    "duels": (DUELS_FILE, dump_duels),
+    "reminders": (REMINDERS_FILE, dump_reminders),
+    "house_points": (POINTS_FILE, dump_house_points),
+    "effects": (EFFECTS_FILE, dump_effects),
+}
+
+persistence_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hedwig-writer")
+
+dirty_keys = {}  # store name -> set of keys changed since the last flush
+persistence_stats = {
+    "flushes": 0,
+    "bytes_written": 0,
+    "last_flush_ms": 0.0,       # wall time of the last write, off the loop
+    "max_flush_ms": 0.0,
+    "last_loop_blocked_ms": 0.0,  # time the loop spent taking the snapshot
+    "max_loop_blocked_ms": 0.0,
+    "failed_writes": 0,
+}
+
+def mark_dirty(store: str, key=None):
+    """Record that `key` in `store` changed; flushes early past the threshold."""
+    dirty_keys.setdefault(store, set()).add(key)
+    if sum(len(keys) for keys in dirty_keys.values()) >= FLUSH_DIRTY_THRESHOLD:
+        flush_dirty()
+
+@timed(PERSISTENCE_FLUSH_SECONDS)
+def _write_snapshots(jobs, loop):
+    """Runs on the writer thread: perform the queued writes and record their cost."""
+    started = time.perf_counter()
+    written = 0
+    for name, changed, write in jobs:
+        try:
+            written += write() or 0
+        except Exception as e:
+            persistence_stats["failed_writes"] += 1
+            print(f"[Hedwig] Failed to flush {name}: {e}")
+            # put the keys back so the next flush retries them
+            if loop is not None and not loop.is_closed():
+                loop.call_soon_threadsafe(_redirty, name, changed)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    persistence_stats["flushes"] += 1
+    persistence_stats["bytes_written"] += written
+    persistence_stats["last_flush_ms"] = elapsed_ms
+    persistence_stats["max_flush_ms"] = max(persistence_stats["max_flush_ms"], elapsed_ms)
+    names = ", ".join(name for name, _, _ in jobs)
+    print(
+        f"[Hedwig] flushed {names} ({written} bytes): write {elapsed_ms:.1f}ms off-loop, "
+        f"loop blocked {persistence_stats['last_loop_blocked_ms']:.2f}ms"
+    )
+    return written
+
+def _redirty(store: str, keys):
+    dirty_keys.setdefault(store, set()).update(keys)
+
+@timed(PERSISTENCE_SNAPSHOT_SECONDS)
+def flush_dirty(stores=None):
+    """Snapshot every dirty store (or only `stores`) and queue the writes.
+
+    Returns the writer-thread future, or None if nothing was dirty.
+    """
+    names = [n for n in (stores or list(dirty_keys)) if n in dirty_keys]
+    if not names:
+        return None
+
+    started = time.perf_counter()
+    jobs = []
+    for name in names:
+        changed = dirty_keys.pop(name)
+        try:
+            jobs.append((name, changed, storage.snapshot(name, changed)))
+        except Exception as e:
+            _redirty(name, changed)
+            print(f"[Hedwig] Failed to snapshot {name}: {e}")
+    blocked_ms = (time.perf_counter() - started) * 1000
+    persistence_stats["last_loop_blocked_ms"] = blocked_ms
+    persistence_stats["max_loop_blocked_ms"] = max(persistence_stats["max_loop_blocked_ms"], blocked_ms)
+
+    if not jobs:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    return persistence_writer.submit(_write_snapshots, jobs, loop)
+
+async def persist_now():
+    """Durable barrier: flush everything dirty and wait until it has hit the disk."""
+    commit_ledger()
+    flush_dirty()
+    # the writer is FIFO, so once this no-op runs every earlier write has finished
+    await asyncio.wrap_future(persistence_writer.submit(lambda: None))
+
+async def run_on_writer(func, *args):
+    """Run blocking storage work (loads, migrations) on the writer thread, in order."""
+    return await asyncio.get_running_loop().run_in_executor(persistence_writer, func, *args)
+
+def shutdown_persistence():
+    """Final synchronous flush: queue whatever is dirty and wait for the writer to drain."""
+    commit_ledger()
+    flush_dirty()
+    persistence_writer.shutdown(wait=True)
+    storage.close()
+
+# -------------------------
+# PERSISTENCE: storage backends
+# -------------------------
+# Store names double as the names of the in-memory globals they persist.
+# HEDWIG_STORAGE=sqlite switches from the per-file JSON documents to one
+# embedded database with a row per user.
+STORAGE_BACKEND = os.getenv("HEDWIG_STORAGE", "json").lower()
+SQLITE_FILE = os.path.join(DATA_DIR, "hedwig.sqlite3")
+
+STORE_LOADERS = {
+    "galleons": load_galleons,
+    "last_daily": load_last_daily,
+    "duel_cooldowns": load_duel_cooldowns,
+    "duels": load_duels,
+    "reminders": load_reminders,
+    "house_points": load_house_points,
+    "effects": load_effects,
+}
+
+class JsonStorage:
+    """The original layout: one JSON document per store, rewritten whole on save."""
+    name = "json"
+
+    def load(self, store: str):
+        STORE_LOADERS[store]()
+
+    def snapshot(self, store: str, keys):
+        """Serialize now (on the loop); return the write to run on the writer thread."""
+        path, dump = STORE_DUMPERS[store]
+        data = dump()
+        return lambda: write_json_file(path, data)
+
+    def save(self, store: str, keys) -> int:
+        return self.snapshot(store, keys)()
+
+    def close(self):
+        pass
+
+def _earliest_expiry(data: dict):
+    stamps = [e.expires_at for e in data["effects"] if e.expires_at]
+    return min(stamps) if stamps else None
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS galleons (user_id INTEGER PRIMARY KEY, balance INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS last_daily (user_id INTEGER PRIMARY KEY, collected_at TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS duel_cooldowns (user_id INTEGER PRIMARY KEY, dueled_at TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS duels (
+    challenger_id INTEGER PRIMARY KEY,
+    challenged_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    deadline TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reminders (user_id INTEGER PRIMARY KEY, remind_at TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS house_points (house TEXT PRIMARY KEY, points INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS effects (
+    user_id INTEGER PRIMARY KEY,
+    original_nick TEXT,
+    effects TEXT NOT NULL,
+    expires_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reminders_remind_at ON reminders(remind_at);
+CREATE INDEX IF NOT EXISTS idx_effects_expires_at ON effects(expires_at);
+"""
+
+# store -> (table, columns, encode(key, value) -> row, decode(row) -> (key, value))
+SQLITE_TABLES = {
+    "galleons": (
+        "galleons", ("user_id", "balance"),
+        lambda k, v: (int(k), int(v)),
+        lambda r: (int(r[0]), int(r[1])),
+    ),
+    "last_daily": (
+        "last_daily", ("user_id", "collected_at"),
+        lambda k, v: (int(k), v.isoformat()),
+        lambda r: (int(r[0]), datetime.fromisoformat(r[1])),
+    ),
+    "duel_cooldowns": (
+        "duel_cooldowns", ("user_id", "dueled_at"),
+        lambda k, v: (int(k), v.isoformat()),
+        lambda r: (int(r[0]), datetime.fromisoformat(r[1])),
+    ),
+    "duels": (
+        "duels", ("challenger_id", "challenged_id", "channel_id", "state", "step", "deadline"),
+        lambda k, v: (int(k), v["challenged"], v["channel"], v["state"], v["step"], v["deadline"]),
+        lambda r: (int(r[0]), {"challenged": r[1], "channel": r[2], "state": r[3], "step": r[4], "deadline": r[5]}),
+    ),
+    "reminders": (
+        "reminders", ("user_id", "remind_at"),
+        lambda k, v: (int(k), v),
+        lambda r: (int(r[0]), r[1]),
+    ),
+    "house_points": (
+        "house_points", ("house", "points"),
+        lambda k, v: (k, int(v)),
+        lambda r: (r[0], int(r[1])),
+    ),
+    "effects": (
+        "effects", ("user_id", "original_nick", "effects", "expires_at"),
+        lambda k, v: (int(k), v.get("original_nick"), json.dumps(v["effects"].pack()), _earliest_expiry(v)),
+        lambda r: (str(r[0]), {"original_nick": r[1], "effects": EffectStack.unpack(json.loads(r[2]))}),
+    ),
+}
+
+class SqliteStorage:
+    """Embedded SQLite in WAL mode: a flush upserts or deletes only the rows that changed."""
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        # used from the writer thread; the lock covers the odd startup call from elsewhere
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.migrate_from_json()
+
+    def load(self, store: str):
+        table, columns, _, decode = SQLITE_TABLES[store]
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall()
+        state = globals()[store]
+        if store != "house_points":
+            state.clear()
+        for row in rows:
+            key, value = decode(row)
+            # house points only ever holds the four known houses
+            if store == "house_points" and key not in state:
+                continue
+            state[key] = value
+        print(f"[Hedwig] loaded {len(rows)} {store} rows from {self.path}")
+
+    def snapshot(self, store: str, keys):
+        """Encode the changed rows now (on the loop); return the SQL to run on the writer thread."""
+        table, columns, encode, _ = SQLITE_TABLES[store]
+        state = globals()[store]
+        key_column = columns[0]
+        placeholders = ", ".join("?" for _ in columns)
+        upsert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        delete = f"DELETE FROM {table} WHERE {key_column} = ?"
+
+        replace_all = keys is None or None in keys
+        if replace_all:
+            # whole store changed (reset, bulk rewrite): replace the table
+            rows = [encode(k, v) for k, v in state.items()]
+            gone = []
+        else:
+            rows, gone = [], []
+            for key in keys:
+                if key in state:
+                    rows.append(encode(key, state[key]))
+                else:
+                    gone.append((key if store == "house_points" else int(key),))
+
+        def write():
+            with self.lock, self.conn:
+                if replace_all:
+                    self.conn.execute(f"DELETE FROM {table}")
+                if rows:
+                    self.conn.executemany(upsert, rows)
+                if gone:
+                    self.conn.executemany(delete, gone)
+            return sum(len(str(value)) for row in rows for value in row)
+        return write
+
+    def save(self, store: str, keys) -> int:
+        return self.snapshot(store, keys)()
+
+    def migrate_from_json(self):
+        """One-shot import of the legacy JSON files the first time the database is opened."""
+        with self.lock:
+            done = self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        if done:
+            return
+        legacy = JsonStorage()
+        migrated = []
+        for store, (path, _) in STORE_DUMPERS.items():
+            if not os.path.exists(path):
+                continue
+            legacy.load(store)
+            self.save(store, None)
+            migrated.append(store)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                (now_utc().isoformat(),),
+            )
+        if migrated:
+            print(f"[Hedwig] migrated {', '.join(migrated)} from JSON into {self.path}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def make_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_FILE)
+    return JsonStorage()
+
+# Startup is staged: the economy stores are loaded before the bot connects, so
+# !balance / !daily work from the first message. Effects are read in the
+# background once connected and hydrated per member on first touch (see
+# STARTUP: staged loading).
+CORE_STORES = ("galleons", "last_daily", "duel_cooldowns", "duels", "reminders", "house_points")
+
+@timed(PERSISTENCE_LOAD_SECONDS)
+def load_core_state():
+    for store in CORE_STORES:
+        storage.load(store)
+    rebuild_duel_index()
+    load_ledger()
+    galleon_ranking.rebuild(galleons)
+    startup_state["core_loaded"] = True
+
+# -------------------------
+# PERSISTENCE: galleon ledger
+# -------------------------
+# Every balance change is appended to a JSON-lines ledger as one record holding
+# the absolute balance after the change, so a transfer's two legs land in the
+# same line and replaying a record twice is harmless. Appends are buffered and
+# fsynced in small groups on the writer thread. Compaction snapshots the
+# `galleons` store and starts a new segment; startup loads the snapshot and
+# replays only the segments written after it. Older segments are kept for
+# LEDGER_KEEP_SEGMENTS rotations so !history can reach back past a compaction.
+LEDGER_SEGMENT_PREFIX = "galleons-ledger-"
+LEDGER_META_FILE = os.path.join(DATA_DIR, "galleons-ledger.json")
+LEDGER_COMMIT_DELAY = 0.05     # seconds an append may wait to share an fsync
+LEDGER_COMMIT_BATCH = 256      # ...or fewer, once this many lines are waiting
+LEDGER_COMPACT_ENTRIES = 5000
+LEDGER_COMPACT_SECONDS = 3600
+LEDGER_KEEP_SEGMENTS = 4
+HISTORY_LIMIT = 10
+
+ledger_state = {
+    "segment": 1,        # segment new records are appended to
+    "size": 0,           # bytes in that segment, including buffered lines
+    "seq": 0,            # last record number handed out
+    "replay_from": 1,    # first segment not covered by the galleons snapshot
+    "since_compaction": 0,
+    "compacted_at": time.monotonic(),
+}
+ledger_buffer = []        # encoded lines waiting for the next group commit
+ledger_unwritten = {}     # writer thread only: segment path -> bytes whose append failed
+ledger_index = {}         # user_id -> [(segment, offset), ...] oldest first
+ledger_commit_handle = None
+
+def ledger_path(segment: int) -> str:
+    return os.path.join(DATA_DIR, f"{LEDGER_SEGMENT_PREFIX}{segment:06d}.jsonl")
+
+def ledger_segments() -> list:
+    segments = []
+    for name in os.listdir(DATA_DIR):
+        if name.startswith(LEDGER_SEGMENT_PREFIX) and name.endswith(".jsonl"):
+            try:
+                segments.append(int(name[len(LEDGER_SEGMENT_PREFIX):-len(".jsonl")]))
+            except ValueError:
+                continue
+    return sorted(segments)
+
+def append_ledger(reason: str, changes: list):
+    """Queue one record: `changes` is [[user_id, delta, balance_after], ...]."""
+    global ledger_commit_handle
+    ledger_state["seq"] += 1
+    record = {"seq": ledger_state["seq"], "ts": now_utc().isoformat(), "reason": reason, "changes": changes}
+    line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+    location = (ledger_state["segment"], ledger_state["size"])
+    for user_id, _, _ in changes:
+        ledger_index.setdefault(user_id, []).append(location)
+    ledger_state["size"] += len(line)
+    ledger_state["since_compaction"] += 1
+    ledger_buffer.append(line)
+
+    if len(ledger_buffer) >= LEDGER_COMMIT_BATCH:
+        commit_ledger()
+        return
+    if ledger_commit_handle is None:
+        try:
+            ledger_commit_handle = asyncio.get_running_loop().call_later(LEDGER_COMMIT_DELAY, commit_ledger)
+        except RuntimeError:
+            commit_ledger()
+
+@timed(LEDGER_COMMIT_SECONDS)
+def _write_ledger(path: str, data: bytes) -> int:
+    """Runs on the writer thread: append a group of records and fsync once.
+
+    A group that fails is kept and written ahead of the next one, so records
+    land in order and at the offsets ledger_index already points at.
+    """
+    data = ledger_unwritten.pop(path, b"") + data
+    start = None
+    try:
+        start = os.path.getsize(path) if os.path.exists(path) else 0
+        with open(path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except Exception as e:
+        ledger_unwritten[path] = data
+        if start is not None:
+            # drop a partial append so the retry doesn't leave a torn line behind
+            with contextlib.suppress(OSError):
+                os.truncate(path, start)
+        persistence_stats["failed_writes"] += 1
+        print(f"[Hedwig] Failed to append to galleon ledger, will retry {len(data)} bytes: {e}")
+        return 0
+    persistence_stats["bytes_written"] += len(data)
+    return len(data)
+
+def commit_ledger():
+    """Hand every buffered record to the writer thread; returns its future (or None)."""
+    global ledger_commit_handle
+    if ledger_commit_handle is not None:
+        ledger_commit_handle.cancel()
+        ledger_commit_handle = None
+    if not ledger_buffer and not ledger_unwritten:
+        return None
+    data = b"".join(ledger_buffer)
+    ledger_buffer.clear()
+    return persistence_writer.submit(_write_ledger, ledger_path(ledger_state["segment"]), data)
+
+def _rotate_ledger(write_snapshot, new_segment: int, oldest_kept: int):
+    """Runs on the writer thread: snapshot first, then move the replay point past it."""
+    write_snapshot()
+    # a crash before this line just replays records the snapshot already holds
+    write_json_file(LEDGER_META_FILE, json.dumps({"replay_from": new_segment}))
+    ledger_unwritten.clear()  # the snapshot holds those balances now
+    open(ledger_path(new_segment), "ab").close()
+    for segment in ledger_segments():
+        if segment < oldest_kept:
+            os.remove(ledger_path(segment))
+
+def compact_ledger():
+    """Snapshot all balances and start a new ledger segment; returns the writer future."""
+    commit_ledger()
+    # the snapshot replaces any pending write-behind of the galleons store
+    dirty_keys.pop("galleons", None)
+    write_snapshot = storage.snapshot("galleons", None)
+
+    new_segment = ledger_state["segment"] + 1
+    oldest_kept = max(1, new_segment - LEDGER_KEEP_SEGMENTS)
+    ledger_state.update(segment=new_segment, size=0, replay_from=new_segment,
+                        since_compaction=0, compacted_at=time.monotonic())
+    for user_id in list(ledger_index):
+        kept = [loc for loc in ledger_index[user_id] if loc[0] >= oldest_kept]
+        if kept:
+            ledger_index[user_id] = kept
+        else:
+            del ledger_index[user_id]
+
+    def rotate():
+        try:
+            _rotate_ledger(write_snapshot, new_segment, oldest_kept)
+        except Exception as e:
+            persistence_stats["failed_writes"] += 1
+            print(f"[Hedwig] Failed to compact galleon ledger: {e}")
+    return persistence_writer.submit(rotate)
+
+def maybe_compact_ledger():
+    pending = ledger_state["since_compaction"]
+    if pending >= LEDGER_COMPACT_ENTRIES or (
+        pending and time.monotonic() - ledger_state["compacted_at"] >= LEDGER_COMPACT_SECONDS
+    ):
+        compact_ledger()
+
+def load_ledger():
+    """Replay the ledger onto the loaded galleons snapshot and rebuild the history index.
+
+    Runs on the writer thread after the stores are loaded. A torn last line
+    (crash mid-append) is cut off so new records start on a clean line.
+    """
+    global ledger_index
+    replay_from = 1
+    try:
+        if os.path.exists(LEDGER_META_FILE):
+            with open(LEDGER_META_FILE, "r", encoding="utf-8") as f:
+                replay_from = int(json.load(f).get("replay_from", 1))
+    except Exception as e:
+        print(f"[Hedwig] Failed to read galleon ledger meta, replaying everything: {e}")
+
+    segments = ledger_segments()
+    index, seq, replayed, size = {}, 0, 0, 0
+    for segment in segments:
+        with open(ledger_path(segment), "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            end = data.find(b"\n", offset)
+            try:
+                if end < 0:
+                    raise ValueError("unterminated record")
+                record = json.loads(data[offset:end])
+            except ValueError:
+                if segment == segments[-1]:
+                    with open(ledger_path(segment), "r+b") as f:
+                        f.truncate(offset)
+                    print(f"[Hedwig] dropped a torn galleon ledger record at {ledger_path(segment)}:{offset}")
+                    data = data[:offset]
+                    break
+                offset = len(data) if end < 0 else end + 1
+                continue
+
+            seq = max(seq, record.get("seq", 0))
+            changes = record.get("changes", [])
+            for user_id, _, _ in changes:
+                index.setdefault(user_id, []).append((segment, offset))
+            if segment >= replay_from:
+                if record.get("reason") == "reset":
+                    galleons.clear()
+                for user_id, _, balance in changes:
+                    galleons[int(user_id)] = int(balance)
+                replayed += 1
+            offset = end + 1
+        size = len(data)
+
+    current = max(segments[-1], replay_from) if segments else replay_from
+    ledger_index = index
+    ledger_state.update(
+        segment=current, size=size if segments and current == segments[-1] else 0,
+        seq=seq, replay_from=replay_from, since_compaction=replayed, compacted_at=time.monotonic(),
+    )
+    print(f"[Hedwig] replayed {replayed} galleon ledger records from segment {replay_from} "
+          f"({len(segments)} segments, {len(index)} accounts with history)")
+
+def _read_ledger_records(locations) -> list:
+    records = []
+    for segment, offset in locations:
+        try:
+            with open(ledger_path(segment), "rb") as f:
+                f.seek(offset)
+                records.append(json.loads(f.readline()))
+        except Exception as e:
+            print(f"[Hedwig] Failed to read ledger record {segment}:{offset}: {e}")
+    return records
+
+async def galleon_history(user_id: int, limit: int = HISTORY_LIMIT) -> list:
+    """The user's most recent ledger records, oldest first."""
+    locations = ledger_index.get(int(user_id), [])[-limit:]
+    if not locations:
+        return []
+    commit_ledger()
+    # queued behind the commit above, so every location is on disk by now
+    return await run_on_writer(_read_ledger_records, locations)
 
 # -------------------------
 # HELPERS
@@ -306,64 +1302,270 @@ def is_staff_allowed(member: discord.Member) -> bool:
     allowed_ids = {ROLE_IDS["prefects"], ROLE_IDS["head_of_house"]}
     return any(r.id in allowed_ids for r in member.roles)
 
+class MemberResolver:
+    """user_id -> (guild, member) across every guild, kept current by member events.
+
+    Cache misses first try the guilds' own member caches, then (for bulk jobs)
+    a bounded number of batched gateway member queries. Ids that still can't be
+    found are remembered for a while so bursts don't keep asking for them.
+    """
+    QUERY_BATCH = 100       # Discord's cap on user_ids per member query
+    MAX_QUERIES = 5         # per resolve_many() call
+    MISS_TTL_SECONDS = 600
+
+    def __init__(self):
+        self._members = {}  # user_id -> (guild, member)
+        self._misses = {}   # user_id -> monotonic time of the failed lookup
+
+    def __len__(self):
+        return len(self._members)
+
+    def remember(self, member: discord.Member):
+        self._members[member.id] = (member.guild, member)
+        self._misses.pop(member.id, None)
+
+    def forget(self, user_id: int):
+        self._members.pop(user_id, None)
+
+    def index_guild(self, guild: discord.Guild):
+        for m in guild.members:
+            self._members[m.id] = (guild, m)
+
+    def drop_guild(self, guild: discord.Guild):
+        for user_id in [uid for uid, (g, _) in self._members.items() if g.id == guild.id]:
+            del self._members[user_id]
+
+    def get(self, user_id: int):
+        hit = self._members.get(user_id)
+        if hit:
+            return hit[1]
+        for guild in school_guilds():
+            m = guild.get_member(user_id)
+            if m:
+                self.remember(m)
+                return m
+        return None
+
+    async def resolve_many(self, user_ids) -> dict:
+        """Resolve many ids at once; returns {user_id: member} for the ones found."""
+        found, missing = {}, []
+        now = time.monotonic()
+        for user_id in user_ids:
+            m = self.get(user_id)
+            if m:
+                found[user_id] = m
+            elif now - self._misses.get(user_id, -self.MISS_TTL_SECONDS) >= self.MISS_TTL_SECONDS:
+                missing.append(user_id)
+
+        queries = 0
+        for guild in school_guilds():
+            for i in range(0, len(missing), self.QUERY_BATCH):
+                if queries >= self.MAX_QUERIES:
+                    break
+                batch = [uid for uid in missing[i:i + self.QUERY_BATCH] if uid not in found]
+                if not batch:
+                    continue
+                queries += 1
+                try:
+                    members = await guild.query_members(user_ids=batch, limit=len(batch))
+                except Exception as e:
+                    print(f"[Hedwig] Member query failed in {guild}: {e}")
+                    continue
+                for m in members:
+                    self.remember(m)
+                    found[m.id] = m
+
+        for user_id in missing:
+            if user_id not in found:
+                self._misses[user_id] = now
+        return found
+
+member_resolver = MemberResolver()
+
 def get_member_from_id(user_id: int):
-    for guild in bot.guilds:
-        m = guild.get_member(user_id)
-        if m:
-            return m
-    return None
+    return member_resolver.get(user_id)
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def available(self) -> float:
+        """Tokens in the bucket right now (refilled up to date)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    async def take(self):
+        while True:
+            if self.available() >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Discord rate-limits member edits per guild. Every role/nickname change goes
+# through edit_member(), which waits on that guild's bucket first, so bursts (a
+# purge, a restart backlog) queue up here instead of collecting 429s.
+MEMBER_EDIT_RATE = 5.0   # edits per second, per guild
+MEMBER_EDIT_BURST = 5
+member_edit_buckets = {}  # guild_id -> TokenBucket
+
+async def wait_member_edit_slot(guild: discord.Guild):
+    bucket = member_edit_buckets.get(guild.id)
+    if bucket is None:
+        bucket = member_edit_buckets[guild.id] = TokenBucket(MEMBER_EDIT_RATE, MEMBER_EDIT_BURST)
+    await bucket.take()
+
+def cache_member_edit(edited: discord.Member):
+    """Fold a PATCH response into the cached member, ahead of its GUILD_MEMBER_UPDATE."""
+    cached = edited.guild.get_member(edited.id)
+    if cached is None or cached is edited:
+        return
+    cached._roles = edited._roles
+    cached.nick = edited.nick
 
-async def safe_add_role(member: discord.Member, role: discord.Role):
-    try:
-        await member.add_roles(role)
-    except discord.Forbidden:
-        print(f"Missing permissions to add role {role} to {member}.")
-    except Exception as e:
-        print("Error adding role:", e)
+async def edit_member(member: discord.Member, paced: bool = True, **changes) -> bool:
+    """Apply `changes` (roles=..., nick=...) in one PATCH. True if Discord accepted it.
 
-async def safe_remove_role(member: discord.Member, role: discord.Role):
+    Waits for the guild's bucket first unless the caller already did (paced=False).
+    """
+    if paced:
+        await wait_member_edit_slot(member.guild)
     try:
-        await member.remove_roles(role)
+        edited = await member.edit(**changes)
+        if edited is not None:
+            cache_member_edit(edited)
+        return True
     except discord.Forbidden:
-        print(f"Missing permissions to remove role {role} from {member}.")
+        print(f"[Hedwig] Forbidden to edit {', '.join(changes)} for {member.name}. Check bot role hierarchy.")
     except Exception as e:
-        print("Error removing role:", e)
+        print(f"[Hedwig] Failed to edit {', '.join(changes)} for {member.name}: {e}")
+    return False
 
-async def set_nickname(member: discord.Member, new_nick: str):
-    """Safely attempts to set a member's nickname, handling permissions and length."""
-    
-    # 1. Check for Server Owner (Highest Immunity)
-    if member.id == member.guild.owner_id:
-        print(f"[Hedwig] WARNING: Cannot set nickname for Server Owner ({member.name}). Skipping edit.")
-        return # Cannot send user message here as there is no ctx available
+NICKNAME_LIMIT = 32  # Discord's nickname length limit
 
-    try:
-        # 2. Check for Discord's 32-character limit
-        if new_nick and len(new_nick) > 32:
-            # Truncate the nickname if necessary
-            new_nick = new_nick[:32]
-        
-        # 3. Attempt the edit
-        await member.edit(nick=new_nick)
-        
-    except discord.Forbidden:
-        # This catches hierarchy issues or other permission errors.
-        print(f"[Hedwig] FATAL ERROR: Forbidden to change nickname for {member.name}. Check bot role hierarchy.")
-    except Exception as e:
-        print(f"[Hedwig] CRITICAL ERROR: Failed to change nickname for {member.name}. Reason: {e}")
+class GalleonRanking:
+    """Balances kept in leaderboard order as a sorted list of (-balance, user_id).
+
+    Updates are a binary search plus a list insert/delete, so reading the top k
+    is O(k) and a single user's rank is O(log n) -- no full sort per command.
+    """
+
+    def __init__(self):
+        self._order = []  # sorted (-balance, user_id)
+        self._keys = {}   # user_id -> its tuple in _order
+
+    def __len__(self):
+        return len(self._order)
+
+    def update(self, user_id: int, balance: int):
+        self.discard(user_id)
+        key = (-balance, user_id)
+        bisect.insort(self._order, key)
+        self._keys[user_id] = key
+
+    def discard(self, user_id: int):
+        key = self._keys.pop(user_id, None)
+        if key is not None:
+            del self._order[bisect.bisect_left(self._order, key)]
+
+    def rebuild(self, balances: dict):
+        self._order = sorted((-bal, uid) for uid, bal in balances.items())
+        self._keys = {uid: (neg, uid) for neg, uid in self._order}
+
+    def top(self, k: int):
+        return [(uid, -neg) for neg, uid in self._order[:k]]
+
+    def rank(self, user_id: int):
+        """1-based position, or None if the user has no account."""
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._order, key) + 1
+
+galleon_ranking = GalleonRanking()
 
 def get_balance(user_id: int) -> int:
     return galleons.get(int(user_id), 0)
 
-def add_galleons_local(user_id: int, amount: int):
+def set_balance(user_id: int, amount: int):
+    """Update a balance in memory and in the leaderboard index (the ledger persists it)."""
     user_id = int(user_id)
-    galleons[user_id] = get_balance(user_id) + int(amount)
-    save_galleons()
+    galleons[user_id] = amount
+    galleon_ranking.update(user_id, amount)
 
-def remove_galleons_local(user_id: int, amount: int):
-    user_id = int(user_id)
-    galleons[user_id] = max(0, get_balance(user_id) - int(amount))
-    save_galleons()
+def apply_galleon_changes(reason: str, deltas) -> list:
+    """Apply [(user_id, delta), ...] together and log them as one ledger record.
+
+    Balances never drop below zero. Returns the [user_id, delta, balance] rows recorded.
+    """
+    changes = []
+    for user_id, delta in deltas:
+        user_id = int(user_id)
+        before = get_balance(user_id)
+        after = max(0, before + int(delta))
+        set_balance(user_id, after)
+        changes.append([user_id, after - before, after])
+    append_ledger(reason, changes)
+    return changes
+
+# Commands move money through transfer / charge / credit. Each takes the locks of
+# the accounts it touches (in id order, so two transfers can't deadlock), checks
+# the balance and applies everything as one ledger record. A lock is dropped
+# again once nobody holds or waits for it.
+account_locks = {}  # user_id -> [asyncio.Lock, holders + waiters]
+
+@contextlib.asynccontextmanager
+async def lock_accounts(*user_ids):
+    ids = sorted({int(uid) for uid in user_ids})
+    for uid in ids:
+        account_locks.setdefault(uid, [asyncio.Lock(), 0])[1] += 1
+    acquired = []
+    try:
+        for uid in ids:
+            await account_locks[uid][0].acquire()
+            acquired.append(uid)
+        yield
+    finally:
+        for uid in reversed(acquired):
+            account_locks[uid][0].release()
+        for uid in ids:
+            entry = account_locks[uid]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del account_locks[uid]
+
+async def transfer(from_id: int, to_id: int, amount: int, reason: str = "pay") -> bool:
+    """Move `amount` between two accounts; False (and nothing changes) if the payer is short."""
+    amount = int(amount)
+    if amount <= 0 or int(from_id) == int(to_id):
+        return False
+    async with lock_accounts(from_id, to_id):
+        if get_balance(from_id) < amount:
+            return False
+        apply_galleon_changes(reason, [(from_id, -amount), (to_id, amount)])
+        return True
+
+async def charge(user_id: int, amount: int, reason: str) -> bool:
+    """Debit `amount` if the user can afford it; False (and nothing changes) otherwise."""
+    amount = int(amount)
+    async with lock_accounts(user_id):
+        if get_balance(user_id) < amount:
+            return False
+        if amount:
+            apply_galleon_changes(reason, [(user_id, -amount)])
+        return True
+
+async def credit(user_id: int, amount: int, reason: str) -> int:
+    """Add `amount` to the user's balance; returns the new balance."""
+    async with lock_accounts(user_id):
+        apply_galleon_changes(reason, [(user_id, int(amount))])
+        return get_balance(user_id)
 
 def make_effect_uid() -> str:
     return uuid.uuid4().hex
@@ -375,33 +1577,321 @@ def get_user_house(member: discord.Member):
             return name
     return None
 
-async def schedule_reminder(user_id: int, remind_at: datetime, recurring=False):
-    """Sleep until remind_at then send reminder if still valid."""
-    now = now_utc()
-    delay = (remind_at - now).total_seconds()
-    if delay <= 0:
-        return
+# -------------------------
+# HELPERS — outbound messages
+# -------------------------
+# Channel messages that can wait a moment go through a per-channel outbox
+# instead of straight to channel.send():
+#  - lines queued within OUTBOX_WINDOW_SECONDS of each other go out as one
+#    message (up to Discord's 2000 characters);
+#  - a REPLY (someone is waiting on it) flushes the outbox at once, taking any
+#    flavor text queued ahead of it along;
+#  - each outbox paces itself on a token bucket shaped like Discord's
+#    per-channel send limit. Once that is down to OUTBOX_RESERVE tokens,
+#    replies jump ahead of FLAVOR text, and flavor older than
+#    OUTBOX_FLAVOR_TTL_SECONDS is dropped rather than sent late.
+# Announcements that unfold over time (the duel countdown) use
+# edit_in_place() to grow one message instead of posting a line at a time.
+REPLY, FLAVOR = 0, 1
+OUTBOX_WINDOW_SECONDS = 0.5
+OUTBOX_SEND_RATE = 1.0        # Discord allows about 5 messages per 5 s per channel
+OUTBOX_SEND_BURST = 5
+OUTBOX_RESERVE = 2
+OUTBOX_FLAVOR_TTL_SECONDS = 30
+MESSAGE_LIMIT = 2000
+
+class ChannelOutbox:
+    """Pending plain-text sends for one channel, drained by a single task."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.bucket = TokenBucket(OUTBOX_SEND_RATE, OUTBOX_SEND_BURST)
+        self.pending = []  # [priority, queued_at, content, merge, future], in queue order
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def put(self, content: str, priority: int, merge: bool = True) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((priority, time.monotonic(), content, merge, future))
+        if priority == REPLY or not merge:
+            self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return future
+
+    def _take_batch(self) -> list:
+        now = time.monotonic()
+        if self.bucket.available() < OUTBOX_RESERVE + 1:
+            keep = []
+            for item in self.pending:
+                if item[0] == FLAVOR and now - item[1] > OUTBOX_FLAVOR_TTL_SECONDS:
+                    item[4].set_result(None)  # stale flavor: not worth a slot
+                else:
+                    keep.append(item)
+            # low on sends: replies go first, flavor waits its turn (stable sort)
+            self.pending = sorted(keep, key=lambda item: item[0])
+
+        batch, size = [], 0
+        for item in self.pending:
+            merge = item[3]
+            if batch and (not merge or not batch[-1][3] or size + 1 + len(item[2]) > MESSAGE_LIMIT):
+                break
+            batch.append(item)
+            size += len(item[2]) + (1 if size else 0)
+            if not merge:
+                break
+        del self.pending[:len(batch)]
+        return batch
+
+    async def _run(self):
+        while self.pending:
+            urgent = any(item[0] == REPLY or not item[3] for item in self.pending)
+            if not urgent:
+                remaining = self.pending[0][1] + OUTBOX_WINDOW_SECONDS - time.monotonic()
+                if remaining > 0:
+                    self.wakeup.clear()
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=remaining)
+                    continue
+            batch = self._take_batch()
+            if not batch:
+                continue
+            await self.bucket.take()
+            try:
+                message = await self.channel.send("\n".join(item[2] for item in batch))
+            except Exception as e:
+                print(f"[Hedwig] Failed to send to #{getattr(self.channel, 'name', self.channel.id)}: {e}")
+                message = None
+            for item in batch:
+                if not item[4].done():
+                    item[4].set_result(message)
+
+outboxes = {}           # channel_id -> ChannelOutbox
+sequence_messages = {}  # key -> message being grown by edit_in_place()
+
+def say(channel, content: str, priority: int = FLAVOR, merge: bool = True) -> asyncio.Future:
+    """Queue `content` for `channel`; await the result for the Message it went out in (None if dropped)."""
+    outbox = outboxes.get(channel.id)
+    if outbox is None or outbox.channel is not channel:
+        outbox = outboxes[channel.id] = ChannelOutbox(channel)
+    return outbox.put(content, priority, merge)
+
+async def edit_in_place(channel, key, content: str, priority: int = FLAVOR):
+    """Show `content` in the message kept under `key`: send it the first time, edit it after."""
+    message = sequence_messages.get(key)
+    if message is not None:
+        try:
+            await message.edit(content=content)
+            return message
+        except Exception as e:
+            print(f"[Hedwig] Couldn't edit announcement {key}, sending a new one: {e}")
+    message = await say(channel, content, priority, merge=False)
+    if message is not None:
+        sequence_messages[key] = message
+    return message
+
+def end_sequence(key):
+    sequence_messages.pop(key, None)
+
+async def drain_outboxes():
+    """Wait until every queued message has been sent (or dropped)."""
+    tasks_left = [o.task for o in outboxes.values() if o.task and not o.task.done()]
+    if tasks_left:
+        await asyncio.gather(*tasks_left, return_exceptions=True)
 
-    try:
-        await asyncio.sleep(delay)
-    except asyncio.CancelledError:
-        return  # cancelled safely (user replaced reminder)
+# -------------------------
+# SCHEDULER
+# -------------------------
+class DeadlineScheduler:
+    """One min-heap of timers (effect expiries, reminders) driven by a single task.
+
+    Each timer has a key so it can be replaced or cancelled. Cancelling only marks
+    the heap entry dead; dead entries are dropped when they reach the top or when
+    they make up most of the heap.
+    """
+
+    def __init__(self):
+        self._heap = []     # [deadline (monotonic), seq, key, callback, args]
+        self._entries = {}  # key -> live heap entry
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._firing = set()  # strong refs so fired jobs aren't garbage-collected mid-run
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def count(self, kind) -> int:
+        """Live timers whose key starts with `kind` (e.g. "reminder")."""
+        return sum(1 for key in self._entries if key[0] == kind)
+
+    def schedule(self, key, when: datetime, callback, *args):
+        """Run `await callback(*args)` at `when` (naive UTC), replacing any timer under `key`."""
+        self.cancel(key)
+        deadline = time.monotonic() + (when - now_utc()).total_seconds()
+        entry = [deadline, next(self._seq), key, callback, args]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # new earliest deadline: the runner is sleeping for too long
+            self._wakeup.set()
+
+    def cancel(self, key) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[3] = None
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [e for e in self._heap if e[3] is not None]
+            heapq.heapify(self._heap)
+        return True
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            while self._heap and self._heap[0][3] is None:
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
 
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            deadline, _, key, callback, args = heapq.heappop(self._heap)
+            self._entries.pop(key, None)
+            SCHEDULER_JOB_LATENESS.observe(max(0.0, time.monotonic() - deadline))
+            job = asyncio.create_task(self._fire(key, callback, args))
+            self._firing.add(job)
+            job.add_done_callback(self._firing.discard)
+
+    @timed(SCHEDULER_JOB_SECONDS, labels=lambda self, key, callback, args: {"job": key[0]})
+    async def _fire(self, key, callback, args):
+        try:
+            await callback(*args)
+        except Exception as e:
+            print(f"[Hedwig] Scheduled job {key} failed: {e}")
+
+scheduler = DeadlineScheduler()
+
+def schedule_reminder(user_id: int, remind_at: datetime, recurring=False):
+    """Queue the daily reminder for `user_id` at remind_at (replaces any existing one)."""
+    scheduler.schedule(("reminder", user_id), remind_at, deliver_reminder, user_id, recurring)
+
+def cancel_reminder_timer(user_id: int) -> bool:
+    return scheduler.cancel(("reminder", user_id))
+
+# Reminders that fall due within REMINDER_BATCH_WINDOW_SECONDS of the first one
+# go out together: one Gringotts message pinging up to REMINDER_MENTIONS_PER_MESSAGE
+# members, so the post-!daily peak costs a handful of sends instead of one each.
+# With HEDWIG_REMINDER_DM=1 members are DMed instead, through a paced queue;
+# anyone whose DMs are closed falls back to the channel ping.
+REMINDER_BATCH_WINDOW_SECONDS = float(os.getenv("HEDWIG_REMINDER_WINDOW", "30"))
+REMINDER_MENTIONS_PER_MESSAGE = 50  # ~23 chars each, well inside MESSAGE_LIMIT
+REMINDER_DM = os.getenv("HEDWIG_REMINDER_DM", "0") == "1"
+REMINDER_DM_RATE = 1.0  # DMs per second; Discord flags bots that DM in bursts
+REMINDER_DM_BURST = 5
+REMINDER_GIF = "https://media1.tenor.com/m/hDy33lPyiPgAAAAd/nickelback-how-you-remind-me.gif"
+
+reminder_batch = {}            # user_id -> True if it must go to the channel (DM failed)
+reminder_dm_closed = set()     # members whose DMs failed this session
+
+def reminder_embed(description: str) -> discord.Embed:
+    embed = discord.Embed(description=description, color=0xFFD700)  # Gold color
+    embed.set_image(url=REMINDER_GIF)
+    return embed
+
+class PacedDMQueue:
+    """DMs sent one at a time under a TokenBucket; `on_fail(member)` gets the ones that bounce."""
+
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.pending = collections.deque()  # (member, content, embed, on_fail)
+        self.task = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, member, content=None, embed=None, on_fail=None):
+        self.pending.append((member, content, embed, on_fail))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self.pending:
+            member, content, embed, on_fail = self.pending.popleft()
+            await self.bucket.take()
+            try:
+                await member.send(content=content, embed=embed)
+                REMINDER_MESSAGES.inc(delivery="dm")
+            except Exception as e:
+                print(f"[Hedwig] Couldn't DM {member}: {e}")
+                if on_fail is not None:
+                    on_fail(member)
+
+reminder_dms = PacedDMQueue(REMINDER_DM_RATE, REMINDER_DM_BURST)
+
+def queue_reminder(user_id: int, in_channel: bool = False):
+    """Add `user_id` to the open reminder batch, opening one if needed."""
+    reminder_batch[user_id] = reminder_batch.get(user_id, False) or in_channel
+    if ("reminder_batch",) not in scheduler:
+        when = now_utc() + timedelta(seconds=REMINDER_BATCH_WINDOW_SECONDS)
+        scheduler.schedule(("reminder_batch",), when, flush_reminder_batch)
+
+def reminder_dm_failed(member):
+    reminder_dm_closed.add(member.id)
+    queue_reminder(member.id, in_channel=True)
+
+async def flush_reminder_batch():
+    """Send everything in the open batch: DMs to the paced queue, the rest as grouped pings."""
+    batch = dict(reminder_batch)
+    reminder_batch.clear()
+
+    pings = []
+    for user_id, in_channel in batch.items():
+        member = get_member_from_id(user_id)
+        if not member:
+            continue
+        if REMINDER_DM and not in_channel and user_id not in reminder_dm_closed:
+            reminder_dms.put(member, embed=reminder_embed("💰 Your daily galleons are ready to collect in Gringotts!"),
+                             on_fail=reminder_dm_failed)
+        else:
+            pings.append(member.mention)
+
+    gringotts = bot.get_channel(GRINGOTTS_CHANNEL_ID)
+    if not pings or not gringotts:
+        return
+    embed = reminder_embed("💰 Your daily galleons are ready to collect!")
+    for i in range(0, len(pings), REMINDER_MENTIONS_PER_MESSAGE):
+        chunk = pings[i:i + REMINDER_MENTIONS_PER_MESSAGE]
+        try:
+            await gringotts.send(" ".join(chunk), embed=embed,
+                                 allowed_mentions=discord.AllowedMentions(users=True, roles=False, everyone=False))
+            REMINDER_MESSAGES.inc(delivery="channel")
+        except Exception as e:
+            print(f"[Hedwig] Failed to send {len(chunk)} reminders to Gringotts: {e}")
+
+async def deliver_reminder(user_id: int, recurring=False):
+    """Queue the reminder if it is still wanted, then schedule the next one."""
     # Still in reminders?
     if user_id not in reminders:
         return
 
-    # Send reminder in Gringotts
-    gringotts = bot.get_channel(GRINGOTTS_CHANNEL_ID)
-    if gringotts:
-        member = get_member_from_id(user_id)
-        if member:
-            embed = discord.Embed(
-                description=f"💰 {member.mention}, your daily galleons are ready to collect!",
-                color=0xFFD700  # Gold color
-            )
-            embed.set_image(url="https://media1.tenor.com/m/hDy33lPyiPgAAAAd/nickelback-how-you-remind-me.gif")
-            await gringotts.send(embed=embed)
+    # Goes out with the next Gringotts batch (or DM)
+    queue_reminder(user_id)
 
     if recurring:
         # Use the user's last_daily time (when they collected)
@@ -410,140 +1900,487 @@ async def schedule_reminder(user_id: int, remind_at: datetime, recurring=False):
         if next_time <= now_utc():
             next_time = now_utc() + timedelta(hours=24)
         reminders[user_id] = next_time.isoformat()
-        save_reminders()
-
-        # Cancel old task (if running) and replace it
-        existing_task = reminder_tasks.get(user_id)
-        if existing_task and not existing_task.done():
-            existing_task.cancel()
-
-        new_task = asyncio.create_task(schedule_reminder(user_id, next_time, recurring=True))
-        reminder_tasks[user_id] = new_task
+        mark_dirty("reminders", user_id)
+        schedule_reminder(user_id, next_time, recurring=True)
 
     else:
-        # One-off: remove after sending
+        # One-off: remove after queueing
         reminders.pop(user_id, None)
-        save_reminders()
-
-    # ✅ Clean up finished task reference (prevents memory buildup)
-    if user_id in reminder_tasks and reminder_tasks[user_id].done():
-        reminder_tasks.pop(user_id, None)
+        mark_dirty("reminders", user_id)
 
 # -------------------------
 # LIBRARIES
 # -------------------------
+# Spell and potion definitions live in items.json next to this file
+# (HEDWIG_ITEMS_FILE overrides the path). The file carries a version: save it
+# with a higher version and it is hot-reloaded on the next flush tick (or at
+# once with !reloaditems). Persisted effects only store (item, version, uid,
+# expires_at, meta); every version loaded since start stays in item_versions,
+# so an effect keeps the definition it was applied with until the next restart
+# rebinds it to the current file.
+try:
+    ITEMS_FILE = os.getenv("HEDWIG_ITEMS_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "items.json")
+except NameError:
+    ITEMS_FILE = os.path.join(os.getcwd(), "items.json")
+
+EFFECT_LIBRARY = {}  # spells, filled from ITEMS_FILE
+POTION_LIBRARY = {}  # potions, filled from ITEMS_FILE
+item_library = {"version": 0, "mtime": None}
+item_versions = {}   # version -> {item_id: definition}
+
+def validate_item(shelf: str, name: str, data: dict):
+    if not isinstance(data, dict):
+        raise ValueError(f"{shelf} item {name!r}: definition must be an object")
+    cost = data.get("cost")
+    if not isinstance(cost, int) or isinstance(cost, bool) or cost < 0:
+        raise ValueError(f"{shelf} item {name!r}: cost must be a non-negative int, got {cost!r}")
+    kind = data.get("kind")
+    if not isinstance(kind, str) or not kind:
+        raise ValueError(f"{shelf} item {name!r}: missing kind")
+
+def read_item_file(path: str = ITEMS_FILE) -> dict:
+    """Parse and validate an item file. Nothing is installed; raises ValueError/OSError."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    version = raw.get("version")
+    if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+        raise ValueError("items file needs an integer version >= 1")
+
+    lib = {"version": version, "mtime": os.path.getmtime(path)}
+    for shelf in ("spells", "potions"):
+        items = raw.get(shelf)
+        if not isinstance(items, dict):
+            raise ValueError(f"items file is missing its {shelf!r} section")
+        resolved = {}
+        for name, data in items.items():
+            validate_item(shelf, name, data)
+            data = dict(data)
+            # roles are named by their ROLE_IDS key so the ids stay in one place
+            role = data.pop("role", None)
+            if role is not None:
+                if role not in ROLE_IDS:
+                    raise ValueError(f"{shelf} item {name!r}: unknown role {role!r}")
+                data["role_id"] = ROLE_IDS[role]
+            resolved[name] = data
+        lib[shelf] = resolved
+    return lib
+
+def install_item_library(lib: dict):
+    # update in place: other modules' references (shop shelves) stay valid
+    EFFECT_LIBRARY.clear()
+    EFFECT_LIBRARY.update(lib["spells"])
+    POTION_LIBRARY.clear()
+    POTION_LIBRARY.update(lib["potions"])
+    # spells win a name clash, same as apply_effect_to_member's lookup
+    item_versions[lib["version"]] = {**lib["potions"], **lib["spells"]}
+    item_library.update(version=lib["version"], mtime=lib["mtime"])
+
+def item_definition(item_id: str, version: int = None):
+    """(version, definition) for `item_id` as of `version`; falls back to the current library."""
+    defs = item_versions.get(version)
+    if defs is None or item_id not in defs:
+        version = item_library["version"]
+        defs = item_versions.get(version, {})
+    return version, defs.get(item_id)
+
+install_item_library(read_item_file())
 
-EFFECT_LIBRARY = {
-    "aguamenti": {
-        "cost": 20, "kind": "nickname",
-        "prefix": "<:aguamenti:1415595031644999742>", "prefix_unicode": "🌊",
-        "suffix": "<:aguamenti:1415595031644999742>", "suffix_unicode": "🌊",
-        "description": "Surrounds the target's nickname with water."
-    },
-    "confundo": {
-        "cost": 25, "kind": "nickname",
-        "prefix": "<:confundo:1415595034769625199>", "prefix_unicode": "❓CONFUNDED - ",
-        "suffix": "", "suffix_unicode": "❓",
-        "description": "Prefixes CONFUNDED to the target's nickname."
-    },
-    "diffindo": {
-        "cost": 30, "kind": "truncate",
-        "length": 5,
-        "description": "Removes the last 5 characters of the target's nickname."
-    },
-    "ebublio": {
-        "cost": 20, "kind": "nickname",
-        "prefix": "<:ebublio:1415595038397693982>", "prefix_unicode": "🫧",
-        "suffix": "<:ebublio:1415595038397693982>", "suffix_unicode": "🫧",
-        "description": "Surrounds the target's nickname with bubbles."
-    },
-    "herbifors": {
-        "cost": 20, "kind": "nickname",
-        "prefix": "<:herbifors:1415595039882481674>", "prefix_unicode": "🌸",
-        "suffix": "<:herbifors:1415595039882481674>", "suffix_unicode": "🌸",
-        "description": "Gives the target a floral nickname."
-    },
-    "serpensortia": {
-        "cost": 20, "kind": "nickname",
-        "prefix": "<:serpensortia:1415595048124289075>", "prefix_unicode": "🐍",
-        "suffix": "<:serpensortia:1415595048124289075>", "suffix_unicode": "🐍",
-        "description": "Surrounds the target's nickname with snake emojis."
-    },
-    "tarantallegra": {
-        "cost": 20, "kind": "nickname",
-        "prefix": "<:tarantallegra:1415595049411936296>", "prefix_unicode": "💃",
-        "suffix": "<:tarantallegra:1415595049411936296>", "suffix_unicode": "💃",
-        "description": "Adds dancing emojis around the target's nickname."
-    },
-    "incendio": {
-        "cost": 25, "kind": "nickname",
-        "prefix": "<:incendio:1415595041191235718>", "prefix_unicode": "🔥",
-        "suffix": "<:incendio:1415595041191235718>", "suffix_unicode": "🔥",
-        "description": "Adds flames to the target's nickname."
-    },
-    "alohomora": {
-        "cost": 50, "kind": "role_alohomora",
-        "description": "Grants access to the Room of Requirement and starts the potion game."
-    },
-    "lumos": {
-        "cost": 15, "kind": "role_lumos",
-        "prefix": "<:lumos:1415595044357931100>", "prefix_unicode": "⭐",
-        "suffix_unicode": "⭐",
-        "duration": 86400,
-        "description": "Gives the Lumos role and a star prefix to the nickname."
-    },
-    # FIX: Successful Polyjuice Effect - Added to EFFECT_LIBRARY
-    "polyjuice": { 
-        "emoji": "<:polyjuice:1413679815520944158>",
-        "cost": 0,
-        "kind": "potion_polyjuice", 
-        "duration": 86400,
-        "description": "Successful Polyjuice: Grants temporary house role access."
-    },
-    # FIX: Polyjuice Misfire Effect - Added to EFFECT_LIBRARY
-    "polyfail_cat": {
-        "emoji": "🐱",
-        "cost": 0,
-        "kind": "nickname",
-        "prefix": "🐱",
-        "prefix_unicode": "🐱",
-        "suffix": "",
-        "duration": 86400,
-        "description": "Polyjuice misfire! Get whiskers for 24 hours.",
-    },
-    "finite": {
-        "cost": 10, "kind": "finite", "duration": 0,
-        "description": "Finite: removes the most recent spell/potion from a user when cast."
-    }
-} 
-
-POTION_LIBRARY = {
-    "felixfelicis": {
-        "emoji": "<:felixfelicis:1413679761036673186>",
-        "cost": 60, "kind": "potion_luck_good", "prefix": "<:felixfelicis:1414255673973280908>", "prefix_unicode": "🍀",
-        "description": "Felix Felicis: improves odds of winning the Alohomora potion game and adds 🍀 to the nickname."
-    },
-    "draughtlivingdeath": {
-        "emoji": "<:draughtoflivingdeath:1413679622041894985>", 
-        "cost": 50, "kind": "potion_luck_bad", "prefix": "<:draughtlivingdeath:1414255673973280910>", "prefix_unicode": "💀",
-        "description": "Draught of the Living Death: decreases odds of winning Alohomora and adds 💀 to the nickname."
-    },
-    "amortentia": {
-        "emoji": "<:amortentia:1413679525178380369>",
-        "cost": 70, "kind": "potion_amortentia", "prefix": "<:amortentia:1414255673973280909>", "prefix_unicode": "💖", "role_id": ROLE_IDS["amortentia"],
-        "description": "Amortentia: grants the Amortentia role (color) and adds 💖 to nickname."
-    },
-    "polyjuice": {
-        "emoji": "<:polyjuice:1413679815520944158>",
-        "cost": 80, "kind": "potion_polyjuice", "duration": 86400,
-        "description": "Polyjuice Potion: randomly grants access to a house common-room role for 24 hours (or backfires)."
-    },
-    "bezoar": {
-        "emoji": "<:bezoar:1415594792217350255>",
-        "cost": 30, "kind": "potion_bezoar",
-        "description": "Bezoar: removes active potion effects from the target instantly."
-    },
+# -------------------------
+# EFFECTS: records
+# -------------------------
+# An active effect is an EffectInstance: the instance's own fields plus a
+# reference to the item definition it was applied with (shared, never
+# copied). A member's effects form an EffectStack that keeps application
+# order (nicknames stack in that order) and indexes the same instances by
+# uid, item and kind, so "has Felix Felicis?" or "active Polyjuice?" never
+# scan the list.
+@dataclass(slots=True)
+class EffectInstance:
+    item: str
+    version: int
+    uid: str
+    expires_at: str = None  # ISO timestamp; None = until removed
+    meta: dict = None
+    definition: dict = None
+    source: str = None      # spell / potion; not persisted
+
+    def __post_init__(self):
+        if self.meta is None:
+            self.meta = {}
+        if self.definition is None:
+            self.definition = {}
+
+    @property
+    def kind(self):
+        return self.definition.get("kind")
+
+    @property
+    def role_id(self):
+        return self.definition.get("role_id")
+
+    @property
+    def length(self) -> int:
+        return self.definition.get("length", 0)
+
+    @property
+    def prefix_unicode(self) -> str:
+        return self.definition.get("prefix_unicode", "")
+
+    @property
+    def suffix_unicode(self) -> str:
+        return self.definition.get("suffix_unicode", "")
+
+    def pack(self) -> dict:
+        """Persisted form: a reference into the item library; defaults are left out."""
+        record = {"item": self.item, "v": self.version, "uid": self.uid}
+        if self.expires_at:
+            record["expires_at"] = self.expires_at
+        if self.meta:
+            record["meta"] = self.meta
+        return record
+
+    @classmethod
+    def unpack(cls, record: dict) -> "EffectInstance":
+        """Rebuild an instance from its persisted form (legacy full copies included)."""
+        if "item" in record:
+            item_id, wanted = record["item"], record.get("v")
+        else:
+            # older files copied the whole definition into every effect
+            item_id, wanted = record.get("effect") or record.get("name"), None
+        version, definition = item_definition(item_id, wanted)
+        if definition is None:
+            print(f"[Hedwig] Effect {record.get('uid')} refers to unknown item {item_id!r}; keeping it inert.")
+            definition = {k: v for k, v in record.items() if k not in ("item", "v", "uid", "expires_at", "meta")}
+        return cls(item_id, version, record["uid"], record.get("expires_at"), record.get("meta"), definition)
+
+
+class EffectStack:
+    """One member's active effects, in the order they were applied."""
+    __slots__ = ("_by_uid", "_by_item", "_by_kind")
+
+    def __init__(self, instances=()):
+        self._by_uid = {}   # uid -> instance; dict order is application order
+        self._by_item = {}  # item -> {uid: instance}
+        self._by_kind = {}  # kind -> {uid: instance}
+        for inst in instances:
+            self.add(inst)
+
+    def __iter__(self):
+        return iter(list(self._by_uid.values()))
+
+    def __len__(self) -> int:
+        return len(self._by_uid)
+
+    def __bool__(self) -> bool:
+        return bool(self._by_uid)
+
+    def add(self, inst: EffectInstance):
+        self._by_uid[inst.uid] = inst
+        self._by_item.setdefault(inst.item, {})[inst.uid] = inst
+        self._by_kind.setdefault(inst.kind, {})[inst.uid] = inst
+
+    def remove(self, uid: str):
+        """Drop and return the instance with `uid` (None if it isn't here)."""
+        inst = self._by_uid.pop(uid, None)
+        if inst is None:
+            return None
+        for index, key in ((self._by_item, inst.item), (self._by_kind, inst.kind)):
+            bucket = index[key]
+            del bucket[uid]
+            if not bucket:
+                del index[key]
+        return inst
+
+    def get(self, uid: str):
+        return self._by_uid.get(uid)
+
+    def last(self):
+        """The most recently applied effect, or None."""
+        return self._by_uid[next(reversed(self._by_uid))] if self._by_uid else None
+
+    def has(self, item: str) -> bool:
+        return item in self._by_item
+
+    def find(self, *items: str):
+        """The oldest active instance of any of `items`, or None."""
+        for item in items:
+            bucket = self._by_item.get(item)
+            if bucket:
+                return next(iter(bucket.values()))
+        return None
+
+    def of_kind(self, kind: str) -> list:
+        return list(self._by_kind.get(kind, {}).values())
+
+    def kinds(self):
+        return self._by_kind.keys()
+
+    def pack(self) -> list:
+        return [inst.pack() for inst in self._by_uid.values()]
+
+    @classmethod
+    def unpack(cls, records) -> "EffectStack":
+        return cls(EffectInstance.unpack(r) for r in records)
+
+# -------------------------
+# CATALOG
+# -------------------------
+# The shop is compiled once from the libraries into frozen, validated item
+# records, and each shelf's listing is rendered into embed pages the first time
+# it is shown. When a reloaded item file is installed, only the shelves and
+# detail cards whose records changed (a price, say) are re-rendered.
+# `!shop <item>` resolves names through a normalized name/alias index that also
+# answers prefix searches ("felix", "poly").
+SHOP_PAGE_CHARS = 3500  # embed descriptions cap at 4096
+SHOP_HIDDEN = {"polyfail_cat"}  # internal effect, never sold
+SHOP_ALIASES = {
+    "felix": "felixfelicis",
+    "liquidluck": "felixfelicis",
+    "livingdeath": "draughtlivingdeath",
+    "draughtoflivingdeath": "draughtlivingdeath",
+    "lovepotion": "amortentia",
 }
+SHOP_SHELVES = {
+    # shelf -> (library, title, footer line, embed colour)
+    "spells": (EFFECT_LIBRARY, "🪄 Spell Shop 🪄", "Use `!cast <spell> @user` to buy and cast spells!", 0x9B59B6),
+    "potions": (POTION_LIBRARY, "🍷 Potion Shop 🍷", "Use `!drink <potion> [@user]` to buy and drink potions.", 0x2ECC71),
+}
+
+@dataclass(frozen=True, slots=True)
+class ShopItem:
+    shelf: str
+    name: str
+    cost: int
+    kind: str
+    emoji: str
+    description: str
+
+    @property
+    def title(self) -> str:
+        return self.name.capitalize()
+
+    @property
+    def usage(self) -> str:
+        if self.shelf == "spells":
+            return f"!cast {self.name} @user"
+        return f"!drink {self.name} [@user]"
+
+def _shop_key(text: str) -> str:
+    return "".join(ch for ch in text.lower() if ch.isalnum())
+
+def compile_shop_item(shelf: str, name: str, data: dict) -> ShopItem:
+    """Validate one library entry and freeze it into a ShopItem."""
+    validate_item(shelf, name, data)
+    if shelf == "spells":
+        emoji = effect_emojis.get(name, data.get("prefix_unicode", ""))
+    else:
+        emoji = data.get("emoji") or data.get("prefix_unicode") or ""
+    return ShopItem(
+        shelf=shelf, name=name, cost=data["cost"], kind=data["kind"], emoji=emoji,
+        description=data.get("description", "No description available."),
+    )
+
+class ShopCatalog:
+    def __init__(self):
+        self.items = {}    # (shelf, name) -> ShopItem, in library order
+        self._index = {}   # normalized name/alias -> [(shelf, name)]
+        self._keys = []    # sorted index keys, for prefix search
+        self._pages = {}   # shelf -> [Embed]
+        self._details = {} # (shelf, name) -> Embed
+        self.compile()
+
+    @staticmethod
+    def build(libraries: dict):
+        """(items, index) compiled from {shelf: library}. Raises ValueError; changes nothing."""
+        items, index = {}, {}
+        for shelf, library in libraries.items():
+            for name, data in library.items():
+                if name in SHOP_HIDDEN:
+                    continue
+                items[(shelf, name)] = compile_shop_item(shelf, name, data)
+                index.setdefault(_shop_key(name), []).append((shelf, name))
+        for alias, name in SHOP_ALIASES.items():
+            targets = [key for key in items if key[1] == name]
+            if not targets:
+                raise ValueError(f"shop alias {alias!r} points at unknown item {name!r}")
+            refs = index.setdefault(_shop_key(alias), [])
+            refs.extend(t for t in targets if t not in refs)
+        return items, index
+
+    def compile(self):
+        self.install(*self.build({shelf: spec[0] for shelf, spec in SHOP_SHELVES.items()}))
+
+    def install(self, items: dict, index: dict):
+        # renders of records that didn't change stay valid
+        for shelf in list(self._pages):
+            if self.shelf(shelf) != [item for (s, _), item in items.items() if s == shelf]:
+                del self._pages[shelf]
+        for key in list(self._details):
+            if items.get(key) != self.items.get(key):
+                del self._details[key]
+        self.items, self._index = items, index
+        self._keys = sorted(index)
+
+    def shelf(self, shelf: str):
+        return [item for (s, _), item in self.items.items() if s == shelf]
+
+    def pages(self, shelf: str) -> list:
+        pages = self._pages.get(shelf)
+        if pages is None:
+            pages = self._pages[shelf] = self._render_shelf(shelf)
+        return pages
+
+    def _render_shelf(self, shelf: str) -> list:
+        _, title, footer, colour = SHOP_SHELVES[shelf]
+        chunks, current = [], ""
+        for item in self.shelf(shelf):
+            entry = f"{item.emoji} **{item.title}** — {item.cost} galleons\n{item.description}\n\n"
+            if current and len(current) + len(entry) > SHOP_PAGE_CHARS:
+                chunks.append(current)
+                current = ""
+            current += entry
+        chunks.append(current + footer)
+
+        pages = []
+        for i, chunk in enumerate(chunks, start=1):
+            page_title = title if len(chunks) == 1 else f"{title} ({i}/{len(chunks)})"
+            pages.append(discord.Embed(title=page_title, description=chunk, color=colour))
+        return pages
+
+    def detail(self, item: ShopItem):
+        key = (item.shelf, item.name)
+        embed = self._details.get(key)
+        if embed is None:
+            _, _, _, colour = SHOP_SHELVES[item.shelf]
+            embed = discord.Embed(title=f"{item.emoji} {item.title}".strip(), description=item.description, color=colour)
+            embed.add_field(name="Price", value=f"{item.cost} galleons")
+            embed.add_field(name="Shelf", value=item.shelf.capitalize())
+            embed.add_field(name="Use", value=f"`{item.usage}`", inline=False)
+            self._details[key] = embed
+        return embed
+
+    def lookup(self, query: str) -> list:
+        """Items named (or aliased) exactly `query`, else every item with a key starting with it."""
+        key = _shop_key(query)
+        if not key:
+            return []
+        found = self._index.get(key)
+        if found is None:
+            found = []
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i].startswith(key):
+                found.extend(ref for ref in self._index[self._keys[i]] if ref not in found)
+                i += 1
+        return [self.items[ref] for ref in found]
+
+shop_catalog = ShopCatalog()
+
+# -------------------------
+# ROLE INDEX
+# -------------------------
+# Reverse index of the roles Hedwig hands out (effect roles + house roles for
+# Polyjuice) -> ids of the members holding them. Built once per guild on ready
+# and kept current from member updates, so "who has Alohomora?" never has to
+# walk the whole member list.
+def _managed_role_ids() -> set:
+    return {
+        ROLE_IDS[name] for name in ("lumos", "alohomora", "gryffindor", "slytherin", "ravenclaw", "hufflepuff")
+    } | {
+        d["role_id"] for d in (*EFFECT_LIBRARY.values(), *POTION_LIBRARY.values()) if d.get("role_id")
+    }
+
+MANAGED_ROLE_IDS = _managed_role_ids()
+
+role_holders = {rid: set() for rid in MANAGED_ROLE_IDS}  # role_id -> {user_id}
+
+def refresh_managed_roles():
+    """Start indexing roles that a reloaded item library hands out."""
+    added = _managed_role_ids() - MANAGED_ROLE_IDS
+    if not added:
+        return
+    MANAGED_ROLE_IDS.update(added)
+    for role_id in added:
+        role_holders[role_id] = set()
+    for guild in school_guilds():
+        for m in guild.members:
+            for r in m.roles:
+                if r.id in added:
+                    role_holders[r.id].add(m.id)
+
+def items_file_changed() -> bool:
+    try:
+        return os.path.getmtime(ITEMS_FILE) != item_library["mtime"]
+    except OSError:
+        return False
+
+async def reload_item_library() -> str:
+    """Re-read ITEMS_FILE and install it if its version is newer. Returns a status line."""
+    try:
+        lib = await run_on_writer(read_item_file)
+    except (OSError, ValueError) as e:
+        # remember the broken file's mtime so the flush tick doesn't retry it forever
+        with contextlib.suppress(OSError):
+            item_library["mtime"] = os.path.getmtime(ITEMS_FILE)
+        print(f"[Hedwig] Item file rejected, keeping version {item_library['version']}: {e}")
+        return f"❌ Item file rejected, still on version {item_library['version']}: {e}"
+
+    if lib["version"] <= item_library["version"]:
+        item_library["mtime"] = lib["mtime"]
+        print(f"[Hedwig] Item file changed but is still version {lib['version']}; not reloaded.")
+        return f"⚠️ Item file is version {lib['version']}, current is {item_library['version']}. Bump the version to publish changes."
+
+    # the catalog (and its aliases) must build from the new file too; only then swap
+    try:
+        items, index = ShopCatalog.build({"spells": lib["spells"], "potions": lib["potions"]})
+    except ValueError as e:
+        item_library["mtime"] = lib["mtime"]
+        print(f"[Hedwig] Item file rejected by the shop, keeping version {item_library['version']}: {e}")
+        return f"❌ Item file rejected, still on version {item_library['version']}: {e}"
+
+    install_item_library(lib)
+    shop_catalog.install(items, index)
+    refresh_managed_roles()
+    print(f"[Hedwig] Item library reloaded: version {lib['version']} ({len(EFFECT_LIBRARY)} spells, {len(POTION_LIBRARY)} potions)")
+    return f"📚 Item library is now version {lib['version']} ({len(EFFECT_LIBRARY)} spells, {len(POTION_LIBRARY)} potions)."
+
+def note_role_holder(role_id: int, user_id: int, holds: bool):
+    holders = role_holders.get(role_id)
+    if holders is None:
+        return
+    if holds:
+        holders.add(user_id)
+    else:
+        holders.discard(user_id)
+
+def sync_member_roles(member: discord.Member):
+    """Bring the index in line with the member's current role list."""
+    held = {r.id for r in member.roles}
+    for role_id, holders in role_holders.items():
+        if role_id in held:
+            holders.add(member.id)
+        else:
+            holders.discard(member.id)
+
+def rebuild_role_index(guild: discord.Guild):
+    for holders in role_holders.values():
+        holders.clear()
+    for m in guild.members:
+        for r in m.roles:
+            if r.id in role_holders:
+                role_holders[r.id].add(m.id)
+
+def role_holder_members(guild: discord.Guild, role: discord.Role):
+    """Members currently holding a managed `role` (falls back to role.members otherwise)."""
+    if role.id not in role_holders:
+        return list(role.members)
+    members = []
+    for user_id in list(role_holders[role.id]):
+        m = guild.get_member(user_id)
+        if m:
+            members.append(m)
+        else:
+            role_holders[role.id].discard(user_id)
+    return members
 
 # -------------------------
 # APPLY / REMOVE EFFECTS
@@ -554,6 +2391,8 @@ async def apply_effect_to_member(member: discord.Member, effect_name: str, sourc
     Applies an effect to a member, updating roles, nickname, and persistence.
     If 'expires_at' is provided, it takes precedence over calculated duration.
     """
+    await ensure_member_effects(member)
+
     # safety: ensure the effect exists in either library
     effect_def = EFFECT_LIBRARY.get(effect_name) or POTION_LIBRARY.get(effect_name)
     if not effect_def:
@@ -574,11 +2413,6 @@ async def apply_effect_to_member(member: discord.Member, effect_name: str, sourc
 
     uid = f"{effect_name}_{int(time.time())}"
 
-    # Use effect_def properties (minor simplification)
-    emoji_custom = effect_def.get("emoji", "")
-    prefix_unicode = effect_def.get("prefix_unicode", "")
-    suffix_unicode = effect_def.get("suffix_unicode", "")
-
     # --- Effect Persistence and Initialization ---
     if member.id not in active_effects:
         # Load persistent data or initialize new entry
@@ -591,7 +2425,7 @@ async def apply_effect_to_member(member: discord.Member, effect_name: str, sourc
             # effect, their display_name is wrong. This is standard behavior for bots
             # that don't track original name upon joining. We rely on the stored 'effects'
             # data for "original_nick" to be right if they've had an effect before.
-            active_effects[member.id] = {"original_nick": member.display_name, "effects": []}
+            active_effects[member.id] = {"original_nick": member.display_name, "effects": EffectStack()}
 
     # --- Special handling for Diffindo (truncate nickname) ---
     if effect_def.get("kind") == "truncate":
@@ -605,45 +2439,38 @@ async def apply_effect_to_member(member: discord.Member, effect_name: str, sourc
             meta["removed_part"] = removed_part
 
     # --- Create Effect Entry ---
-    entry = {
-        "uid": uid,
-        "effect": effect_name,
-        "name": effect_name,
-        "source": source,
-        # Use final_expires_at here:
-        "expires_at": final_expires_at.isoformat() if final_expires_at else None,
-        **effect_def,
-        "prefix_custom": emoji_custom,
-        "prefix_unicode": prefix_unicode,
-        "suffix_unicode": suffix_unicode,
-        "meta": meta or {}
-    }
+    entry = EffectInstance(
+        effect_name, item_library["version"], uid,
+        final_expires_at.isoformat() if final_expires_at else None,
+        meta, effect_def, source=source,
+    )
 
     # Add role immediately if relevant (This is duplicated logic, but left for compatibility)
-    role_id = entry.get("role_id")
+    role_id = entry.role_id
     if role_id:
         role = member.guild.get_role(role_id)
-        if role and role not in member.roles:
-            await safe_add_role(member, role)
+        if role:
+            queue_role_change(member, role, add=True)
 
     # Add to active effects
-    active_effects[member.id]["effects"].append(entry)
+    active_effects[member.id]["effects"].add(entry)
 
     # Persist
     effects[str(member.id)] = active_effects[member.id]
-    save_effects()
+    mark_dirty("effects", str(member.id))
 
     # schedule expiry for any temporary effect
     if final_expires_at:
-        asyncio.create_task(schedule_expiry(member.id, uid, final_expires_at))
+        schedule_expiry(member.id, uid, final_expires_at)
 
     # Update nickname/roles
     await update_member_display(member)
 
-async def schedule_expiry(user_id: int, uid: str, expires_at: datetime):
-    delta = (expires_at - now_utc()).total_seconds()
-    if delta > 0:
-        await asyncio.sleep(delta)
+def schedule_expiry(user_id: int, uid: str, expires_at: datetime):
+    """Queue the effect's expiry on the shared scheduler (past deadlines fire right away)."""
+    scheduler.schedule(("effect", user_id, uid), expires_at, run_expiry, user_id, uid)
+
+async def run_expiry(user_id: int, uid: str):
     member = get_member_from_id(user_id)
     if member:
         await expire_effect(member, uid)
@@ -653,16 +2480,18 @@ async def expire_effect(member: discord.Member, uid: str):
     global active_potions
     global effects
     global active_effects
+
+    await ensure_member_effects(member)
+
+    # expired early (Finite, Bezoar, !leaveroom...): drop the pending timer
+    scheduler.cancel(("effect", member.id, uid))
     
     if member.id not in active_effects:
         effects.pop(str(member.id), None)
-        save_effects()
+        mark_dirty("effects", str(member.id))
         return
 
-    expired = next((e for e in active_effects[member.id]["effects"] if e["uid"] == uid), None)
-    active_effects[member.id]["effects"] = [
-        e for e in active_effects[member.id]["effects"] if e["uid"] != uid
-    ]
+    expired = active_effects[member.id]["effects"].remove(uid)
 
     # --- STATE AND PERSISTENCE CLEANUP ---
     if active_effects.get(member.id, {}).get("effects"):
@@ -671,10 +2500,10 @@ async def expire_effect(member: discord.Member, uid: str):
         active_effects.pop(member.id, None) 
         effects.pop(str(member.id), None)
         
-    save_effects()
+    mark_dirty("effects", str(member.id))
 
     if expired:
-        effect_name = expired.get("effect")
+        effect_name = expired.item
         
         # --- ALOHOMORA SPECIAL CLEANUP (Definitive Role Removal + State) ---
         if effect_name == "alohomora":
@@ -682,8 +2511,8 @@ async def expire_effect(member: discord.Member, uid: str):
             alohomora_rid = ROLE_IDS.get("alohomora") 
             if alohomora_rid:
                 role = member.guild.get_role(alohomora_rid)
-                if role and role in member.roles:
-                    await safe_remove_role(member, role) # This must work now.
+                if role:
+                    queue_role_change(member, role, add=False) # This must work now.
 
             # 2. Clear the global room reservation and potion game state
             if current_room_user == member.id:
@@ -695,130 +2524,218 @@ async def expire_effect(member: discord.Member, uid: str):
             # 3. Announce room is available
             dueling_club = bot.get_channel(DUELING_CLUB_ID)
             if dueling_club:
-                await dueling_club.send("You hear a soft rumbling inside of the walls...")
+                say(dueling_club, "You hear a soft rumbling inside of the walls...")
         # -----------------------------------
 
         # --- Handle generic roles (for timed effects that stored a role_id) ---
         # This block now handles all non-alohomora roles that stored a role_id
-        role_id = expired.get("role_id")
+        role_id = expired.role_id
         if role_id and role_id != ROLE_IDS.get("alohomora"): # Avoid double-removal check
             role = member.guild.get_role(role_id)
-            if role and role in member.roles:
-                await safe_remove_role(member, role)
+            if role:
+                queue_role_change(member, role, add=False)
 
-        if expired.get("kind") == "role_lumos":
+        if expired.kind == "role_lumos":
             lumos_rid = ROLE_IDS.get("lumos")
             if lumos_rid:
                 lumos_role = member.guild.get_role(lumos_rid)
-                if lumos_role and lumos_role in member.roles:
-                    await safe_remove_role(member, lumos_role)
+                if lumos_role:
+                    queue_role_change(member, lumos_role, add=False)
         
         # --- Handle Polyjuice role removal ---
-        if expired.get("kind") == "potion_polyjuice":
-            chosen = expired.get("meta", {}).get("polyhouse")
+        if expired.kind == "potion_polyjuice":
+            chosen = expired.meta.get("polyhouse")
             if chosen and chosen in ROLE_IDS:
                 role = member.guild.get_role(ROLE_IDS[chosen])
-                if role and role in member.roles:
-                    await safe_remove_role(member, role)
+                if role:
+                    queue_role_change(member, role, add=False)
 
         # --- Handle truncate restore (Diffindo) ---
-        if expired.get("kind") == "truncate":
-            removed = expired.get("meta", {}).get("removed_part")
+        if expired.kind == "truncate":
+            removed = expired.meta.get("removed_part")
             if removed:
                 if member.id in active_effects:
                     orig = active_effects[member.id].get("original_nick", "") or ""
                     if not orig.endswith(removed):  # prevent duplicates
                         active_effects[member.id]["original_nick"] = orig + removed
                         effects[str(member.id)] = active_effects[member.id]
-                        save_effects()
+                        mark_dirty("effects", str(member.id))
                 else:
                     # fallback: just restore directly
                     effects[str(member.id)] = {
                         "original_nick": member.display_name + removed,
-                        "effects": []
+                        "effects": EffectStack()
                     }
-                    save_effects()
+                    mark_dirty("effects", str(member.id))
 
     # Finally, refresh display/nick
     await update_member_display(member)
 
-async def recompute_nickname(member: discord.Member):
-    data = active_effects.get(member.id)
-    if not data:
-        # If no active effects, reset to original display name.
-        if member.display_name != member.name:
-             await set_nickname(member, None)
-        return
+# member_id -> nickname Hedwig last pushed (None = cleared). Lets repeated
+# refreshes skip the REST call before the gateway echoes the change back.
+last_pushed_nicks = {}
 
-    # Start with the member's current display name, which is the most reliable base.
-    base_name = data.get("original_nick", member.display_name)
-    
-    # We need to find the *true* base name, without any effects applied yet.
-    # The safest way is to clear all and re-apply.
-    await set_nickname(member, base_name)
-    
-    # Now that the nickname is reset, get the display name and build from there.
-    display_name = member.display_name
-    
-    # Apply effects in order (stackable)
-    for e in data["effects"]:
-        kind = e.get("kind")
+def compute_nickname(base_name: str, effect_entries) -> str:
+    """Pure: the nickname `base_name` wears with `effect_entries` applied in order (stackable)."""
+    display_name = base_name
+    for e in effect_entries:
+        kind = e.kind
 
         if kind == "nickname":
-            prefix = e.get("prefix_unicode", "")
-            suffix = e.get("suffix_unicode", "")
-            display_name = f"{prefix}{display_name}{suffix}"
+            display_name = f"{e.prefix_unicode}{display_name}{e.suffix_unicode}"
 
         elif kind == "truncate":
-            length = e.get("length", 0)
+            length = e.length
             if length and len(display_name) > length:
                 display_name = display_name[:-length]
 
         elif kind == "role_lumos":
-            prefix = e.get("prefix_unicode", "")
+            prefix = e.prefix_unicode
             if prefix:
                 display_name = f"{prefix}{display_name}"
 
         elif kind and kind.startswith("potion_"):
-            prefix = e.get("prefix_unicode", "")
+            prefix = e.prefix_unicode
             if prefix:
                 display_name = f"{prefix}{display_name}"
-    
-    await set_nickname(member, display_name)
 
+    return display_name[:NICKNAME_LIMIT]
 
-async def update_member_display(member: discord.Member):
-    """Refresh nickname and roles from active effects."""
-    user_effects = active_effects.get(member.id, {}).get("effects", [])
+def target_nickname(member: discord.Member):
+    """The nickname the member should have right now; None means no server nickname."""
+    data = active_effects.get(member.id)
+    if not data:
+        return None
+    return compute_nickname(data.get("original_nick") or member.display_name, data["effects"])
+
+
+# -------------------------
+# DISPLAY UPDATE QUEUE
+# -------------------------
+# Role and nickname changes are collected per member for a short window and
+# then applied as one net batch: the final role set and nickname go out in a
+# single member edit (none if the cached member already matches), so purging N
+# effects costs one API call, same as purging one. Within a window the last
+# request for a role wins, which matches what applying the calls one by one
+# would have left behind.
+DISPLAY_DEBOUNCE_SECONDS = 0.25
+
+pending_display = {}  # member_id -> {"member": Member, "roles": {role_id: (Role, add)}, "handle": TimerHandle}
+display_locks = {}    # member_id -> [asyncio.Lock, flushes holding or waiting]
+display_flushes = set()  # strong refs so flush tasks aren't garbage-collected mid-run
+
+def _pending_display_for(member: discord.Member) -> dict:
+    pending = pending_display.get(member.id)
+    if pending is None:
+        pending = {"member": member, "roles": {}, "handle": None}
+        pending_display[member.id] = pending
+    else:
+        pending["member"] = member  # keep the freshest object
+    if pending["handle"] is None:
+        loop = asyncio.get_running_loop()
+        pending["handle"] = loop.call_later(
+            DISPLAY_DEBOUNCE_SECONDS,
+            lambda: _start_display_flush(member.id),
+        )
+    return pending
+
+def _start_display_flush(member_id: int):
+    task = asyncio.create_task(flush_member_display(member_id))
+    display_flushes.add(task)
+    task.add_done_callback(display_flushes.discard)
+
+def queue_role_change(member: discord.Member, role: discord.Role, add: bool = True):
+    """Queue adding (or removing) `role`; applied with the member's next display flush."""
+    if role is None:
+        return
+    pending = _pending_display_for(member)
+    pending["roles"].pop(role.id, None)  # re-insert so ordering follows the latest request
+    pending["roles"][role.id] = (role, add)
 
-    # First, handle roles, as they are independent of the nickname.
-    # Add all necessary roles for the active effects.
-    for e in user_effects:
-        kind = e.get("kind")
+def effect_roles(member: discord.Member):
+    """Roles the member's active effects call for."""
+    roles = []
+    data = active_effects.get(member.id)
+    for e in (data["effects"] if data else ()):
+        kind = e.kind
+        role = None
         if kind == "role_lumos":
             role = member.guild.get_role(ROLE_IDS["lumos"])
-            if role and role not in member.roles:
-                await safe_add_role(member, role)
         elif kind == "potion_amortentia":
-            rid = e.get("role_id")
-            role = member.guild.get_role(rid)
-            if role and role not in member.roles:
-                await safe_add_role(member, role)
+            role = member.guild.get_role(e.role_id)
         elif kind == "role_alohomora":
             role = discord.utils.get(member.guild.roles, name=ALOHOMORA_ROLE_NAME)
-            if role and role not in member.roles:
-                await safe_add_role(member, role)
         elif kind == "potion_polyjuice":
-            chosen = e.get("meta", {}).get("polyhouse")
+            chosen = e.meta.get("polyhouse")
             if chosen and chosen in ROLE_IDS:
                 role = member.guild.get_role(ROLE_IDS[chosen])
-                if role and role not in member.roles:
-                    await safe_add_role(member, role)
+        if role:
+            roles.append(role)
+    return roles
+
+async def update_member_display(member: discord.Member):
+    """Refresh nickname and roles from active effects (debounced, see above)."""
+    # Add all necessary roles for the active effects; the nickname is
+    # recomputed from the final effect stack when the batch is flushed.
+    _pending_display_for(member)
+    for role in effect_roles(member):
+        queue_role_change(member, role, add=True)
+
+async def flush_member_display(member_id: int):
+    """Apply the member's final role set and nickname in a single edit (or none)."""
+    pending = pending_display.pop(member_id, None)
+    if pending is None:
+        return
+    # One flush per member at a time, so a later batch starts from the roles this
+    # one leaves behind instead of reverting them.
+    entry = display_locks.setdefault(member_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            await apply_member_display(pending)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del display_locks[member_id]
+
+async def apply_member_display(pending: dict):
+    member = pending["member"]
+    await wait_member_edit_slot(member.guild)
+    # read the roles only now: the wait can be long, and the edit replaces the
+    # whole list, so anything changed meanwhile (by a mod, say) must be in it
+    member = member.guild.get_member(member.id) or member
+
+    # the edit replaces the whole role list; @everyone is implicit and can't be sent
+    current = {r.id: r for r in member.roles if r.id != member.guild.id}
+    final = dict(current)
+    for role_id, (role, add) in pending["roles"].items():
+        if add:
+            final[role_id] = role
+        else:
+            final.pop(role_id, None)
 
-    # Now, recompute and set the nickname based on the roles that were added.
-    await recompute_nickname(member)
+    changes = {}
+    if final.keys() != current.keys():
+        changes["roles"] = list(final.values())
+
+    target = target_nickname(member)
+    if target != last_pushed_nicks.get(member.id, member.nick):
+        if member.id == member.guild.owner_id:
+            print(f"[Hedwig] WARNING: Cannot set nickname for Server Owner ({member.name}). Skipping edit.")
+        else:
+            changes["nick"] = target
+
+    if not changes or not await edit_member(member, paced=False, **changes):
+        return
+    for role_id in final.keys() - current.keys():
+        note_role_holder(role_id, member.id, True)
+    for role_id in current.keys() - final.keys():
+        note_role_holder(role_id, member.id, False)
+    if "nick" in changes:
+        last_pushed_nicks[member.id] = target
 
 @bot.command(name="force_alohomora")
+@track_command
 async def force_alohomora(ctx, member: discord.Member):
     """Staff only: Forcefully grants a user access to the Room of Requirement."""
     if not is_staff_allowed(ctx.author):
@@ -831,11 +2748,12 @@ async def force_alohomora(ctx, member: discord.Member):
         old_occupant = ctx.guild.get_member(current_room_user)
         if old_occupant and old_occupant.id in active_effects:
             # Find their alohomora UID to expire it properly
-            alo_effect = next((e for e in active_effects[old_occupant.id]["effects"] if e["effect"] == "alohomora"), None)
+            alo_effect = active_effects[old_occupant.id]["effects"].find("alohomora")
             if alo_effect:
-                await expire_effect(old_occupant, alo_effect["uid"])
+                await expire_effect(old_occupant, alo_effect.uid)
         
-        await ctx.send(f"🧹 Clearing the previous occupant to make way for {member.display_name}...")
+        # goes out together with the rumbling expire_effect just queued
+        await say(ctx.channel, f"🧹 Clearing the previous occupant to make way for {member.display_name}...", REPLY)
 
     # 2. Reset any specific alohomora cooldown for the target
     if member.id in alohomora_cooldowns:
@@ -861,59 +2779,206 @@ async def force_alohomora(ctx, member: discord.Member):
     await ctx.send(f"🪄 **Staff Override:** The Room of Requirement has recognized {member.mention}. The door is now open!")
 
 # -------------------------
-# DUEL SEQUENCE
-# -------------------------
-
-async def start_duel_sequence(ctx, challenger, challenged):
-    outcomes = [
-        "casts Expelliarmus on",
-        "casts Stupefy on",
-        "casts Impedimenta on",
-        "casts Petrificus Totalus on",
-        "casts Confundo on"
-    ]
-
-    await ctx.send(f"💥 WELCOME TO THE DUEL! 💥\n**{challenger.mention}** vs **{challenged.mention}**")
-    await asyncio.sleep(10)
-    await ctx.send("Wands at the ready!")
-    await asyncio.sleep(5)
-    await ctx.send(f"*{challenger.display_name} and {challenged.display_name} lift their wands, turn their backs, and begin walking to the end...*")
-    await asyncio.sleep(3)
-    await ctx.send("On the count of three, type `!duel cast` to cast your spell!")
-    await asyncio.sleep(5)
-    await ctx.send("Three...")
-    await asyncio.sleep(2)
-    await ctx.send("Two...")
-    await asyncio.sleep(1)
-    await ctx.send("One... **GO**!")
-
-    winner = None
-    loser = None
-    
+# MESSAGE ROUTING
+# -------------------------
+# Messages a specific member is expected to send in a specific channel (a
+# duellist's cast) are looked up by (channel_id, author_id) in on_message and
+# handed straight to their handler, before the command parser. One dict
+# lookup per message, however many duels are running; the timeouts that go
+# with a route live on the shared scheduler, not here.
+message_routes = {}  # (channel_id, author_id) -> (triggers, handler)
+
+def add_message_route(channel_id: int, author_id: int, triggers, handler):
+    """Send `author_id`'s messages in `channel_id` whose text is one of `triggers` to `handler(message)`."""
+    message_routes[(channel_id, author_id)] = (frozenset(triggers), handler)
+
+def remove_message_route(channel_id: int, author_id: int):
+    message_routes.pop((channel_id, author_id), None)
+
+async def dispatch_routed_message(message: discord.Message) -> bool:
+    """Run the route for this message, if there is one; True if it was handled."""
+    route = message_routes.get((message.channel.id, message.author.id))
+    if route is None:
+        return False
+    triggers, handler = route
+    if " ".join(message.content.lower().split()) not in triggers:
+        return False
     try:
-        def check(m):
-            return m.content.lower() == '!duel cast' and m.author in [challenger, challenged] and m.channel == ctx.channel
+        await handler(message)
+    except Exception as e:
+        print(f"[Hedwig] Routed message from {message.author.id} failed: {e}")
+    return True
 
-        msg = await bot.wait_for('message', check=check, timeout=10.0)
-        winner = msg.author
-        loser = challenger if winner == challenged else challenged
+# -------------------------
+# DUEL STATE MACHINE
+# -------------------------
+# A duel is a small persisted record that the shared scheduler moves along;
+# no coroutine sleeps through it and nothing waits on a message listener.
+#   challenged -> (!duelconfirm) countdown -> (last line) open -> resolved
+# `step` is the countdown line due at `deadline`; the timer for a record is
+# keyed by its challenger and carries the (state, step) it was set for, so a
+# timer that lost a race (a cast, a newer step) finds the record moved on and
+# does nothing. Records survive a restart: pending challenges keep their
+# expiry, and a countdown or open duel carries on where it was, unless we were
+# down long enough that it makes no sense any more.
+DUEL_CHALLENGE_SECONDS = 300      # how long a challenge waits for !duelconfirm
+DUEL_CAST_WINDOW_SECONDS = 10     # "GO!" -> draw
+DUEL_RESUME_GRACE_SECONDS = 60    # later than this after a restart: call it off
+DUEL_PRIZE = 100
+DUEL_CAST_TRIGGERS = ("!duel cast", "!duelcast")
+
+# (line, seconds until the next one); the last line opens the cast window
+DUEL_COUNTDOWN = (
+    ("💥 WELCOME TO THE DUEL! 💥\n**{challenger.mention}** vs **{challenged.mention}**", 10),
+    ("Wands at the ready!", 5),
+    ("*{challenger.display_name} and {challenged.display_name} lift their wands, turn their backs, and begin walking to the end...*", 3),
+    ("On the count of three, type `!duel cast` to cast your spell!", 5),
+    ("Three...", 2),
+    ("Two...", 1),
+    ("One... **GO**!", DUEL_CAST_WINDOW_SECONDS),
+)
+
+DUEL_OUTCOMES = [
+    "casts Expelliarmus on",
+    "casts Stupefy on",
+    "casts Impedimenta on",
+    "casts Petrificus Totalus on",
+    "casts Confundo on"
+]
 
-        random_spell = random.choice(outcomes)
-        await ctx.send(f"*{winner.display_name} {random_spell} {loser.display_name} and successfully disarms them!*")
-        add_galleons_local(winner.id, 100)
-        await ctx.send(f"🎉 Congratulations **{winner.mention}**! You've won **100 Galleons**!")
-        
-    except asyncio.TimeoutError:
-        await ctx.send("❌ No one cast their spell in time! The duel is a draw. No galleons were won.")
-        winner = challenger
-        loser = challenged
+def rebuild_duel_index():
+    duel_by_challenged.clear()
+    for challenger_id, duel in duels.items():
+        duel_by_challenged[duel["challenged"]] = challenger_id
+
+def duel_for(user_id: int):
+    """(challenger_id, record) of the duel `user_id` is in on either side, or (None, None)."""
+    challenger_id = user_id if user_id in duels else duel_by_challenged.get(user_id)
+    if challenger_id is None:
+        return None, None
+    return challenger_id, duels[challenger_id]
+
+def set_duel_state(challenger_id: int, state: str, step: int, delay: float):
+    """Move the duel on and arm its next timer `delay` seconds from now."""
+    duel = duels[challenger_id]
+    deadline = now_utc() + timedelta(seconds=delay)
+    duel.update(state=state, step=step, deadline=deadline.isoformat())
+    mark_dirty("duels", challenger_id)
+    scheduler.schedule(("duel", challenger_id), deadline, advance_duel, challenger_id, state, step)
+    if state == "open":
+        route_duel_casts(challenger_id)
+
+async def route_duel_cast(message: discord.Message):
+    await cast_in_duel(message.channel.id, message.author.id)
+
+def route_duel_casts(challenger_id: int):
+    """While the duel is open, both duellists' casts bypass the command parser."""
+    duel = duels[challenger_id]
+    for user_id in (challenger_id, duel["challenged"]):
+        add_message_route(duel["channel"], user_id, DUEL_CAST_TRIGGERS, route_duel_cast)
+
+def open_challenge(challenger_id: int, challenged_id: int, channel_id: int):
+    duels[challenger_id] = {"challenged": challenged_id, "channel": channel_id}
+    duel_by_challenged[challenged_id] = challenger_id
+    set_duel_state(challenger_id, "challenged", 0, DUEL_CHALLENGE_SECONDS)
+
+def end_duel(challenger_id: int):
+    duel = duels.pop(challenger_id, None)
+    if duel is None:
+        return
+    duel_by_challenged.pop(duel["challenged"], None)
+    scheduler.cancel(("duel", challenger_id))
+    for user_id in (challenger_id, duel["challenged"]):
+        remove_message_route(duel["channel"], user_id)
+    end_sequence(("duel", challenger_id))
+    mark_dirty("duels", challenger_id)
+
+async def advance_duel(challenger_id: int, state: str, step: int):
+    """Scheduler callback: the deadline of (state, step) passed."""
+    duel = duels.get(challenger_id)
+    if duel is None or (duel["state"], duel["step"]) != (state, step):
+        return
 
-    finally:
-        # This block always runs, whether there was a winner or a timeout
-        now = dt.datetime.utcnow()
-        duel_cooldowns[winner.id] = now
-        duel_cooldowns[loser.id] = now
-        save_duel_cooldowns()
+    channel = bot.get_channel(duel["channel"])
+    challenger = get_member_from_id(challenger_id)
+    challenged = get_member_from_id(duel["challenged"])
+    if not (channel and challenger and challenged):
+        # the channel or one of the duellists is gone
+        end_duel(challenger_id)
+        return
+
+    if state == "challenged":
+        end_duel(challenger_id)
+        say(channel, f"⌛ {challenged.display_name} didn't answer {challenger.display_name}'s challenge in time. The duel is off.", REPLY)
+        return
+
+    late = (now_utc() - datetime.fromisoformat(duel["deadline"])).total_seconds()
+    if late > DUEL_RESUME_GRACE_SECONDS:
+        end_duel(challenger_id)
+        say(channel, f"🦉 The duel between {challenger.display_name} and {challenged.display_name} was interrupted. No galleons were won, and you may duel again.", REPLY)
+        return
+
+    if state == "countdown":
+        delay = DUEL_COUNTDOWN[step][1]
+        if step + 1 < len(DUEL_COUNTDOWN):
+            set_duel_state(challenger_id, "countdown", step + 1, delay)
+        else:
+            set_duel_state(challenger_id, "open", 0, delay)
+        # the countdown is one message that grows a line per step
+        text = "\n".join(line for line, _ in DUEL_COUNTDOWN[:step + 1])
+        await edit_in_place(channel, ("duel", challenger_id), text.format(challenger=challenger, challenged=challenged), REPLY)
+        return
+
+    # open and nobody cast in time
+    await finish_duel(challenger_id, None)
+
+def start_duel(challenger_id: int):
+    """Challenge accepted: the countdown starts with its first line right away."""
+    set_duel_state(challenger_id, "countdown", 0, 0)
+
+async def cast_in_duel(channel_id: int, user_id: int) -> bool:
+    """A duellist cast in the open window; True if that won the duel."""
+    challenger_id, duel = duel_for(user_id)
+    if duel is None or duel["state"] != "open" or duel["channel"] != channel_id:
+        return False
+    await finish_duel(challenger_id, user_id)
+    return True
+
+async def finish_duel(challenger_id: int, winner_id):
+    duel = duels[challenger_id]
+    challenged_id = duel["challenged"]
+    end_duel(challenger_id)
+
+    channel = bot.get_channel(duel["channel"])
+    if winner_id is None:
+        if channel:
+            say(channel, "❌ No one cast their spell in time! The duel is a draw. No galleons were won.", REPLY)
+    else:
+        loser_id = challenged_id if winner_id == challenger_id else challenger_id
+        winner = get_member_from_id(winner_id)
+        loser = get_member_from_id(loser_id)
+        await credit(winner_id, DUEL_PRIZE, reason="duel")
+        if channel and winner and loser:
+            say(channel, f"*{winner.display_name} {random.choice(DUEL_OUTCOMES)} {loser.display_name} and successfully disarms them!*", REPLY)
+            say(channel, f"🎉 Congratulations **{winner.mention}**! You've won **{DUEL_PRIZE} Galleons**!", REPLY)
+
+    # both duellists are on cooldown, whatever the outcome
+    now = dt.datetime.utcnow()
+    for user_id in (challenger_id, challenged_id):
+        duel_cooldowns[user_id] = now
+        mark_dirty("duel_cooldowns", user_id)
+
+def resume_duels():
+    """Re-arm the timers of persisted duels (past deadlines fire straight away)."""
+    for challenger_id, duel in duels.items():
+        scheduler.schedule(
+            ("duel", challenger_id), datetime.fromisoformat(duel["deadline"]),
+            advance_duel, challenger_id, duel["state"], duel["step"],
+        )
+        if duel["state"] == "open":
+            route_duel_casts(challenger_id)
+    if duels:
+        print(f"[Hedwig] resumed {len(duels)} duels")
 
 # -------------------------
 # ROOM / ALOHOMORA GAME HELPERS
@@ -925,49 +2990,59 @@ async def announce_room_for(member: discord.Member):
     room = bot.get_channel(ROOM_OF_REQUIREMENT_ID)
     if not room:
         return
-    await room.send(f"🔮 Welcome {member.mention}!\nPick a potion with `!choose 1-5`")
-    await room.send(" ".join(POTION_EMOJIS))
+    # one message: the welcome and the potion row are queued back to back
+    say(room, f"🔮 Welcome {member.mention}!\nPick a potion with `!choose 1-5`", REPLY)
+    await say(room, " ".join(POTION_EMOJIS), REPLY)
 
 # -------------------------
 # COMMANDS: HELP / MOD
 # -------------------------
+HELP_TEXT = (
+    "🦉 **Hedwig Help** 🦉\n"
+    "✨ Student Commands:\n"
+    "`!shopspells` – View available spells in Dueling Club\n"
+    "`!shoppotions` – View available potions in Dueling Club \n"
+    "`!shop <item>` – Look up a spell or potion (the start of its name is enough)\n"
+    "`!cast <spell> @user` – Cast a spell and include a target such as yourself or another person in Dueling Club\n"
+    "`!drink <potion> @user` – Drink a potion and include a target such as yourself or another person in Dueling Club\n"
+    "`!balance` – Check your galleons\n"
+    "`!rank [@user]` – See where you stand on the Gringotts Rich List\n"
+    "`!history [@user]` – Recent Gringotts transactions\n"
+    "`!daily` – Collect your daily allowance\n"
+    "`!points` – View house points\n"
+    "`!choose <1–5>` – Choose a potion in Room of Requirement to play the game.\n"
+)
+
+MOD_HELP_TEXT = (
+    "⚖️ **Hedwig Moderator Commands** ⚖️\n"
+    "`!addpoints <house> <points>` — Add house points\n"
+    "`!resetpoints` — Reset house points globally\n"
+    "`!givegalleons @user <amount>` — Give galleons to a user (Prefects & Head of House only)\n"
+    "`!resetgalleons` — Clear all galleon balances globally\n"
+    "`!reloaditems` — Reload spells & potions from items.json (bump its version first)\n"
+    "`!clear [number]` — Clears a number of messages (default 100) from the Dueling Club or Room of Requirement channels.\n"
+    "`!cast finite @user`  — Removes most recent spell/potion from a user\n"
+    "`!trigger-game [@user]` — Prefects-only test: starts the Alohomora game for a user\n"
+)
+
 @bot.command()
+@track_command
 async def hedwighelp(ctx):
-    msg = (
-        "🦉 **Hedwig Help** 🦉\n"
-        "✨ Student Commands:\n"
-        "`!shopspells` – View available spells in Dueling Club\n"
-        "`!shoppotions` – View available potions in Dueling Club \n"
-        "`!cast <spell> @user` – Cast a spell and include a target such as yourself or another person in Dueling Club\n"
-        "`!drink <potion> @user` – Drink a potion and include a target such as yourself or another person in Dueling Club\n"
-        "`!balance` – Check your galleons\n"
-        "`!daily` – Collect your daily allowance\n"
-        "`!points` – View house points\n"
-        "`!choose <1–5>` – Choose a potion in Room of Requirement to play the game.\n"
-    )
-    await ctx.send(msg)
+    await ctx.send(HELP_TEXT)
 
 @bot.command()
+@track_command
 async def hedwigmod(ctx):
     if not is_staff_allowed(ctx.author):
         return await ctx.send("❌ You don’t have permission to see mod commands.")
-    msg = (
-        "⚖️ **Hedwig Moderator Commands** ⚖️\n"
-        "`!addpoints <house> <points>` — Add house points\n"
-        "`!resetpoints` — Reset house points globally\n"
-        "`!givegalleons @user <amount>` — Give galleons to a user (Prefects & Head of House only)\n"
-        "`!resetgalleons` — Clear all galleon balances globally\n"
-        "`!clear [number]` — Clears a number of messages (default 100) from the Dueling Club or Room of Requirement channels.\n"
-        "`!cast finite @user`  — Removes most recent spell/potion from a user\n"
-        "`!trigger-game [@user]` — Prefects-only test: starts the Alohomora game for a user\n"
-    )
-    await ctx.send(msg)
+    await ctx.send(MOD_HELP_TEXT)
 
 # -------------------------
 # COMMANDS: DUEL
 # -------------------------
 
-@bot.command()
+@bot.group(invoke_without_command=True)
+@track_command
 async def duel(ctx, challenged_user: discord.Member = None):
     # Restrict to dueling club
     if ctx.channel.id != DUELING_CLUB_ID:
@@ -993,55 +3068,54 @@ async def duel(ctx, challenged_user: discord.Member = None):
         return await ctx.send(f"⏳ {challenged_user.display_name} has already dueled today.")
         
     # Check if a duel is already in progress for either user
-    if challenger.id in active_duels or challenged_user.id in active_duels:
+    if duel_for(challenger.id)[1] or duel_for(challenged_user.id)[1]:
         return await ctx.send("❌ One of you is already in a duel.")
 
-    # Store the duel request
-    active_duels[challenger.id] = {
-        'challenged': challenged_user,
-        'channel': ctx.channel
-    }
+    # Store the duel request; it lapses if not confirmed in time
+    open_challenge(challenger.id, challenged_user.id, ctx.channel.id)
     
     # Send challenge message and wait for confirmation
     await ctx.send(f"⚔️ **{challenged_user.mention}**, you have been challenged to a wizard's duel by **{challenger.mention}**! Do you accept? Type `!duelconfirm` to confirm.")
 
 @bot.command(name='duelconfirm')
+@track_command
 async def duel_confirm(ctx):
-    challenger = None
-    challenged = ctx.author
-    
     # Find the duel challenge
-    for k, v in active_duels.items():
-        if v['challenged'].id == challenged.id:
-            challenger = ctx.guild.get_member(k)
-            break
-            
-    if not challenger:
+    challenger_id = duel_by_challenged.get(ctx.author.id)
+    if challenger_id is None or duels[challenger_id]["state"] != "challenged":
         return await ctx.send("❌ You have not been challenged to a duel.")
 
-    # Start the duel sequence
-    active_duels.pop(challenger.id, None) # Use .pop() for safer deletion
-    await start_duel_sequence(ctx, challenger, challenged)
+    # The countdown runs on the scheduler; this command returns right away
+    start_duel(challenger_id)
 
-@bot.command(name='duelcast')
+@duel.command(name='cast')
+@track_command
 async def duel_cast(ctx):
-    # This command is handled by the wait_for, so it just returns if called directly
-    return
+    # Open duels route their casts in on_message; this catches the rest
+    # (no duel open, wrong channel) and stays silent.
+    await cast_in_duel(ctx.channel.id, ctx.author.id)
+
+@bot.command(name='duelcast')
+@track_command
+async def duelcast(ctx):
+    await cast_in_duel(ctx.channel.id, ctx.author.id)
 
 # -------------------------
 # COMMANDS: HOUSE POINTS
 # -------------------------
 @bot.command()
+@track_command
 async def addpoints(ctx, house: str, points: int):
     house = house.lower()
     if house in house_points:
         house_points[house] += int(points)
-        save_house_points()
+        mark_dirty("house_points", house)
         await ctx.send(f"{house_emojis[house]} {house.capitalize()} now has {house_points[house]} points!")
     else:
         await ctx.send("That house does not exist.")
 
 @bot.command()
+@track_command
 async def points(ctx):
     result = "🏆 Current House Points 🏆\n"
     for house, pts in house_points.items():
@@ -1049,23 +3123,27 @@ async def points(ctx):
     await ctx.send(result)
 
 @bot.command()
+@track_command
 async def resetpoints(ctx):
     if not is_staff_allowed(ctx.author):
         return await ctx.send("❌ You don’t have permission to reset points.")
     for house in house_points:
         house_points[house] = 0
-    save_house_points()
+    mark_dirty("house_points")
+    await persist_now()
     await ctx.send("🔄 All house points have been reset!")
 
 # -------------------------
 # COMMANDS: GALLEON ECONOMY
 # -------------------------
 @bot.command()
+@track_command
 async def balance(ctx, member: discord.Member = None):
     member = member or ctx.author
     await ctx.send(f"💰 {member.display_name} has **{get_balance(member.id)}** galleons.")
 
 @bot.command()
+@track_command
 async def daily(ctx):
     user_id = ctx.author.id
     now = now_utc()
@@ -1075,9 +3153,10 @@ async def daily(ctx):
         mins = rem // 60
         return await ctx.send(f"⏳ You already collected daily. Try again in {hrs}h {mins}m. You can use !remindme and I'll ping you when it's ready.")
     reward = random.randint(10, 30)
-    add_galleons_local(user_id, reward)
+    # claim the day before awaiting the credit so a repeated !daily can't slip in
     last_daily[user_id] = now
-    save_last_daily()
+    mark_dirty("last_daily", user_id)
+    await credit(user_id, reward, reason="daily")
     gringotts = bot.get_channel(GRINGOTTS_CHANNEL_ID)
     if gringotts:
         await gringotts.send(f"💰 {ctx.author.display_name} collected daily allowance and now has {get_balance(user_id)} galleons!")
@@ -1085,49 +3164,89 @@ async def daily(ctx):
         await ctx.send(f"💰 You collected {reward} galleons! You now have {get_balance(user_id)}.")
 
 @bot.command()
+@track_command
 async def pay(ctx, member: discord.Member, amount: int):
     if amount <= 0:
         return await ctx.send("Please provide a positive amount.")
-    sender = ctx.author.id
-    if get_balance(sender) < amount:
+    if member.id == ctx.author.id:
+        return await ctx.send("🚫 You can't pay yourself.")
+    # both legs go into one ledger record, so a crash can't keep only one of them
+    if not await transfer(ctx.author.id, member.id, amount, reason="pay"):
         return await ctx.send("🚫 You don’t have enough galleons.")
-    remove_galleons_local(sender, amount)
-    add_galleons_local(member.id, amount)
     await ctx.send(f"💸 {ctx.author.display_name} paid {amount} galleons to {member.display_name}!")
 
 @bot.command()
+@track_command
 async def givegalleons(ctx, member: discord.Member, amount: int):
     if not is_staff_allowed(ctx.author):
         return await ctx.send("🚫 You don't have permission to give galleons.")
     if amount <= 0:
         return await ctx.send("Please provide a positive amount.")
-    add_galleons_local(member.id, amount)
-    await ctx.send(f"✨ {member.display_name} received {amount} galleons! They now have {get_balance(member.id)}.")
+    balance = await credit(member.id, amount, reason="give")
+    await ctx.send(f"✨ {member.display_name} received {amount} galleons! They now have {balance}.")
 
 @bot.command()
+@track_command
 async def resetgalleons(ctx):
     if not is_staff_allowed(ctx.author):
         return await ctx.send("🚫 You don't have permission to reset galleons.")
     galleons.clear()
-    save_galleons()
+    galleon_ranking.rebuild(galleons)
+    append_ledger("reset", [])
+    compact_ledger()
+    await persist_now()
     await ctx.send("🔄 All galleon balances have been reset.")
 
 @bot.command()
+@track_command
+async def reloaditems(ctx):
+    if not is_staff_allowed(ctx.author):
+        return await ctx.send("🚫 You don't have permission to reload the item library.")
+    await ctx.send(await reload_item_library())
+
+@bot.command()
+@track_command
 async def leaderboard(ctx):
     if not galleons:
         return await ctx.send("No one has any galleons yet!")
-    sorted_balances = sorted(galleons.items(), key=lambda x: x[1], reverse=True)[:10]
+    sorted_balances = galleon_ranking.top(10)
+    members = await member_resolver.resolve_many([int(user_id) for user_id, _ in sorted_balances])
     result = "🏦 Gringotts Rich List 🏦\n"
     for i, (user_id, bal) in enumerate(sorted_balances, start=1):
-        member = get_member_from_id(int(user_id)) or ctx.guild.get_member(int(user_id))
+        member = members.get(int(user_id))
         name = member.display_name if member else f"User {user_id}"
         result += f"{i}. {name} — {bal} galleons\n"
     await ctx.send(result)
 
-# Track running reminder tasks in memory
-reminder_tasks = {}  # {user_id: asyncio.Task}
+@bot.command()
+@track_command
+async def rank(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    position = galleon_ranking.rank(member.id)
+    if position is None:
+        return await ctx.send(f"🏦 {member.display_name} doesn't have a Gringotts account yet.")
+    await ctx.send(
+        f"🏅 {member.display_name} is **#{position}** of {len(galleon_ranking)} "
+        f"on the Gringotts Rich List with **{get_balance(member.id)}** galleons."
+    )
+
+@bot.command()
+@track_command
+async def history(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    records = await galleon_history(member.id)
+    if not records:
+        return await ctx.send(f"📜 Gringotts has no recent transactions for {member.display_name}.")
+    lines = []
+    for record in reversed(records):
+        for user_id, delta, balance in record["changes"]:
+            if user_id == member.id:
+                when = record["ts"][:16].replace("T", " ")
+                lines.append(f"`{when}` {record['reason']}: **{delta:+d}** → {balance}")
+    await ctx.send(f"📜 **Gringotts ledger for {member.display_name}** (newest first)\n" + "\n".join(lines))
 
 @bot.command()
+@track_command
 async def remindme(ctx):
     """Set a recurring daily reminder when !daily is ready again."""
     if ctx.channel.id != GRINGOTTS_CHANNEL_ID:
@@ -1151,23 +3270,17 @@ async def remindme(ctx):
     mins = rem // 60
     remind_at = now + remaining
 
-    # --- Prevent duplicate reminders ---
-    # Cancel any existing reminder task
-    existing_task = reminder_tasks.get(user_id)
-    if existing_task and not existing_task.done():
-        existing_task.cancel()
-
     # Replace in persistence
     reminders[user_id] = remind_at.isoformat()
-    save_reminders()
+    mark_dirty("reminders", user_id)
 
-    # Schedule the reminder and store task
-    task = asyncio.create_task(schedule_reminder(user_id, remind_at, recurring=True))
-    reminder_tasks[user_id] = task
+    # Schedule the reminder (replaces any existing one, so no duplicates)
+    schedule_reminder(user_id, remind_at, recurring=True)
 
     await ctx.send(f"⏳ Okay {ctx.author.display_name}, I’ll remind you every {hrs}h {mins}m when your daily is ready again. You only have to do this once as it is a continuous reminder. Type !cancelreminder to cancel your current reminder.")
 
 @bot.command()
+@track_command
 async def cancelreminder(ctx, member: discord.Member = None):
     """Cancel your current daily reminder (mods can cancel others)."""
     # Allow mods or Prefects to cancel for someone else
@@ -1181,15 +3294,13 @@ async def cancelreminder(ctx, member: discord.Member = None):
     if user_id not in reminders:
         return await ctx.send(f"❌ {target.display_name} has no active reminder.")
 
-    # Cancel running asyncio task (if exists)
-    existing_task = reminder_tasks.get(user_id)
-    if existing_task and not existing_task.done():
-        existing_task.cancel()
-        reminder_tasks.pop(user_id, None)
+    # Drop the pending timer (if any) and a ping that hasn't gone out yet
+    cancel_reminder_timer(user_id)
+    reminder_batch.pop(user_id, None)
 
     # Remove from persistence
     reminders.pop(user_id, None)
-    save_reminders()
+    mark_dirty("reminders", user_id)
 
     await ctx.send(f"🪶 Reminder cancelled for {target.display_name}.")
 
@@ -1198,42 +3309,45 @@ async def cancelreminder(ctx, member: discord.Member = None):
 # COMMAND: SHOP (spells + potions)
 # -------------------------
 @bot.command()
+@track_command
 async def shopspells(ctx):
     if ctx.channel.id not in [OWLRY_CHANNEL_ID, DUELING_CLUB_ID]:
         return await ctx.send("❌ This command can only be used in the Dueling Club.")
-   
-    msg = "🪄 **Spell Shop** 🪄\n\n"
-    for name, data in EFFECT_LIBRARY.items():
-        if name == "polyfail_cat":
-            continue
-        # Get emoji from effect_emojis dictionary, fallback to prefix_unicode or empty string
-        emoji = effect_emojis.get(name, data.get("prefix_unicode", ""))
-        cost = data.get("cost", "?")
-        desc = data.get("description", "No description available.")
-        msg += f"{emoji} **{name.capitalize()}** — {cost} galleons\n {desc}\n\n"
-    msg += "Use `!cast @user` to buy and cast spells!\n"
-    await ctx.send(msg)
+    for page in shop_catalog.pages("spells"):
+        await ctx.send(embed=page)
 
 @bot.command()
+@track_command
 async def shoppotions(ctx):
     if ctx.channel.id not in [OWLRY_CHANNEL_ID, DUELING_CLUB_ID]:
         return await ctx.send("❌ This command can only be used in the Dueling Club.")
-    msg = "🍷 **Potion Shop** 🍷\n\n"
-    for name, data in POTION_LIBRARY.items():
-        if name == "polyfail_cat":
-            continue
-        emoji = data.get("emoji") or data.get("prefix_unicode") or ""
-        cost = data.get("cost", "?")
-        desc = data.get("description", "No description available.")
-        msg += f"{emoji} **{name.capitalize()}** — {cost} galleons\n   {desc}\n\n"
-    msg += "Use `!drink <potion> [@user]` to buy and drink potions.\n"
-    await ctx.send(msg)
+    for page in shop_catalog.pages("potions"):
+        await ctx.send(embed=page)
+
+@bot.command()
+@track_command
+async def shop(ctx, *, item: str = None):
+    """Look up one spell or potion (prefixes work: `!shop felix`)."""
+    if ctx.channel.id not in [OWLRY_CHANNEL_ID, DUELING_CLUB_ID]:
+        return await ctx.send("❌ This command can only be used in the Dueling Club.")
+    if not item:
+        return await ctx.send("🛒 Use `!shop <item>` to look something up, or browse `!shopspells` / `!shoppotions`.")
+
+    matches = shop_catalog.lookup(item)
+    if not matches:
+        return await ctx.send(f"❌ Nothing in the shop matches **{item}**. Try `!shopspells` or `!shoppotions`.")
+    if len({m.name for m in matches}) > 1:
+        names = ", ".join(f"`{m.name}`" for m in matches[:10])
+        return await ctx.send(f"🔎 Several items match **{item}**: {names}")
+    for match in matches:
+        await ctx.send(embed=shop_catalog.detail(match))
 
 
 # -------------------------
 # COMMAND: CAST (spells)
 # -------------------------
 @bot.command()
+@track_command
 async def cast(ctx, spell: str, member: discord.Member):
     # channel restriction: supports OWLRY + optional DUELING_CLUB_ID if defined
     allowed = {OWLRY_CHANNEL_ID}
@@ -1244,6 +3358,7 @@ async def cast(ctx, spell: str, member: discord.Member):
 
     caster = ctx.author
     spell = spell.lower()
+    await ensure_member_effects(member)
 
     # 🛑 INSERT SERVER OWNER CHECK HERE 🛑
     if member.id == member.guild.owner_id:
@@ -1280,6 +3395,15 @@ async def cast(ctx, spell: str, member: discord.Member):
         last = alohomora_cooldowns.get(member.id)
         if last and now - last < timedelta(hours=24):
             return await ctx.send("⏳ Alohomora can only be cast on this user once every 24 hours.")
+
+        # Immediately reserve the room BEFORE any await calls
+        current_room_user = member.id
+
+        # Charge before changing anything else, so a failed charge only has to
+        # give the room back
+        if not await charge(caster.id, cost, reason="cast"):
+            current_room_user = None
+            return await ctx.send("💸 You don’t have enough galleons to cast that spell!")
         alohomora_cooldowns[member.id] = now
 
         # Ensure exclusivity: remove Alohomora role from anyone who already has it
@@ -1287,15 +3411,9 @@ async def cast(ctx, spell: str, member: discord.Member):
         role = member.guild.get_role(alohomora_id) if alohomora_id else discord.utils.get(member.guild.roles, name=ALOHOMORA_ROLE_NAME)
         
         if role:
-            for m in member.guild.members:
+            for m in role_holder_members(member.guild, role):
                 if role in m.roles:
-                    await safe_remove_role(m, role)
-
-        # Immediately reserve the room BEFORE any await calls
-        current_room_user = member.id
-
-        # Now safely proceed
-        remove_galleons_local(caster.id, cost)
+                    queue_role_change(m, role, add=False)
 
         # Store role ID for cleanup
         effect_meta = {}
@@ -1309,7 +3427,7 @@ async def cast(ctx, spell: str, member: discord.Member):
         
         # Add the role using the found 'role' object
         if role:
-            await safe_add_role(member, role)
+            queue_role_change(member, role, add=True)
             
         await announce_room_for(member)
 
@@ -1327,9 +3445,8 @@ async def cast(ctx, spell: str, member: discord.Member):
         if member.id not in active_effects or not active_effects[member.id]["effects"]:
             return await ctx.send("❌ That user has no active spells/potions to finite.")
 
-        effects_list = active_effects[member.id]["effects"]
-        last_entry = effects_list[-1]
-        last_effect_name = last_entry.get("effect")
+        last_entry = active_effects[member.id]["effects"].last()
+        last_effect_name = last_entry.item
 
         # Prevent using Finite on Alohomora (policy in your code) — don't charge
         if last_effect_name == "alohomora":
@@ -1340,22 +3457,24 @@ async def cast(ctx, spell: str, member: discord.Member):
             return await ctx.send("✂️ Finite can only be used on spells, not potions.")
 
         # Charge first
-        remove_galleons_local(caster.id, cost)
+        if not await charge(caster.id, cost, reason="cast"):
+            return await ctx.send("💸 You don’t have enough galleons to cast that spell!")
 
         # Special-case Lumos: remove role immediately
-        if last_entry.get("kind") == "role_lumos":
+        if last_entry.kind == "role_lumos":
             lumos_rid = ROLE_IDS.get("lumos")
             if lumos_rid:
                 lumos_role = member.guild.get_role(lumos_rid)
-                if lumos_role and lumos_role in member.roles:
-                    await safe_remove_role(member, lumos_role)
+                if lumos_role:
+                    queue_role_change(member, lumos_role, add=False)
 
         # Expire the effect normally (this also updates nickname etc.)
-        await expire_effect(member, last_entry["uid"])
+        await expire_effect(member, last_entry.uid)
         return await ctx.send(f"✨ {caster.display_name} cast Finite on {member.display_name} — removed **{last_effect_name}**.")
 
     # ---- All other spells (standard flow) ----
-    remove_galleons_local(caster.id, cost)
+    if not await charge(caster.id, cost, reason="cast"):
+        return await ctx.send("💸 You don’t have enough galleons to cast that spell!")
     await apply_effect_to_member(member, spell, source="spell")
     await ctx.send(f"✨ {caster.display_name} cast **{spell.capitalize()}** on {member.display_name}!")
 
@@ -1363,6 +3482,7 @@ async def cast(ctx, spell: str, member: discord.Member):
 # COMMAND: DRINK (potions)
 # -------------------------
 @bot.command()
+@track_command
 async def drink(ctx, potion: str, member: discord.Member = None):
     # Initial checks
     if ctx.channel.id not in [OWLRY_CHANNEL_ID, DUELING_CLUB_ID]:
@@ -1371,6 +3491,7 @@ async def drink(ctx, potion: str, member: discord.Member = None):
     potion = potion.lower()
     member = member or ctx.author
     caster = ctx.author
+    await ensure_member_effects(member)
 
     # Server Owner Check
     if member.id == member.guild.owner_id:
@@ -1391,15 +3512,12 @@ async def drink(ctx, potion: str, member: discord.Member = None):
 
     # --- 1. Polyjuice Cooldown Check ---
     if pd.get("kind") == "potion_polyjuice":
-        active = active_effects.get(member.id, {}).get("effects", [])
-        polyjuice_effect = next(
-            (e for e in active if e.get("effect") in ("polyjuice", "polyfail_cat")),
-            None
-        )
+        data = active_effects.get(member.id)
+        polyjuice_effect = data["effects"].find("polyjuice", "polyfail_cat") if data else None
 
         if polyjuice_effect:
             try:
-                expires_at = dt.datetime.fromisoformat(polyjuice_effect["expires_at"])
+                expires_at = dt.datetime.fromisoformat(polyjuice_effect.expires_at)
                 now = dt.datetime.utcnow()
 
                 if now < expires_at:
@@ -1411,7 +3529,7 @@ async def drink(ctx, potion: str, member: discord.Member = None):
                         f"You try to imbibe another Polyjuice, but can't get it down. 🤢 "
                         f"You must wait **{hours}h {minutes}m {seconds}s** before you can drink it again."
                     )
-            except KeyError:
+            except TypeError:
                 return await ctx.send("🤢 You still feel a residual effect from a bugged Polyjuice. Please wait for manual clearing or drink a Bezoar.")
             except Exception as e:
                 print("Polyjuice cooldown parse error:", e)
@@ -1420,14 +3538,15 @@ async def drink(ctx, potion: str, member: discord.Member = None):
     if pd["kind"] == "potion_bezoar":
         if member.id in active_effects:
             to_remove = [
-                e["uid"]
+                e.uid
                 for e in active_effects[member.id]["effects"]
-                if (e.get("kind") or "").startswith("potion_")
-                and e.get("effect") not in ("polyjuice", "polyfail_cat")
+                if (e.kind or "").startswith("potion_")
+                and e.item not in ("polyjuice", "polyfail_cat")
             ]
 
             if to_remove:
-                remove_galleons_local(caster.id, cost)
+                if not await charge(caster.id, cost, reason="drink"):
+                    return await ctx.send("💸 You don’t have enough galleons to buy that potion!")
                 for uid in to_remove:
                     await expire_effect(member, uid)
 
@@ -1443,7 +3562,8 @@ async def drink(ctx, potion: str, member: discord.Member = None):
 
     # --- 3. Polyjuice Execution ---
     if pd["kind"] == "potion_polyjuice":
-        remove_galleons_local(caster.id, cost)
+        if not await charge(caster.id, cost, reason="drink"):
+            return await ctx.send("💸 You don’t have enough galleons to buy that potion!")
 
         expiration_time = dt.datetime.utcnow() + timedelta(hours=24)
 
@@ -1480,7 +3600,8 @@ async def drink(ctx, potion: str, member: discord.Member = None):
         )
 
     # --- 4. All other potions ---
-    remove_galleons_local(caster.id, cost)
+    if not await charge(caster.id, cost, reason="drink"):
+        return await ctx.send("💸 You don’t have enough galleons to buy that potion!")
     await apply_effect_to_member(member, potion, source="potion", meta={"permanent": True})
     await ctx.send(f"🧪 {caster.display_name} gave **{potion.capitalize()}** to {member.display_name}!")
 
@@ -1488,6 +3609,7 @@ async def drink(ctx, potion: str, member: discord.Member = None):
 # COMMAND: CHOOSE (Room of Requirement)
 # -------------------------
 @bot.command()
+@track_command
 async def choose(ctx, number: int):
     # Ensure constants are available (ALOHOMORA_ROLE_NAME, ROOM_OF_REQUIREMENT_ID are available)
     if ctx.channel.id != ROOM_OF_REQUIREMENT_ID:
@@ -1506,13 +3628,14 @@ async def choose(ctx, number: int):
     
     # luck modifiers (rest of your existing logic)
     luck = 0.0
+    await ensure_member_effects(ctx.author)
     data = active_effects.get(user_id)
     if data:
-        for e in data["effects"]:
-            if e.get("effect") == "felixfelicis":
-                luck += 0.5
-            if e.get("effect") == "draughtlivingdeath":
-                luck -= 0.5
+        stack = data["effects"]
+        if stack.has("felixfelicis"):
+            luck += 0.5
+        if stack.has("draughtlivingdeath"):
+            luck -= 0.5
                 
     forced_win = (luck > 0 and random.random() < luck)
     forced_miss = (luck < 0 and random.random() < abs(luck))
@@ -1525,7 +3648,7 @@ async def choose(ctx, number: int):
         final_choice = random.choice(opts)
         
     if final_choice == winning:
-        add_galleons_local(user_id, 100)
+        await credit(user_id, 100, reason="choose")
         await ctx.send(f"🎉 {ctx.author.mention} picked potion {number} and won **100 galleons**! Type `!leaveroom` to exit.")
     else:
         await ctx.send(f"💨 {ctx.author.mention} picked potion {number}... nothing happened. Better luck next time! Type `!leaveroom` to exit.")
@@ -1537,6 +3660,7 @@ async def choose(ctx, number: int):
 # COMMAND: TRIGGER-GAME (testing) - restricted to Prefects/Head
 # -------------------------
 @bot.command(name="trigger-game", aliases=["trigger_game", "triggergame"])
+@track_command
 async def trigger_game(ctx, member: discord.Member = None):
     if not is_staff_allowed(ctx.author):
         return await ctx.send("❌ You don’t have permission to trigger the test game.")
@@ -1563,6 +3687,7 @@ async def trigger_game(ctx, member: discord.Member = None):
 # COMMAND: LEAVE ROOM
 # -------------------------
 @bot.command()
+@track_command
 async def leaveroom(ctx, member: discord.Member = None):
     """Leave the Room of Requirement — or force someone to leave (staff only)."""
     
@@ -1573,15 +3698,15 @@ async def leaveroom(ctx, member: discord.Member = None):
         return await ctx.send("You can only use `!leaveroom` inside the Room of Requirement.")
         
     target = member or ctx.author
+    await ensure_member_effects(target)
     
     # 1. Find the Alohomora effect UID
     # This is essential because expire_effect needs a UID, even for a manual remove.
     alohomora_uid = None
     if target.id in active_effects:
-        for entry in active_effects[target.id]["effects"]:
-            if entry.get("effect") == "alohomora":
-                alohomora_uid = entry["uid"]
-                break
+        entry = active_effects[target.id]["effects"].find("alohomora")
+        if entry:
+            alohomora_uid = entry.uid
 
     # Check if they are the current reserved user OR have an active effect
     is_occupant = current_room_user == target.id or alohomora_uid is not None
@@ -1604,7 +3729,7 @@ async def leaveroom(ctx, member: discord.Member = None):
         # Send confirmation to Dueling Club, not the just-purged Room of Requirement
         dueling_club = bot.get_channel(DUELING_CLUB_ID)
         if dueling_club:
-            return await dueling_club.send(f"🪄 {ctx.author.display_name} has forced **{target.display_name}** to leave the Room of Requirement. The room is now clean.")
+            return await say(dueling_club, f"🪄 {ctx.author.display_name} has forced **{target.display_name}** to leave the Room of Requirement. The room is now clean.", REPLY)
         return
 
     # --- Regular Self-Use ---
@@ -1623,7 +3748,7 @@ async def leaveroom(ctx, member: discord.Member = None):
         # 4. Final message to the Dueling Club channel (where they will reappear)
         dueling_club = bot.get_channel(DUELING_CLUB_ID)
         if dueling_club:
-             return await dueling_club.send(f"🚪 **{target.display_name}** has left the Room of Requirement. The room vanishes, and you find yourself back here in the Dueling Club.")
+             return await say(dueling_club, f"🚪 **{target.display_name}** has left the Room of Requirement. The room vanishes, and you find yourself back here in the Dueling Club.", REPLY)
 
         return await ctx.send(f"🚪 **{target.display_name}** has left the Room of Requirement. The room is closed.")
     
@@ -1633,7 +3758,7 @@ async def leaveroom(ctx, member: discord.Member = None):
         # Manually remove role and purge messages for safety
         role = discord.utils.get(ctx.guild.roles, name=ALOHOMORA_ROLE_NAME)
         if role and role in target.roles:
-            await safe_remove_role(target, role)
+            queue_role_change(target, role, add=False)
         
         try:
             await ctx.channel.purge(limit=100)
@@ -1649,34 +3774,37 @@ async def leaveroom(ctx, member: discord.Member = None):
 # -------------------------
 
 @bot.command(name="cleareffects")
+@track_command
 async def cleareffects(ctx, member: discord.Member = None):
     if not is_staff_allowed(ctx.author):
         await ctx.send("Only Prefects and Heads of House can clear effects!")
         return
 
     target_member = member or ctx.author
+    await ensure_member_effects(target_member)
 
     # Clear active effects from the user
     if target_member.id in active_effects:
-        for e in list(active_effects[target_member.id]["effects"]):
-            await expire_effect(target_member, e["uid"])
-        await ctx.send(f"🪄 All effects cleared for {target_member.display_name}.")
+        for e in active_effects[target_member.id]["effects"]:
+            await expire_effect(target_member, e.uid)
+        say(ctx.channel, f"🪄 All effects cleared for {target_member.display_name}.", REPLY)
     else:
-        await ctx.send(f"No active effects found for {target_member.display_name}.")
+        say(ctx.channel, f"No active effects found for {target_member.display_name}.", REPLY)
 
-    # Clear the duel cooldown
+    # Clear the duel cooldown (same message as the line above)
     if target_member.id in duel_cooldowns:
         del duel_cooldowns[target_member.id]
-        save_duel_cooldowns()
-        await ctx.send(f"⚔️ Duel cooldown has been cleared for {target_member.display_name}.")
+        mark_dirty("duel_cooldowns", target_member.id)
+        await say(ctx.channel, f"⚔️ Duel cooldown has been cleared for {target_member.display_name}.", REPLY)
     else:
-        await ctx.send(f"No duel cooldown found for {target_member.display_name}.")
+        await say(ctx.channel, f"No duel cooldown found for {target_member.display_name}.", REPLY)
 
 # -------------------------
 # CLEAR ROOMS COMMAND
 # -------------------------
 
 @bot.command(name="clear")
+@track_command
 async def clear_channel(ctx, limit: int = 100):
     """
     Clears messages from the Dueling Club or Room of Requirement channels.
@@ -1696,21 +3824,219 @@ async def clear_channel(ctx, limit: int = 100):
     except Exception as e:
         await ctx.send(f"An error occurred while trying to clear the channel: {e}")
 
+# -------------------------
+# EVENTS: cache upkeep
+# -------------------------
+@bot.event
+async def on_message(message: discord.Message):
+    # a shard also carries other schools; they are served by their own process
+    if message.guild is not None and message.guild.id != GUILD_ID:
+        return
+    # DMs reach every process on shard 0, so only the home school's answers them
+    if message.guild is None and GUILD_ID != HOME_GUILD_ID:
+        return
+    if message_routes and await dispatch_routed_message(message):
+        return
+    await bot.process_commands(message)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if after.guild.id != GUILD_ID:
+        return
+    # Someone else (the user, a mod) changed the nickname: what we pushed is stale.
+    if after.nick != last_pushed_nicks.get(after.id, after.nick):
+        last_pushed_nicks.pop(after.id, None)
+    if before.roles != after.roles:
+        sync_member_roles(after)
+    member_resolver.remember(after)
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    if member.guild.id != GUILD_ID:
+        return
+    member_resolver.remember(member)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    if member.guild.id != GUILD_ID:
+        return
+    member_resolver.forget(member.id)
+    last_pushed_nicks.pop(member.id, None)
+    for holders in role_holders.values():
+        holders.discard(member.id)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    member_resolver.drop_guild(guild)
+
+# -------------------------
+# STARTUP: staged loading
+# -------------------------
+# Stage 1 (economy) runs before connecting, see load_core_state(). Stage 2 reads
+# the effects store in the background once connected; until a member's saved
+# effects are hydrated into active_effects (and their expiry timers re-armed),
+# anything that reads or changes that member's effects first awaits
+# ensure_member_effects(). A warmer then hydrates everyone else and brings
+# nicknames/roles back in line: members that already look right are skipped,
+# and the rest are pushed by a few workers paced by a token bucket, so a big
+# backlog drains steadily instead of stampeding into Discord's rate limits.
+REHYDRATE_WORKERS = 4
+REHYDRATE_RATE = 4.0       # member refreshes per second
+REHYDRATE_BURST = 8
+REHYDRATE_PROGRESS_EVERY = 100
+
+startup_state = {
+    "core_loaded": False,     # galleons, dailies, reminders, points: economy commands are safe
+    "effects_loaded": False,  # every saved effect hydrated into active_effects
+    "display_ready": False,   # every restored effect is visible on Discord again
+    "total": 0,
+    "done": 0,
+    "skipped": 0,
+}
+effects_hydrated = set()  # member ids whose saved effects are live in active_effects
+effects_load_task = None
+warmer_task = None
+
+async def load_saved_effects():
+    """Read the effects store once, on the writer thread; concurrent callers share the read.
+
+    A failed read is forgotten, so the next caller tries again instead of
+    getting the same error until restart.
+    """
+    global effects_load_task
+    if effects_load_task is None:
+        effects_load_task = asyncio.ensure_future(run_on_writer(storage.load, "effects"))
+    task = effects_load_task
+    try:
+        await task
+    except Exception:
+        if effects_load_task is task:
+            effects_load_task = None
+        raise
+
+def hydrate_member_effects(member: discord.Member) -> bool:
+    """Make one member's saved effects live and re-arm their timers. Runs once per member."""
+    if member.id in effects_hydrated:
+        return False
+    effects_hydrated.add(member.id)
+    data = effects.get(str(member.id))
+    if not data:
+        return False
+
+    entry = {"original_nick": data.get("original_nick", member.display_name), "effects": EffectStack()}
+    for e in data["effects"]:
+        # the Room of Requirement is reset on every start, so its pass goes too
+        if e.item == "alohomora":
+            continue
+        try:
+            # Timed effects go back on the scheduler. Ones that lapsed while
+            # we were offline fire straight away, so expire_effect still
+            # takes their roles back.
+            entry["effects"].add(e)
+            if e.expires_at:
+                schedule_expiry(member.id, e.uid, datetime.fromisoformat(e.expires_at))
+        except Exception as err:
+            print(f"[Hedwig] Error restoring effect for {member.display_name}: {err}")
+
+    if entry["effects"]:
+        active_effects[member.id] = entry
+        effects[str(member.id)] = entry
+    else:
+        effects.pop(str(member.id), None)
+    mark_dirty("effects", str(member.id))
+    return True
+
+async def ensure_member_effects(member: discord.Member):
+    """First-touch hook: the member's saved effects are live before anyone looks at them."""
+    if member.id in effects_hydrated:
+        return
+    await load_saved_effects()
+    hydrate_member_effects(member)
+
+async def warm_effects(guild: discord.Guild):
+    """Stage 2: hydrate every saved effect, then catch the Discord side up."""
+    await load_saved_effects()
+    restored = []
+    for i, uid in enumerate(list(effects)):
+        try:
+            member = guild.get_member(int(uid))
+        except (ValueError, TypeError):
+            member = None
+        if member is None:
+            # left the server while we were away
+            effects.pop(uid, None)
+            mark_dirty("effects", uid)
+            continue
+        hydrate_member_effects(member)
+        if member.id in active_effects:
+            restored.append(member)
+        if i % 500 == 499:
+            await asyncio.sleep(0)  # let commands through on very large backlogs
+    startup_state["effects_loaded"] = True
+    print(f"[Hedwig] hydrated saved effects for {len(restored)} members")
+    await rehydrate_displays(restored)
+
+def start_effects_warmer(guild: discord.Guild):
+    global warmer_task
+    if warmer_task is None or (warmer_task.done() and not startup_state["effects_loaded"]):
+        warmer_task = asyncio.create_task(warm_effects(guild))
+
+def display_in_sync(member: discord.Member) -> bool:
+    """True if the member already wears the nickname and roles their effects call for."""
+    current = {r.id for r in member.roles}
+    if any(role.id not in current for role in effect_roles(member)):
+        return False
+    return target_nickname(member) == member.nick
+
+async def rehydrate_displays(members):
+    """Bring every member's nickname/roles in line with their restored effects."""
+    todo = [m for m in members if not display_in_sync(m)]
+    startup_state.update(total=len(todo), done=0, skipped=len(members) - len(todo), display_ready=False)
+    print(f"[Hedwig] rehydrating {len(todo)} members ({startup_state['skipped']} already up to date)")
+
+    queue = asyncio.Queue()
+    for member in todo:
+        queue.put_nowait(member)
+    bucket = TokenBucket(REHYDRATE_RATE, REHYDRATE_BURST)
+    started = time.monotonic()
+
+    async def worker():
+        while True:
+            try:
+                member = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await bucket.take()
+            # the member may have changed (or left) while queued
+            member = member.guild.get_member(member.id)
+            if member and not display_in_sync(member):
+                try:
+                    await update_member_display(member)
+                    await flush_member_display(member.id)
+                except Exception as e:
+                    print(f"[Hedwig] Error rehydrating {member.display_name}: {e}")
+            startup_state["done"] += 1
+            if startup_state["done"] % REHYDRATE_PROGRESS_EVERY == 0:
+                print(f"[Hedwig] rehydrated {startup_state['done']}/{startup_state['total']} members")
+
+    await asyncio.gather(*(worker() for _ in range(REHYDRATE_WORKERS)))
+    startup_state["display_ready"] = True
+    print(f"[Hedwig] rehydration finished: {startup_state['done']} members in {time.monotonic() - started:.1f}s")
+
 # -------------------------
 # STARTUP / RUN
 # -------------------------
+storage = make_storage()
+
 @bot.event
 async def on_ready():
     # -------------------------------------------------
-    # START: Initial Setup (Synchronous Loads)
+    # START: Stage 1 (economy) normally ran before connecting
     # -------------------------------------------------
-    # Synchronous functions must run safely
-    load_galleons()
-    load_house_points()
-    load_effects()
-    load_reminders()
-    load_last_daily()
-    load_duel_cooldowns()
+    # on_ready also fires after reconnects; memory is newer than the files by
+    # then, so nothing is reloaded.
+    if not startup_state["core_loaded"]:
+        await run_on_writer(load_core_state)
 
     # Clean up duplicate reminder keys
     unique = {}
@@ -1719,72 +4045,48 @@ async def on_ready():
         if uid not in unique or v > unique[uid]:
             unique[uid] = v
     reminders.clear()
-    reminders.update({str(k): v for k, v in unique.items()})
-    save_reminders()
+    reminders.update(unique)
+    mark_dirty("reminders")
+
+    # All timers (reminders + effect expiries) run on one scheduler task
+    scheduler.start()
+    await start_metrics()
 
     # Re-schedule valid reminders
     for uid, iso_time in reminders.items():
         remind_time = datetime.fromisoformat(iso_time)
         if remind_time > datetime.utcnow():
-            task = asyncio.create_task(schedule_reminder(int(uid), remind_time, recurring=True))
-            reminder_tasks[int(uid)] = task
+            schedule_reminder(int(uid), remind_time, recurring=True)
+
+    # Pick up duels that were in flight when we went down
+    resume_duels()
 
     # -------------------------------------------------
     # STEP 1: Safely Acquire Guild Object
     # -------------------------------------------------
-    SERVER_ID = 1398801863549259796
-    guild = bot.get_guild(SERVER_ID)
+    guild = bot.get_guild(GUILD_ID)
     
     # CRITICAL FIX: Wait for guild if not found immediately (Prevents Attribute Error)
     if not guild:
         await asyncio.sleep(2)
-        guild = bot.get_guild(SERVER_ID)
-    
-    new_effects = {}
-
-    if guild:
-        # -------------------------------------------------
-        # STEP 2: Rehydrate Saved Effects (Only runs if guild is available)
-        # -------------------------------------------------
-        for uid, data in list(effects.items()):
-            try:
-                # SAFE: guild is guaranteed to be non-None here
-                member = guild.get_member(int(uid))
-            except (ValueError, TypeError):
-                continue
+        guild = bot.get_guild(GUILD_ID)
 
-            if not member:
-                continue
+    for g in school_guilds():
+        member_resolver.index_guild(g)
 
-            original_nick = data.get("original_nick", member.display_name)
-            active_effects[member.id] = {"original_nick": original_nick, "effects": []}
-            
-            for e in data.get("effects", []):
-                try:
-                    is_active = True
-                    if "expires_at" in e and e["expires_at"]:
-                        exp_time = datetime.fromisoformat(e["expires_at"])
-                        if exp_time <= datetime.utcnow():
-                            is_active = False
-                            
-                    if is_active:
-                        active_effects[member.id]["effects"].append(e)
-                        if e.get("kind") in ("potion_polyjuice", "role_alohomora", "role_lumos") and e.get("expires_at"):
-                            asyncio.create_task(schedule_expiry(member.id, e["uid"], exp_time))
-                            
-                except Exception as err:
-                    print(f"[Hedwig] Error restoring effect for {member.display_name}: {err}")
-
-            if active_effects[member.id]["effects"]:
-                new_effects[uid] = active_effects[member.id]
-            
-            await update_member_display(member)
+    if guild:
+        rebuild_role_index(guild)
 
         # --- Alohomora Safety Cleanup (Only runs if guild is available) ---
         role = discord.utils.get(guild.roles, name=ALOHOMORA_ROLE_NAME)
         if role:
-            for m in role.members:
-                await safe_remove_role(m, role)
+            for m in role_holder_members(guild, role):
+                queue_role_change(m, role, add=False)
+
+        # -------------------------------------------------
+        # STEP 2: Saved effects load and rehydrate in the background
+        # -------------------------------------------------
+        start_effects_warmer(guild)
 
     # -------------------------------------------------
     # STEP 3: Final Cleanup and Announcements
@@ -1794,83 +4096,40 @@ async def on_ready():
     current_room_user = None
     alohomora_cooldowns.pop("global_last_cast", None)
 
-    # Update persistent effects 
-    effects.clear()
-    effects.update(new_effects)
-    save_effects()
-
     owlry_channel = bot.get_channel(OWLRY_CHANNEL_ID)
     if owlry_channel:
         await owlry_channel.send("🦉 Hedwig is flying again!")
 
     # Start background task only after all setup is complete
-    if not cleanup_effects.is_running():
-        cleanup_effects.start()
+    if not flush_dirty_state.is_running():
+        flush_dirty_state.start()
 
     print(f"[Hedwig] Logged in as {bot.user}")
 
 # -------------------------
 # Background Tasks
 # -------------------------
-@tasks.loop(minutes=5)
-async def cleanup_effects():
-    """Remove expired effects from memory and save file."""
-    now = now_utc()
-    to_expire = []
-    
-    # 1. Gather all expired effects
-    # We iterate over a copy of effects.items() for safe mutation
-    for member_uid, data in list(effects.items()):
-        
-        # A list to hold effects that are NOT expired
-        new_effects_list = []
-        
-        for e in data.get("effects", []):
-            expires_at = e.get("expires_at")
-            
-            # --- FIX: Skip permanent effects and malformed effects ---
-            if not expires_at:
-                # This effect has no expiration date (e.g., Alohomora). Keep it.
-                new_effects_list.append(e)
-                continue
-            
-            # --- Process timed effects ---
-            try:
-                exp_time = datetime.fromisoformat(expires_at)
-            except Exception:
-                # Should not happen, but if timestamp is malformed, treat as permanent/keep it
-                new_effects_list.append(e)
-                continue
-
-            if now >= exp_time:
-                # The effect has expired. Add to the list for cleanup.
-                to_expire.append((member_uid, e["uid"]))
-            else:
-                # The effect is still active. Keep it.
-                new_effects_list.append(e)
-
-        # 2. Update the user's effects list in memory
-        if not new_effects_list:
-            effects.pop(member_uid, None)
-        else:
-            data["effects"] = new_effects_list
-            effects[member_uid] = data
-
-    # 3. Call the external cleanup function for expired items
-    for member_uid_str, uid in to_expire:
-        # We need to ensure we can get the member object
-        member = bot.get_guild(1398801863549259796).get_member(int(member_uid_str))
-        if member:
-            await expire_effect(member, uid)
-        
-    save_effects()
-
-    # Log to console that cleanup finished
-    # print("[Hedwig] Cleanup finished.") 
-    
-    # This task *should not* re-apply roles. Re-application happens in update_member_display,
-    # which is called by expire_effect. Since expire_effect is now only called for 
-    # *truly* expired effects (and via !leaveroom), the issue should be gone.
+@tasks.loop(seconds=FLUSH_INTERVAL_SECONDS)
+async def flush_dirty_state():
+    """Write-behind flush of every store changed since the last tick."""
+    flush_dirty()
+    if ledger_unwritten:
+        commit_ledger()  # retry a failed append even if nothing new was buffered
+    maybe_compact_ledger()
+    if items_file_changed():
+        # a failed reload must not stop the loop (and with it every flush)
+        try:
+            await reload_item_library()
+        except Exception as e:
+            print(f"[Hedwig] Item library reload failed: {e}")
 
 
-bot.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    try:
+        # Stage 1 before connecting: the first !balance / !daily already sees the economy
+        persistence_writer.submit(load_core_state).result()
+        bot.run(TOKEN)
+    finally:
+        # bot.run() returns once the client has closed (Ctrl+C / SIGTERM included):
+        # make sure nothing buffered is lost.
+        shutdown_persistence()
\ No newline at end of file
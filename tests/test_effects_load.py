@@ -0,0 +1,46 @@
+# tests/test_effects_load.py
+"""Startup staging: a failed read of the effects store is retried, not cached."""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point persistence at a scratch directory *before* importing the bot.
+_SCRATCH = tempfile.mkdtemp(prefix="hedwig-test-")
+os.environ.setdefault("HEDWIG_DATA_DIR", _SCRATCH)
+os.environ.setdefault("HEDWIG_METRICS_PORT", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hedwig_bot as hb  # noqa: E402
+
+
+@pytest.fixture
+def fresh_effects_load(monkeypatch):
+    monkeypatch.setattr(hb, "effects_load_task", None)
+    yield
+    hb.effects_load_task = None
+
+
+def test_failed_effects_load_is_retried(monkeypatch, fresh_effects_load):
+    real_load = hb.storage.load
+    calls = []
+
+    def flaky_load(name):
+        calls.append(name)
+        if len(calls) == 1:
+            raise OSError("disk went away")
+        return real_load(name)
+
+    monkeypatch.setattr(hb.storage, "load", flaky_load)
+
+    async def scenario():
+        with pytest.raises(OSError):
+            await hb.load_saved_effects()
+        assert hb.effects_load_task is None
+        await hb.load_saved_effects()
+        await hb.load_saved_effects()  # shared by later callers, not re-read
+
+    asyncio.run(scenario())
+    assert calls == ["effects", "effects"]